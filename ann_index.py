@@ -0,0 +1,247 @@
+import os
+import math
+import faiss
+import numpy as np
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# "auto" picks from the corpus size; "flat", "ivf" and "hnsw" force a type
+INDEX_TYPE = os.getenv("DEVMATE_INDEX_TYPE", "auto")
+# Product-quantization sub-vectors (0 = store full vectors). Must divide the embedding size.
+INDEX_PQ = int(os.getenv("DEVMATE_INDEX_PQ", "0"))
+# Below FLAT_MAX chunks exact search is fast enough; above HNSW_MAX the graph's RAM cost
+# outweighs its speed and IVF takes over
+FLAT_MAX = int(os.getenv("DEVMATE_FLAT_MAX", "20000"))
+HNSW_MAX = int(os.getenv("DEVMATE_HNSW_MAX", "500000"))
+HNSW_M = 32
+
+# HNSW graphs cannot drop vectors, so deleted ones stay in the graph as tombstones that searches
+# skip; the graph is rebuilt without them once they make up more than this share of it
+TOMBSTONE_MAX_RATIO = float(os.getenv("DEVMATE_TOMBSTONE_MAX_RATIO", "0.2"))
+
+# Query-time recall/latency knobs: IVF lists probed and HNSW candidate list size
+NPROBE = int(os.getenv("DEVMATE_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("DEVMATE_EF_SEARCH", "64"))
+
+def choose_index_type(n_vectors, requested=None):
+    """
+    Returns "flat", "hnsw" or "ivf" for a corpus of n_vectors chunks.
+    """
+    requested = requested or INDEX_TYPE
+    if requested != "auto":
+        return requested
+    if n_vectors < FLAT_MAX:
+        return "flat"
+    if n_vectors < HNSW_MAX:
+        return "hnsw"
+    return "ivf"
+
+def _inner(index):
+    # Flat and HNSW indexes are wrapped in an IndexIDMap that carries the docstore labels
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def describe(index):
+    """
+    Returns the (kind, pq) pair an index was built as.
+    """
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexFlat):
+        return "flat", 0
+    if isinstance(inner, faiss.IndexHNSW):
+        storage = faiss.downcast_index(inner.storage)
+        return "hnsw", storage.pq.M if isinstance(storage, faiss.IndexPQ) else 0
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf = faiss.downcast_index(ivf)
+        return "ivf", ivf.pq.M if isinstance(ivf, faiss.IndexIVFPQ) else 0
+    return "other", 0
+
+def supports_removal(index):
+    """
+    HNSW graphs cannot drop vectors (see TOMBSTONE_MAX_RATIO); flat and IVF indexes remove by label in place.
+    """
+    return describe(index)[0] != "hnsw"
+
+def factory_string(kind, n_vectors, dim, pq=0):
+    """
+    Returns the faiss.index_factory description for the requested index type.
+    Every type stores caller-provided labels: IVF natively, flat and HNSW through IDMap.
+    """
+    if pq and dim % pq != 0:
+        log.warning(f"Ignoring PQ{pq}: it does not divide the embedding size {dim}.")
+        pq = 0
+    if kind == "hnsw":
+        return f"IDMap,HNSW{HNSW_M}_PQ{pq}" if pq else f"IDMap,HNSW{HNSW_M},Flat"
+    if kind == "ivf":
+        # ~4*sqrt(n) lists keeps lists short while leaving enough points to train each centroid
+        nlist = int(min(65536, max(16, 4 * math.sqrt(n_vectors))))
+        nlist = min(nlist, max(1, n_vectors // 39))
+        return f"IVF{nlist},PQ{pq}" if pq else f"IVF{nlist},Flat"
+    return "IDMap,Flat"
+
+def new_index(dim):
+    """
+    Returns the empty exact index ingestion starts from.
+    """
+    return faiss.index_factory(dim, "IDMap,Flat", faiss.METRIC_L2)
+
+def _ivf_positions(index):
+    """
+    Returns (labels, list numbers, offsets) of every vector in an IVF index's inverted lists.
+    """
+    ivf = faiss.extract_index_ivf(index)
+    invlists = ivf.invlists
+    labels, list_nos, offsets = [np.zeros(0, dtype="int64")], [np.zeros(0, dtype="int64")], [np.zeros(0, dtype="int64")]
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = invlists.get_ids(list_no)
+            labels.append(faiss.rev_swig_ptr(ids, size).copy())
+            invlists.release_ids(list_no, ids)
+            list_nos.append(np.full(size, list_no, dtype="int64"))
+            offsets.append(np.arange(size, dtype="int64"))
+    return np.concatenate(labels), np.concatenate(list_nos), np.concatenate(offsets)
+
+def _reconstruct_positions(index, list_nos, offsets):
+    # Decodes straight from the inverted lists: no direct map is set on the index, which
+    # may be the resident one shared by concurrent searches
+    ivf = faiss.extract_index_ivf(index)
+    vectors = np.empty((len(list_nos), index.d), dtype="float32")
+    for row, (list_no, offset) in enumerate(zip(list_nos, offsets)):
+        ivf.reconstruct_from_offset(int(list_no), int(offset), faiss.swig_ptr(vectors[row]))
+    return vectors
+
+def reconstruct_all(index):
+    """
+    Returns (labels, vectors) for every vector in the index, ordered by label.
+    Exact for flat, HNSW and IVF-Flat indexes; approximate for PQ-compressed ones.
+    The index is only read, so this is safe on an index other threads are searching.
+    """
+    if index.ntotal == 0:
+        return np.zeros(0, dtype="int64"), np.zeros((0, index.d), dtype="float32")
+
+    if isinstance(index, faiss.IndexIDMap):
+        labels = faiss.vector_to_array(index.id_map)
+        vectors = _inner(index).reconstruct_n(0, index.ntotal)
+    else:
+        labels, list_nos, offsets = _ivf_positions(index)
+        vectors = _reconstruct_positions(index, list_nos, offsets)
+
+    order = np.argsort(labels)
+    return labels[order], vectors[order]
+
+def sample_vectors(index, n, seed=0):
+    """
+    Returns (labels, vectors) for up to n vectors picked uniformly at random, without
+    reconstructing the rest of the index. Like reconstruct_all, it never modifies the index.
+    """
+    rng = np.random.default_rng(seed)
+    if index.ntotal <= n:
+        return reconstruct_all(index)
+    if isinstance(index, faiss.IndexIDMap):
+        positions = np.sort(rng.choice(index.ntotal, n, replace=False))
+        labels = faiss.vector_to_array(index.id_map)[positions]
+        return labels, _inner(index).reconstruct_batch(positions)
+    labels, list_nos, offsets = _ivf_positions(index)
+    picked = rng.choice(len(labels), n, replace=False)
+    picked = picked[np.argsort(labels[picked])]
+    return labels[picked], _reconstruct_positions(index, list_nos[picked], offsets[picked])
+
+def to_flat(index):
+    """
+    Returns an exact flat index with the same labels and vectors.
+    Used to compact an HNSW index, which cannot remove in place.
+    """
+    if describe(index) == ("flat", 0):
+        return index
+    flat = new_index(index.d)
+    labels, vectors = reconstruct_all(index)
+    flat.add_with_ids(vectors, labels)
+    return flat
+
+def build_index(labels, vectors, kind, pq=0):
+    """
+    Builds, trains if needed, and fills an index of the given kind with labelled `vectors`.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(kind, n_vectors, dim, pq), faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, np.asarray(labels, dtype="int64"))
+    return index
+
+def target_type(index, requested=None, pq=None):
+    """
+    Returns the (kind, pq) pair the index should have for the current corpus size.
+    """
+    pq = INDEX_PQ if pq is None else pq
+    kind = choose_index_type(index.ntotal, requested)
+    # IVF and PQ need enough points to train; small corpora stay exact
+    if kind != "flat" and index.ntotal < 1000:
+        kind, pq = "flat", 0
+    if pq and index.ntotal < 256 * 39:
+        pq = 0
+    return kind, pq if kind != "flat" else 0
+
+def finalize_index(index, requested=None, pq=None):
+    """
+    Converts the working index to the configured type for the current corpus size.
+    Returns the index unchanged when it already has that type.
+    """
+    kind, pq = target_type(index, requested, pq)
+    if describe(index) == (kind, pq):
+        return index
+    log.info(f"Building {kind} index{f' with PQ{pq}' if pq and kind != 'flat' else ''} over {index.ntotal} vectors...")
+    if kind == "flat":
+        return to_flat(index)
+    return build_index(*reconstruct_all(index), kind, pq)
+
+def tune_index(index, nprobe=None, ef_search=None):
+    """
+    Applies the query-time recall/latency parameters to a loaded index.
+    """
+    nprobe = NPROBE if nprobe is None else nprobe
+    ef_search = EF_SEARCH if ef_search is None else ef_search
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    return index
+
+def search_params(index, labels, k, exclude=False):
+    """
+    Returns faiss SearchParameters that restrict a search to `labels` (or, with exclude=True,
+    to every vector except `labels`, e.g. HNSW tombstones).
+    The selector is checked while the index is traversed, so filtered-out vectors never take
+    a slot in the top k. The more selective the filter, the wider HNSW and IVF search, so a
+    narrow scope still finds k neighbours.
+    """
+    labels = np.ascontiguousarray(labels, dtype="int64")
+    selector = faiss.IDSelectorBatch(labels)
+    allowed = len(labels)
+    if exclude:
+        excluded = selector
+        selector = faiss.IDSelectorNot(excluded)
+        # The SWIG wrapper does not keep the wrapped selector alive on its own
+        selector.base_ref = excluded
+        allowed = index.ntotal - len(labels)
+    widen = index.ntotal / max(allowed, 1)
+    inner = _inner(index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if isinstance(inner, faiss.IndexHNSW):
+        ef_search = int(min(max(inner.hnsw.efSearch, k * widen), 4096))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    elif ivf is not None:
+        nprobe = int(min(max(ivf.nprobe, ivf.nprobe * widen), ivf.nlist))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # The SWIG wrapper does not keep the selector alive on its own
+    params.selector_ref = selector
+    return params
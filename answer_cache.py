@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import metrics
+
+# Cosine similarity above which two questions are treated as the same question
+ANSWER_CACHE_THRESHOLD = float(os.getenv("DEVMATE_ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("DEVMATE_ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("DEVMATE_ANSWER_CACHE_MAX", "500"))
+
+class SemanticAnswerCache:
+    """
+    Process-wide cache of answers keyed by the question embedding.
+    Entries are scoped by the asker's profile (role, experience) and by the namespace (project)
+    and index generation they were answered from; when a new generation of a namespace shows
+    up, that namespace's older entries are dropped. Expired entries (TTL) are skipped and the
+    least recently used are evicted.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Live generation per namespace
+        self._generations = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_generation(self, namespace, generation):
+        # Caller holds the lock
+        if self._generations.get(namespace) != generation:
+            stale = [key for key, entry in self._entries.items() if entry["namespace"] == namespace]
+            for key in stale:
+                del self._entries[key]
+            self._generations[namespace] = generation
+
+    def lookup(self, vector, scope, generation, namespace=None):
+        """
+        Returns {"answer", "sources", "similarity"} for the closest cached question in
+        `scope` if it is similar enough, otherwise None.
+        """
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            self._check_generation(namespace, generation)
+            expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+            for key in expired:
+                del self._entries[key]
+
+            candidates = [(key, entry) for key, entry in self._entries.items() if entry["namespace"] == namespace and entry["scope"] == scope]
+            if candidates:
+                matrix = np.vstack([entry["vector"] for _, entry in candidates])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return {"answer": entry["answer"], "sources": entry["sources"], "similarity": float(similarities[best])}
+            self.misses += 1
+            return None
+
+    def store(self, vector, scope, generation, answer, sources, namespace=None):
+        with self._lock:
+            self._check_generation(namespace, generation)
+            self._entries[self._next_id] = {
+                "vector": self._normalize(vector),
+                "namespace": namespace,
+                "scope": scope,
+                "answer": answer,
+                "sources": list(sources),
+                "created": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+answer_cache = SemanticAnswerCache()
+metrics.register_stats("answer_cache", answer_cache.stats)
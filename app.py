@@ -3,6 +3,17 @@ import os
 
 st.set_page_config(page_title="DevMate", layout="wide")
 
+# Bedrock calls from all sessions share one gateway, which queues them fairly per session
+import uuid
+from bedrock_gateway import set_session_id
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+set_session_id(st.session_state.session_id)
+
+# Prometheus /metrics endpoint, only if DEVMATE_METRICS_PORT is set; started once per process
+import metrics
+metrics.start_metrics_server()
+
 # Custom CSS for UI Polish
 st.markdown("""
 <style>
@@ -92,18 +103,107 @@ st.markdown("""
 st.title("🤖 DevMate – Developer Onboarding Assistant")
 st.write("Welcome to DevMate - Your Developer Onboarding Assistant")
 
+def queue_job(kind, payload=None):
+    """
+    Hands a knowledge-base job for the selected project to the background worker; the UI never waits for it.
+    """
+    from ingest_jobs import submit_job
+    job_id = submit_job(kind, {**(payload or {}), "project": project.name})
+    st.session_state.setdefault("job_ids", [])
+    if job_id not in st.session_state.job_ids:
+        st.session_state.job_ids.append(job_id)
+    return job_id
+
+JOB_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+JOB_LABELS = {"ingest": "Index update", "sync": "Repo sync", "quiz_bank": "Quiz bank", "reset": "Hard reset"}
+
+@st.fragment(run_every=2)
+def job_status_panel():
+    """
+    Progress of queued and running jobs plus the outcome of this session's recent ones.
+    Re-renders on its own every 2 seconds without rerunning the rest of the page.
+    """
+    from ingest_jobs import get_queue
+    queue = get_queue()
+    jobs = {job["id"]: job for job in queue.pending()}
+    for job_id in st.session_state.get("job_ids", [])[-3:]:
+        if job_id not in jobs:
+            job = queue.get(job_id)
+            if job:
+                jobs[job_id] = job
+    for job in sorted(jobs.values(), key=lambda job: job["id"]):
+        label = f"{JOB_ICONS.get(job['status'], '')} {JOB_LABELS.get(job['kind'], job['kind'])} #{job['id']} ({job['payload'].get('project', DEFAULT_PROJECT)})"
+        if job["status"] == "running":
+            st.progress(min(max(job["progress"], 0.0), 1.0), text=f"{label}: {job['message']}")
+        else:
+            st.caption(f"{label}: {job['message']}")
+
 # Sidebar for configuration
 with st.sidebar:
+    st.subheader("📁 Project")
+    
+    # Each project has its own documents, repos and index; this session queries the selected one
+    from projects import Project, DEFAULT_PROJECT, list_projects, set_project
+    project_names = list_projects()
+    if st.session_state.get("project") not in project_names:
+        st.session_state.project = DEFAULT_PROJECT
+    selected_project = st.selectbox("Knowledge base", project_names, index=project_names.index(st.session_state.project))
+    if selected_project != st.session_state.project:
+        # The quiz on screen was drawn from the other project
+        st.session_state.pop("quiz_data", None)
+        st.session_state.project = selected_project
+    set_project(st.session_state.project)
+    project = Project(st.session_state.project)
+    
+    with st.expander("➕ New Project"):
+        new_project = st.text_input("Project name", placeholder="payments-api", help="Lowercase letters, digits, '-' and '_'")
+        if st.button("Create", use_container_width=True) and new_project:
+            try:
+                Project(new_project.strip()).create()
+                st.session_state.project = new_project.strip()
+                st.session_state.pop("quiz_data", None)
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+    
+    st.divider()
     st.subheader("👤 Profile")
     role = st.selectbox("Your Role", ["Intern", "Fresher", "Junior Dev", "Senior Dev"])
     exp = st.selectbox("Experience", ["0-1 years", "1-3 years", "3+ years"])
     
+    st.divider()
+    st.subheader("🔎 Search Scope")
+    
+    # Values present in the index; empty until something has been ingested
+    try:
+        from rag import get_facets
+        facets = get_facets()
+    except Exception:
+        facets = {}
+    
+    scope_options = ["Everything", "Uploaded docs", "All repos"] + [f"Repo: {name}" for name in facets.get("repo", [])]
+    scope = st.selectbox("Search in", scope_options)
+    file_types = st.multiselect("File types", facets.get("file_type", []), placeholder="All file types")
+    
+    search_filters = {}
+    if scope == "Uploaded docs":
+        search_filters["origin"] = "upload"
+    elif scope == "All repos":
+        search_filters["origin"] = "repo"
+    elif scope.startswith("Repo: "):
+        search_filters["repo"] = scope[len("Repo: "):]
+    if file_types:
+        search_filters["file_type"] = file_types
+    
+    show_trace = st.checkbox("⏱️ Show request timings", help="Time spent per pipeline stage for each answer")
+    auto_speak = st.checkbox("🔊 Read answers aloud", help="Play every new answer; otherwise use the Listen button under an answer")
+    
     st.divider()
     st.subheader("🧠 Knowledge Base")
     
     # 1. Stats
-    docs_path = "data/docs"
-    repos_path = "data/repos"
+    docs_path = project.docs_dir
+    repos_path = project.repos_dir
     
     total_docs = 0
     doc_files = []
@@ -127,6 +227,14 @@ with st.sidebar:
                 st.caption(f"📄 {f}")
             if os.path.exists(repos_path):
                  st.caption("... plus git repo files")
+            # Written by ingest_docs: files left out by ignore rules, heuristics or size caps
+            report_path = os.path.join(project.index_dir, "ingest_report.json")
+            if os.path.exists(report_path):
+                import json
+                with open(report_path, "r", encoding="utf-8") as f:
+                    skip_counts = json.load(f).get("counts", {})
+                for reason, count in skip_counts.items():
+                    st.caption(f"🚫 {count} skipped: {reason}")
     else:
         st.info("0 Documents Indexed")
     
@@ -144,7 +252,7 @@ with st.sidebar:
         
         if uploaded_files:
             if st.button("✅ Process Files", use_container_width=True):
-                save_path = "data/docs"
+                save_path = project.docs_dir
                 if not os.path.exists(save_path):
                     os.makedirs(save_path)
                     
@@ -161,50 +269,30 @@ with st.sidebar:
                     
                     if count > 0:
                         try:
-                            import ingest_docs as ingest_docs_module
-                            import importlib
-                            importlib.reload(ingest_docs_module)
-                            
-                            ingest_docs_module.ingest_docs()
-                            st.success(f"Added {count} files!")
+                            queue_job("ingest")
+                            st.success(f"Added {count} files! Indexing in the background.")
                         except Exception as e:
                             st.error(f"Ingest failed: {e}")
 
     with ingest_tabs[1]:
         repo_url = st.text_input("Repo URL", placeholder="https://github.com/...", label_visibility="collapsed")
         
-        if st.button("⬇️ Clone Repo", use_container_width=True):
+        if st.button("⬇️ Clone / Update Repo", use_container_width=True):
             if repo_url:
                 try:
-                    import git
-                    import shutil
-                    
-                    repo_name = repo_url.split("/")[-1].replace(".git", "")
-                    clone_path = os.path.join("data", "repos", repo_name)
-                    
-                    if os.path.exists(clone_path):
-                        # Helper to remove read-only files (common in git repos on Windows)
-                        def on_rm_error(func, path, exc_info):
-                            import stat
-                            os.chmod(path, stat.S_IWRITE)
-                            func(path)
-                            
-                        shutil.rmtree(clone_path, onerror=on_rm_error)
-                    
-                    with st.spinner(f"Cloning {repo_name}..."):
-                        git.Repo.clone_from(repo_url, clone_path)
-                        st.success(f"Cloned {repo_name}!")
-                    
-                    with st.spinner("Learning code..."):
-                        import ingest_docs as ingest_docs_module
-                        import importlib
-                        importlib.reload(ingest_docs_module)
-                        
-                        ingest_docs_module.ingest_docs()
-                        st.success("Brain Updated!")
-                        
+                    # Shallow clone the first time, shallow fetch afterwards; runs in the background worker
+                    queue_job("sync", {"url": repo_url})
+                    st.success("Sync queued! Chat keeps working while the repo is indexed.")
                 except Exception as e:
                     st.error(f"Error: {e}")
+        
+        from repo_sync import registered_repos
+        repos = registered_repos(project.repos_dir)
+        if repos:
+            for name, url in repos:
+                st.caption(f"🐙 {name}")
+            if st.button("🔁 Update All Repos", use_container_width=True):
+                queue_job("sync")
 
     # 4. Actions
     st.divider()
@@ -213,40 +301,29 @@ with st.sidebar:
     col_a, col_b = st.columns(2)
     with col_a:
         if st.button("🔄 Refresh", use_container_width=True):
-            with st.spinner("Refreshing..."):
-                try:
-                    import ingest_docs as ingest_docs_module
-                    import importlib
-                    importlib.reload(ingest_docs_module)
-                    
-                    ingest_docs_module.ingest_docs()
-                    st.success("Done!")
-                except Exception as e:
-                    st.error(f"{e}")
+            try:
+                queue_job("ingest")
+            except Exception as e:
+                st.error(f"{e}")
     with col_b:
         if st.button("🗑️ Clear Chat", use_container_width=True):
             st.session_state.messages = []
+            st.session_state.pop("history", None)
+            # Played answers are tracked by position; new answers must not inherit them
+            st.session_state.pop("spoken", None)
             st.rerun()
             
     if st.button("💣 Hard Reset Brain", use_container_width=True, type="primary"):
-        import shutil
-        with st.spinner("Wiping memory..."):
-             if os.path.exists("data"):
-                 def on_rm_error(func, path, exc_info):
-                    import stat
-                    os.chmod(path, stat.S_IWRITE)
-                    func(path)
-                 shutil.rmtree("data", onerror=on_rm_error)
-             if os.path.exists("faiss_index"):
-                 shutil.rmtree("faiss_index")
-             
-             # Recreate empty structure
-             os.makedirs("data/docs", exist_ok=True)
-             os.makedirs("data/repos", exist_ok=True)
-             
-             st.session_state.messages = []
-             st.success("Memory Wiped! Ready for new project.")
-             st.rerun()
+        # Queued like any other write, so it never deletes an index that is being built.
+        # Only the selected project is wiped; other teams' knowledge bases are untouched.
+        queue_job("reset")
+        st.session_state.messages = []
+        st.session_state.pop("history", None)
+        st.session_state.pop("spoken", None)
+        st.success(f"Memory wipe of {project.name} queued!")
+    
+    # 5. Background jobs
+    job_status_panel()
 
 # Main content area
 # Main content area
@@ -263,11 +340,39 @@ with tab1:
     # Container for all chat messages (History + New)
     chat_container = st.container()
 
+    if "spoken" not in st.session_state:
+        st.session_state.spoken = set()
+    
+    def play_answer(index, text, autoplay=False, trace=None):
+        """
+        Renders the audio of an answer. The first sentence gets its own player so it can start
+        while the rest is still being synthesized; cached audio is served without synthesis.
+        """
+        from tts import get_synthesizer, join_audio
+        try:
+            with metrics.span("tts", trace=trace):
+                audio_format, futures = get_synthesizer().speak(text)
+                if not futures:
+                    return
+                st.audio(futures[0].result(), format=audio_format, autoplay=autoplay)
+                if len(futures) > 1:
+                    st.audio(join_audio([future.result() for future in futures[1:]], audio_format), format=audio_format)
+            st.session_state.spoken.add(index)
+        except Exception as e:
+            st.warning(f"Audio generation failed: {e}")
+    
+    def listen_button(index, text):
+        # Audio is only synthesized on request; once played it stays (served from the cache)
+        if index in st.session_state.spoken or st.button("🔊 Listen", key=f"listen_{index}"):
+            play_answer(index, text, autoplay=index not in st.session_state.spoken)
+
     # Display chat messages from history on app rerun
     with chat_container:
-        for message in st.session_state.messages:
+        for i, message in enumerate(st.session_state.messages):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
+                if message["role"] == "assistant":
+                    listen_button(i, message["content"])
         
         # Add a spacer at the bottom so the last message isn't hidden by the floating footer
         st.write("<div style='height: 80px;'></div>", unsafe_allow_html=True)
@@ -344,56 +449,71 @@ with tab1:
             # Add user message to chat history
             st.session_state.messages.append({"role": "user", "content": user_input})
             
-            # Prepare history string for RAG
-            history_str = ""
-            for msg in st.session_state.messages[:-1]: 
-                role_name = "Human" if msg["role"] == "user" else "Assistant"
-                history_str += f"{role_name}: {msg['content']}\n"
+            # Prepare history string for RAG: recent turns verbatim, older ones summarized
+            if "history" not in st.session_state:
+                from chat_history import ConversationHistory
+                from rag import summarize_history
+                st.session_state.history = ConversationHistory(summarize=summarize_history)
+            history_str = st.session_state.history.render(st.session_state.messages[:-1])
 
             with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    try:
-                        from rag import ask_devmate
-                        # Call RAG with history
-                        result = ask_devmate(user_input, role, exp, history_str)
-                        
-                        if isinstance(result, dict):
-                            response_text = result.get("answer", "")
-                            sources = result.get("sources", [])
-                        else:
-                            response_text = str(result)
-                            sources = []
-                        
-                        st.markdown(response_text)
-                        
-                        # specific display for sources
-                        if sources:
-                            with st.expander("📚 Source Documents"):
-                                for source in sources:
-                                    st.caption(f"📄 {source}")
-                                    
-                        # Add assistant response to chat history
-                        st.session_state.messages.append({"role": "assistant", "content": response_text})
+                try:
+                    from rag import ask_devmate_stream
+                    # Call RAG with history; tokens are rendered as they arrive
+                    result = {}
+                    
+                    def answer_tokens():
+                        for event in ask_devmate_stream(user_input, role, exp, history_str, search_filters):
+                            if "token" in event:
+                                yield event["token"]
+                            else:
+                                result.update(event)
+                    
+                    response_text = st.write_stream(answer_tokens())
+                    if not isinstance(response_text, str):
+                        response_text = "".join(str(part) for part in response_text)
+                    sources = result.get("sources", [])
+                    
+                    # specific display for sources
+                    if sources:
+                        with st.expander("📚 Source Documents"):
+                            for source in sources:
+                                st.caption(f"📄 {source}")
+                    if result.get("cached"):
+                        st.caption(f"⚡ Answered from cache in {result['total_time'] * 1000:.0f} ms")
+                    elif result:
+                        st.caption(f"⚡ First token in {result['time_to_first_token']:.2f}s · full answer in {result['total_time']:.2f}s")
+                                
+                    # Add assistant response to chat history
+                    st.session_state.messages.append({"role": "assistant", "content": response_text})
+                    
+                    # Speech is synthesized in the background after the answer is complete,
+                    # and only when asked for
+                    message_index = len(st.session_state.messages) - 1
+                    if auto_speak:
+                        play_answer(message_index, response_text, autoplay=True, trace=result.get("trace"))
+                    else:
+                        listen_button(message_index, response_text)
+                    
+                    # Per-stage timings of this answer
+                    if show_trace and result.get("trace"):
+                        with st.expander("⏱️ Request trace"):
+                            st.dataframe(
+                                [
+                                    {
+                                        "stage": span["name"],
+                                        "start (ms)": round(span["start"] * 1000, 1),
+                                        "duration (ms)": round(span["duration"] * 1000, 1),
+                                        "details": ", ".join(f"{k}={v}" for k, v in span.items() if k not in ("name", "start", "duration")),
+                                    }
+                                    for span in result["trace"].spans
+                                ],
+                                hide_index=True,
+                                use_container_width=True,
+                            )
                         
-                        # Generate and play audio
-                        try:
-                            from gtts import gTTS
-                            from io import BytesIO
-                            
-                            # Create a BytesIO buffer
-                            audio_bytes = BytesIO()
-                            
-                            # Generate speech
-                            tts = gTTS(text=response_text, lang='en')
-                            tts.write_to_fp(audio_bytes)
-                            
-                            # Play audio
-                            st.audio(audio_bytes, format='audio/mp3')
-                        except Exception as e:
-                            st.warning(f"Audio generation failed: {e}")
-                            
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
 
 with tab2:
     st.header("🎮 Knowledge Check")
@@ -403,11 +523,13 @@ with tab2:
         st.session_state.quiz_data = []
 
     if st.button("🎲 Generate New Quiz"):
-        with st.spinner("Creating quiz from documents..."):
-            from rag import generate_quiz
-            st.session_state.quiz_data = generate_quiz()
-            # Clear previous answers
-            st.session_state.quiz_answers = {}
+        # Served from the precomputed quiz bank, so this is instant
+        from rag import generate_quiz
+        st.session_state.quiz_data = generate_quiz()
+        # Clear previous answers
+        st.session_state.quiz_answers = {}
+        if not st.session_state.quiz_data:
+            st.info("The quiz bank is still being prepared from your documents. Try again in a minute!")
             
     if st.session_state.quiz_data:
         if "quiz_answers" not in st.session_state:
@@ -422,13 +544,15 @@ with tab2:
             # Radio button for options
             options = q['options']
             # We need a unique key for each question's radio button
-            user_answer = st.radio(f"Select logic for Q{i+1}", options, label_visibility="collapsed", key=f"q_{i}")
+            user_answer = st.radio(f"Select logic for Q{i+1}", options, label_visibility="collapsed", key=f"q_{q.get('id', i)}")
             
             if user_answer == q['answer']:
                 st.success("Correct! ✅")
                 score += 1
             else:
                 st.write("Pick an answer.")
+            if q.get('source'):
+                st.caption(f"📄 Based on {q['source']}")
                 
         if st.button("Submit Score"):
              st.balloons()
@@ -445,10 +569,28 @@ with tab3:
     
     if st.button("🧐 Explain Code"):
         if code_input.strip():
-            with st.spinner("Analyzing code..."):
-                from rag import explain_code
-                explanation = explain_code(code_input)
-                st.markdown("### Explanation")
-                st.markdown(explanation)
+            from code_explainer import explain_code_stream
+            st.markdown("### Explanation")
+            events = explain_code_stream(code_input)
+            try:
+                # One streamed section per block; cached blocks appear instantly
+                for event in events:
+                    if event.get("block"):
+                        st.markdown(f"#### {event['block']}" + (" ⚡" if event["cached"] else ""))
+                    
+                    sources = []
+                    
+                    def block_tokens():
+                        for block_event in events:
+                            if "sources" in block_event:
+                                sources.extend(block_event["sources"])
+                                return
+                            yield block_event["token"]
+                    
+                    st.write_stream(block_tokens())
+                    if sources:
+                        st.caption("🔗 Related code: " + ", ".join(sources))
+            except Exception as e:
+                st.error(f"Error explaining code: {e}")
         else:
             st.warning("Please paste some code first!")
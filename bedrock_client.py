@@ -1,17 +1,67 @@
 import os
+import threading
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from langchain_aws import ChatBedrockConverse
 from langchain_aws import BedrockEmbeddings
 from dotenv import load_dotenv
+from embedding_cache import CachedEmbeddings
+import metrics
+
+log = metrics.get_logger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+# Process-wide cache: boto3 clients are thread-safe, so one client (and the
+# LangChain wrappers built on it) is shared by every Streamlit session.
+_cache = {}
+_cache_lock = threading.RLock()
+
+def _cached(key, factory):
+    """
+    Returns the cached object for `key`, building it with `factory` on first use.
+    Failed builds (None) are not cached so fixing credentials takes effect without a restart.
+    """
+    value = _cache.get(key)
+    if value is not None:
+        return value
+    with _cache_lock:
+        value = _cache.get(key)
+        if value is None:
+            value = factory()
+            if value is not None:
+                _cache[key] = value
+        return value
+
+def reset_clients():
+    """
+    Drops all cached clients, e.g. after credentials change.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+# Bedrock error codes that mean "slow down" rather than "this request is wrong"
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
+
+def is_throttling_error(error):
+    """
+    Returns True if `error` is Bedrock asking us to back off.
+    LangChain re-raises Bedrock errors as ValueError, so the message is checked as well.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
 def get_bedrock_client():
     """
     Returns a configured Bedrock client for usage with LangChain or direct Boto3 calls.
-    Ensures credentials are loaded.
+    Ensures credentials are loaded. The client is created once per process.
     """
+    return _cached("client", _create_bedrock_client)
+
+def _create_bedrock_client():
     try:
         # Check for credentials
         if not os.getenv("AWS_ACCESS_KEY_ID") or not os.getenv("AWS_SECRET_ACCESS_KEY"):
@@ -21,10 +71,12 @@ def get_bedrock_client():
             service_name='bedrock-runtime',
             region_name=os.getenv("AWS_REGION", "us-east-1"),
             aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            # The shared client serves concurrent sessions and embedding workers
+            config=Config(max_pool_connections=int(os.getenv("DEVMATE_MAX_POOL_CONNECTIONS", "32")))
         )
     except Exception as e:
-        print(f"Error initializing Bedrock client: {e}")
+        log.error(f"Error initializing Bedrock client: {e}")
         return None
 
 def get_llm():
@@ -33,6 +85,9 @@ def get_llm():
     Uses 'amazon.nova-lite-v1:0' by default.
     Using Converse API is required for Nova models.
     """
+    return _cached("llm", _create_llm)
+
+def _create_llm():
     model_id = os.getenv("BEDROCK_MODEL_ID", "amazon.nova-lite-v1:0")
     
     client = get_bedrock_client()
@@ -51,13 +106,26 @@ def get_llm():
 def get_embeddings():
     """
     Returns the BedrockEmbeddings model for vectorization.
-    Uses 'amazon.titan-embed-text-v1'.
+    Uses 'amazon.titan-embed-text-v1', wrapped in a persistent embedding cache.
     """
+    return _cached("embeddings", _create_embeddings)
+
+def _create_embeddings():
     client = get_bedrock_client()
     if not client:
         return None
         
-    return BedrockEmbeddings(
+    model_id = "amazon.titan-embed-text-v1"
+    embeddings = BedrockEmbeddings(
         client=client,
-        model_id="amazon.titan-embed-text-v1"
+        model_id=model_id
     )
+
+    try:
+        cached = CachedEmbeddings(embeddings, model_id)
+        metrics.register_stats("embedding_cache", cached.stats)
+        return cached
+    except Exception as e:
+        # A broken cache must never take embeddings down with it
+        log.warning(f"Embedding cache unavailable, using Bedrock directly: {e}")
+        return embeddings
@@ -0,0 +1,279 @@
+import os
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from bedrock_client import get_llm, get_embeddings, is_throttling_error
+from embedding_pipeline import AdaptiveBackoff
+import metrics
+
+log = metrics.get_logger("gateway")
+
+# Bedrock calls in flight at once across every session of this process
+GATEWAY_CONCURRENCY = int(os.getenv("DEVMATE_BEDROCK_CONCURRENCY", "4"))
+GATEWAY_MAX_RETRIES = int(os.getenv("DEVMATE_BEDROCK_MAX_RETRIES", "5"))
+
+# Set by app.py at the start of every script run; Streamlit runs each session in its own thread
+_session_id = contextvars.ContextVar("devmate_session_id", default="default")
+
+def set_session_id(session_id):
+    _session_id.set(session_id)
+
+def current_session_id():
+    return _session_id.get()
+
+def record_usage(message):
+    """
+    Counts the input/output tokens Bedrock reports on a response (or on the last chunk of
+    a stream). Returns the usage dict, or None if the message carries none.
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    for kind in ("input", "output"):
+        metrics.inc("devmate_llm_tokens_total", usage.get(f"{kind}_tokens", 0), help="LLM tokens reported by Bedrock", type=kind)
+    return usage
+
+class FairSemaphore:
+    """
+    Counting semaphore that hands free slots to waiting sessions in round-robin order,
+    so one session firing many requests cannot starve the others.
+    Within a session, requests are served first come, first served.
+    """
+
+    def __init__(self, slots):
+        self._free = max(1, slots)
+        self._lock = threading.Lock()
+        # session_id -> waiting Events, in the order sessions get their next turn
+        self._queues = OrderedDict()
+
+    def acquire(self, session_id):
+        with self._lock:
+            if self._free > 0 and not self._queues:
+                self._free -= 1
+                return
+            turn = threading.Event()
+            self._queues.setdefault(session_id, deque()).append(turn)
+        turn.wait()
+
+    def release(self):
+        with self._lock:
+            if not self._queues:
+                self._free += 1
+                return
+            # The slot passes straight to the next session; it moves to the back of the line
+            session_id, queue = self._queues.popitem(last=False)
+            turn = queue.popleft()
+            if queue:
+                self._queues[session_id] = queue
+            turn.set()
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+class SharedStream:
+    """
+    Chunks of one upstream LLM stream, buffered so that any number of readers can each
+    iterate over the whole stream at their own pace, including readers that join late.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = threading.Condition()
+
+    def put(self, chunk):
+        with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    def __iter__(self):
+        position = 0
+        while True:
+            with self._changed:
+                while position >= len(self.chunks) and not self.done:
+                    self._changed.wait()
+                if position < len(self.chunks):
+                    chunk = self.chunks[position]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            position += 1
+            yield chunk
+
+class BedrockGateway:
+    """
+    Single entry point for the Bedrock calls made while serving users.
+    Every call takes a slot of a process-wide fair semaphore, throttling errors are retried
+    with a shared jittered backoff (one throttled call slows every session down a little
+    instead of all of them retrying at once), and identical requests that are already in
+    flight are answered by the same upstream call.
+    """
+
+    def __init__(self, concurrency=GATEWAY_CONCURRENCY, max_retries=GATEWAY_MAX_RETRIES):
+        self.max_retries = max_retries
+        self._slots = FairSemaphore(concurrency)
+        self._backoff = AdaptiveBackoff()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    def _attempts(self, session_id):
+        """
+        Yields (attempt, is_last) after waiting out the shared backoff and taking a slot;
+        the caller must release the slot when done with each attempt.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._backoff.wait()
+            self._slots.acquire(session_id)
+            yield attempt, attempt == self.max_retries
+
+    def _throttled(self, attempt):
+        self._backoff.throttled()
+        with self._lock:
+            self.retries += 1
+        metrics.inc("devmate_bedrock_throttled_total", help="Bedrock calls retried after throttling")
+        metrics.log_event(log, "bedrock throttled", level=logging.WARNING, backoff=round(self._backoff.delay, 2), attempt=attempt + 1)
+
+    def _call(self, func, session_id):
+        with self._lock:
+            self.calls += 1
+        for attempt, is_last in self._attempts(session_id):
+            try:
+                result = func()
+                self._backoff.succeeded()
+                return result
+            except Exception as e:
+                if not is_throttling_error(e) or is_last:
+                    raise
+                self._throttled(attempt)
+            finally:
+                self._slots.release()
+
+    def _coalesced(self, key, func, session_id):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._call(func, session_id))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+    def invoke(self, prompt, session_id=None):
+        """
+        Returns the LLM response message for `prompt`.
+        """
+        llm = get_llm()
+        if not llm:
+            raise RuntimeError("LLM not initialized. Check your AWS credentials.")
+        with metrics.span("llm_invoke") as span:
+            response = self._coalesced(("invoke", prompt), lambda: llm.invoke(prompt), session_id or current_session_id())
+            span.update(record_usage(response) or {})
+        return response
+
+    def embed_query(self, text, session_id=None):
+        """
+        Returns the embedding of a search query.
+        """
+        embeddings = get_embeddings()
+        if not embeddings:
+            raise RuntimeError("Embeddings not initialized. Check your AWS credentials.")
+        with metrics.span("embed_query"):
+            return self._coalesced(("embed", text), lambda: embeddings.embed_query(text), session_id or current_session_id())
+
+    def stream(self, prompt, session_id=None, shared=False):
+        """
+        Yields LLM response chunks for `prompt`. The slot is held until the stream ends.
+        Streams are only retried if throttled before the first chunk.
+        With shared=True, identical prompts streaming at the same time share one upstream
+        call: it runs in a background thread and every caller reads its chunks from the
+        start. Only use it where the whole stream is read, since the call runs to the end
+        even if every reader stops early.
+        """
+        llm = get_llm()
+        if not llm:
+            raise RuntimeError("LLM not initialized. Check your AWS credentials.")
+        session_id = session_id or current_session_id()
+        if not shared:
+            yield from self._stream(llm, prompt, session_id)
+            return
+
+        key = ("stream", prompt)
+        with self._lock:
+            stream = self._inflight.get(key)
+            leader = stream is None
+            if leader:
+                stream = SharedStream()
+                self._inflight[key] = stream
+            else:
+                self.coalesced += 1
+        if leader:
+            threading.Thread(target=self._pump, args=(key, stream, llm, prompt, session_id), name="devmate-stream", daemon=True).start()
+        yield from stream
+
+    def _pump(self, key, stream, llm, prompt, session_id):
+        try:
+            for chunk in self._stream(llm, prompt, session_id):
+                stream.put(chunk)
+            stream.finish()
+        except Exception as e:
+            stream.finish(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _stream(self, llm, prompt, session_id):
+        with self._lock:
+            self.calls += 1
+        for attempt, is_last in self._attempts(session_id):
+            started = False
+            try:
+                for chunk in llm.stream(prompt):
+                    started = True
+                    record_usage(chunk)
+                    yield chunk
+                self._backoff.succeeded()
+                return
+            except Exception as e:
+                if started or not is_throttling_error(e) or is_last:
+                    raise
+                self._throttled(attempt)
+            finally:
+                self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "retries": self.retries,
+                "in_flight": len(self._inflight),
+                "waiting": self._slots.waiting(),
+            }
+
+gateway = BedrockGateway()
+metrics.register_stats("gateway", gateway.stats)
@@ -0,0 +1,85 @@
+import os
+import random
+
+# (uploaded docs, repo source files) per scale
+SCALES = {
+    "small": (20, 20),
+    "medium": (200, 200),
+    "large": (2000, 1000),
+}
+# Paragraphs of filler per document, around one sentence of signal each
+DOC_PARAGRAPHS = 6
+FUNCTIONS_PER_FILE = 6
+
+_FILLER = (
+    "service deployment request cache queue worker config database schema migration token "
+    "session user account billing invoice report dashboard metric alert log trace retry "
+    "timeout payload endpoint handler client server cluster node replica shard backup "
+    "storage bucket object upload download stream batch job scheduler pipeline build test "
+    "release branch review merge commit rollback feature flag permission role team onboarding"
+).split()
+_SYLLABLES = ["ka", "lo", "mi", "ren", "tor", "vex", "zu", "quo", "bri", "dal", "nim", "sar", "tek", "vol", "xan", "yor"]
+_STORES = ["PostgreSQL", "Redis", "S3", "DynamoDB", "SQLite", "Elasticsearch", "Kafka", "MongoDB"]
+_VERBS = ["load", "parse", "validate", "render", "sync", "publish", "resolve", "score"]
+
+def _codename(rng, used):
+    while True:
+        name = "".join(rng.choice(_SYLLABLES) for _ in range(3))
+        if name not in used:
+            used.add(name)
+            return name
+
+def _sentence(rng, words=14):
+    return " ".join(rng.choice(_FILLER) for _ in range(words)).capitalize() + "."
+
+def _document(rng, codename, port, store):
+    paragraphs = [" ".join(_sentence(rng) for _ in range(4)) for _ in range(DOC_PARAGRAPHS)]
+    fact = f"The {codename} service keeps its state in {store} and listens on port {port}."
+    paragraphs.insert(rng.randrange(len(paragraphs) + 1), fact)
+    return f"# {codename.capitalize()} service\n\n" + "\n\n".join(paragraphs) + "\n"
+
+def _module(rng, codename, index):
+    functions = []
+    target = rng.randrange(FUNCTIONS_PER_FILE)
+    for i in range(FUNCTIONS_PER_FILE):
+        noun = rng.choice(_FILLER)
+        name = f"{rng.choice(_VERBS)}_{noun}_{index}_{i}"
+        doc = f"Handles {codename} webhook deliveries." if i == target else _sentence(rng, 8)
+        body = "\n".join(f"    {rng.choice(_FILLER)}_{j} = {rng.choice(_FILLER)}.get({j!r})" for j in range(rng.randint(3, 8)))
+        functions.append(f'def {name}(payload):\n    """{doc}"""\n{body}\n    return payload\n')
+    return "import json\n\n\n" + "\n\n".join(functions)
+
+def generate(root, scale, seed=0):
+    """
+    Writes a synthetic corpus under root/data (uploaded markdown docs and one repo of Python
+    modules) and returns the labeled questions: [{"question", "expected"}], where `expected`
+    is the file name retrieval has to surface. Every file carries exactly one fact with a
+    unique code name, so each question has exactly one right source.
+    """
+    doc_count, file_count = SCALES[scale]
+    rng = random.Random(seed)
+    used = set()
+    questions = []
+
+    docs_dir = os.path.join(root, "data", "docs")
+    repo_dir = os.path.join(root, "data", "repos", "synthetic", "src")
+    os.makedirs(docs_dir, exist_ok=True)
+    os.makedirs(repo_dir, exist_ok=True)
+
+    for i in range(doc_count):
+        codename = _codename(rng, used)
+        port = rng.randint(1024, 65535)
+        name = f"{codename}_service.md"
+        with open(os.path.join(docs_dir, name), "w", encoding="utf-8") as f:
+            f.write(_document(rng, codename, port, rng.choice(_STORES)))
+        questions.append({"question": f"Which port does the {codename} service listen on?", "expected": name})
+
+    for i in range(file_count):
+        codename = _codename(rng, used)
+        name = f"module_{i}.py"
+        with open(os.path.join(repo_dir, name), "w", encoding="utf-8") as f:
+            f.write(_module(rng, codename, i))
+        questions.append({"question": f"Which function handles {codename} webhook deliveries?", "expected": name})
+
+    rng.shuffle(questions)
+    return questions
@@ -0,0 +1,96 @@
+import re
+import time
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic local stand-in for Titan embeddings: a feature-hashed bag of words,
+    L2-normalized. Texts sharing words get similar vectors, so retrieval quality can be
+    measured without a real model. Every call sleeps `latency` plus `per_text` per text
+    to mimic the network.
+    """
+
+    def __init__(self, dim=256, latency=0.0, per_text=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_text = per_text
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            digest = zlib.crc32(word.encode("utf-8"))
+            # A hashed sign lets colliding words cancel out instead of piling up (feature hashing)
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _sleep(self, count):
+        self.calls += 1
+        delay = self.latency + self.per_text * count
+        if delay > 0:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        self._sleep(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._sleep(1)
+        return self._vector(text)
+
+class FakeLLM:
+    """
+    Canned stand-in for ChatBedrockConverse with the invoke()/stream() calls the app uses.
+    The reply quotes the start of the prompt's context, so answers vary with retrieval.
+    `first_token` is the delay before the first chunk, `per_token` the delay between chunks.
+    Usage metadata is reported like Bedrock does, on the last streamed chunk.
+    """
+
+    def __init__(self, first_token=0.0, per_token=0.0, tokens=40):
+        self.first_token = first_token
+        self.per_token = per_token
+        self.tokens = tokens
+        self.calls = 0
+
+    def _words(self, prompt):
+        context = prompt.split("Context:", 1)[-1]
+        words = _WORD.findall(context)[:self.tokens]
+        return ["Based", "on", "the", "docs:"] + words
+
+    def _usage(self, prompt, words):
+        input_tokens = len(prompt) // 4
+        return {"input_tokens": input_tokens, "output_tokens": len(words), "total_tokens": input_tokens + len(words)}
+
+    def invoke(self, prompt):
+        self.calls += 1
+        words = self._words(prompt)
+        time.sleep(self.first_token + self.per_token * len(words))
+        return AIMessage(content=" ".join(words), usage_metadata=self._usage(prompt, words))
+
+    def stream(self, prompt):
+        self.calls += 1
+        words = self._words(prompt)
+        time.sleep(self.first_token)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.per_token)
+            last = i == len(words) - 1
+            yield AIMessageChunk(content=word + " ", usage_metadata=self._usage(prompt, words) if last else None)
+
+def install(llm, embeddings):
+    """
+    Makes bedrock_client.get_llm() and get_embeddings() return the fakes in this process.
+    Every module calls those through bedrock_client's client cache, so filling the cache
+    covers the names they imported too. No AWS credentials are needed afterwards.
+    """
+    import bedrock_client
+    bedrock_client.reset_clients()
+    bedrock_client._cache["client"] = object()
+    bedrock_client._cache["llm"] = llm
+    bedrock_client._cache["embeddings"] = embeddings
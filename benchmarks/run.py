@@ -0,0 +1,231 @@
+"""
+Offline benchmark for ingestion and question answering, with Bedrock replaced by local fakes.
+
+    python -m benchmarks.run --scales small,medium
+    python -m benchmarks.run --scales small --compare 1a2b3c4
+
+Every scale runs in its own process and temporary directory (fresh data/, faiss_index/ and
+.cache/), so peak RSS and caches are not shared between scales. Results are written to
+benchmarks/results/<commit>.json (with a -dirty suffix for uncommitted trees), so runs on
+different commits can be compared with --compare.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+# rag.prepare_answer retrieves this many chunks per question
+RECALL_K = 3
+# Metrics where a higher value is better, for the comparison arrows
+HIGHER_IS_BETTER = ("ingest_chunks_per_second", "recall_at_3", "questions_per_second")
+
+def _peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def _percentiles(values):
+    import numpy as np
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50) * 1000, 2),
+        "p95_ms": round(float(p95) * 1000, 2),
+        "p99_ms": round(float(p99) * 1000, 2),
+        "mean_ms": round(float(np.mean(values)) * 1000, 2),
+    }
+
+def run_scale(scale, args):
+    """
+    Benchmarks one corpus scale in the current process and returns the results dict.
+    Meant for a fresh process: it changes the working directory and installs the fakes.
+    """
+    workspace = tempfile.mkdtemp(prefix=f"devmate-bench-{scale}-")
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workspace)
+    try:
+        from benchmarks import corpus, fakes
+        questions = corpus.generate(workspace, scale, seed=args.seed)[:args.questions]
+
+        embeddings = fakes.HashEmbeddings(dim=args.dim, latency=args.embed_latency / 1000, per_text=args.embed_per_text / 1000)
+        llm = fakes.FakeLLM(first_token=args.llm_first_token / 1000, per_token=args.llm_per_token / 1000)
+        fakes.install(llm, embeddings)
+
+        import metrics
+        import ingest_docs
+        import rag
+        from answer_cache import answer_cache
+        from bedrock_gateway import set_session_id
+        from kb_store import current_generation, generation_dir
+
+        # --- Ingestion ---
+        started = time.perf_counter()
+        ingest_docs.ingest_docs()
+        ingest_seconds = time.perf_counter() - started
+        index_dir = generation_dir(ingest_docs.FAISS_INDEX_DIR, current_generation(ingest_docs.FAISS_INDEX_DIR))
+        with rag.use_index(embeddings) as (_, knowledge_base, _):
+            chunks = knowledge_base.ntotal
+        files = sum(len(names) for _, _, names in os.walk(ingest_docs.DATA_DIR))
+        ingest_rss = _peak_rss_mb()
+
+        # --- Questions ---
+        # Every question has to run the whole pipeline; the templated questions are close
+        # enough that the semantic answer cache would otherwise answer most of them
+        answer_cache.threshold = float("inf")
+
+        def ask(item):
+            set_session_id(f"bench-{item['question']}")
+            started = time.perf_counter()
+            result = rag.ask_devmate(item["question"], "Junior Dev", "0-1 years")
+            elapsed = time.perf_counter() - started
+            found = any(source.startswith(item["expected"]) for source in result["sources"])
+            return elapsed, found, result["answer"].startswith("Error")
+
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            started = time.perf_counter()
+            outcomes = list(executor.map(ask, questions))
+            wall = time.perf_counter() - started
+
+        stages = {}
+        for key, histogram in metrics.registry.snapshot()["histograms"].get("devmate_stage_seconds", {}).items():
+            stages[dict(key)["stage"]] = round(histogram["sum"] / histogram["count"] * 1000, 3)
+
+        return {
+            "files": files,
+            "chunks": chunks,
+            "ingest_seconds": round(ingest_seconds, 3),
+            "ingest_chunks_per_second": round(chunks / ingest_seconds, 1),
+            "index_bytes": _directory_size(index_dir),
+            "peak_rss_mb_after_ingest": ingest_rss,
+            "peak_rss_mb": _peak_rss_mb(),
+            # The loader processes that parse files during ingestion
+            "peak_child_rss_mb": _peak_rss_mb(children=True),
+            "questions": len(questions),
+            "errors": sum(1 for _, _, error in outcomes if error),
+            f"recall_at_{RECALL_K}": round(sum(1 for _, found, _ in outcomes if found) / len(questions), 4) if questions else None,
+            "ask_latency": _percentiles([elapsed for elapsed, _, _ in outcomes]),
+            "questions_per_second": round(len(questions) / wall, 2) if wall else None,
+            "mean_stage_ms": dict(sorted(stages.items())),
+        }
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+def _git(*command):
+    try:
+        return subprocess.run(["git", *command], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def commit_label():
+    """
+    Returns the short commit hash, with "-dirty" if the tree has uncommitted changes.
+    """
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    if _git("status", "--porcelain", "--untracked-files=no"):
+        commit += "-dirty"
+    return commit
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def load_results(ref):
+    """
+    Loads the stored results of a commit (full or short hash, optionally with -dirty).
+    """
+    labels = [name[:-len(".json")] for name in os.listdir(RESULTS_DIR) if name.endswith(".json")] if os.path.isdir(RESULTS_DIR) else []
+    # Exact label first, then a clean run of the commit before a dirty one
+    matches = sorted(
+        (label for label in labels if label.startswith(ref) or ref.startswith(label.replace("-dirty", ""))),
+        key=lambda label: (label != ref, label.endswith("-dirty"))
+    )
+    if matches:
+        with open(os.path.join(RESULTS_DIR, matches[0] + ".json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    raise SystemExit(f"No stored benchmark results for {ref} in {RESULTS_DIR}")
+
+def print_report(record, baseline=None):
+    for scale, results in record["results"].items():
+        print(f"\n== {scale} ==")
+        flat = _flatten(results)
+        old = _flatten(baseline["results"].get(scale, {})) if baseline else {}
+        for key, value in flat.items():
+            line = f"  {key:<40} {value:>12}"
+            if key in old and old[key]:
+                change = (value - old[key]) / abs(old[key]) * 100
+                better = (change > 0) == (key in HIGHER_IS_BETTER or key.startswith("recall"))
+                line += f"   {old[key]:>12} ({change:+.1f}%{'' if abs(change) < 1 else ' better' if better else ' worse'})"
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline DevMate benchmark with a local Bedrock stand-in.")
+    parser.add_argument("--scales", default="small", help="Comma-separated corpus scales: small, medium, large")
+    parser.add_argument("--questions", type=int, default=200, help="Labeled questions asked per scale (at most)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Questions asked in parallel, one session each")
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding size")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Fake embedding call latency (ms)")
+    parser.add_argument("--embed-per-text", type=float, default=0.0, help="Extra fake embedding latency per text (ms)")
+    parser.add_argument("--llm-first-token", type=float, default=0.0, help="Fake LLM time to first token (ms)")
+    parser.add_argument("--llm-per-token", type=float, default=0.0, help="Fake LLM delay between tokens (ms)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help="Commit whose stored results to compare against")
+    parser.add_argument("--no-save", action="store_true", help="Do not store the results")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Child process: one scale, results as JSON on the last line of stdout
+        print(json.dumps(run_scale(args.worker, args)))
+        return
+
+    from benchmarks.corpus import SCALES
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("scales", "compare", "no_save", "worker")}
+    record = {"commit": commit_label(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": settings, "results": {}}
+    forwarded = [part for key, value in settings.items() for part in (f"--{key.replace('_', '-')}", str(value))]
+    for scale in scales:
+        print(f"Benchmarking {scale} corpus...", flush=True)
+        command = [sys.executable, "-m", "benchmarks.run", *forwarded, "--worker", scale]
+        completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            raise SystemExit(f"Benchmark of the {scale} corpus failed")
+        record["results"][scale] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    baseline = load_results(args.compare) if args.compare else None
+    print_report(record, baseline)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{record['commit']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        print(f"\nSaved to {os.path.relpath(path, REPO_ROOT)}")
+
+if __name__ == "__main__":
+    main()
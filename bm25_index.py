@@ -0,0 +1,223 @@
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from kb_store import connect_readonly
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Postings read per query term, best impact first; lower-impact ones cannot reach the top k
+BM25_TERM_DEPTH = 1000
+# Impacts depend on the average chunk length; they are all recomputed once it drifts this much
+BM25_IMPACT_DRIFT = 0.05
+# Filters selecting at most this many chunks are looked up directly instead of scanned for
+BM25_ALLOWED_LOOKUP = 500
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "do", "does", "for", "from", "how", "i",
+    "if", "in", "is", "it", "of", "on", "or", "the", "this", "to", "what", "where", "which",
+    "who", "why", "with", "can", "we", "you",
+}
+
+def tokenize(text):
+    """
+    Splits text into lowercase terms. Identifiers are kept whole and also split on
+    snake_case and camelCase boundaries, so `getUserById` matches "user" and "getuserbyid".
+    """
+    terms = []
+    for word in _WORD.findall(text):
+        lower = word.lower()
+        if lower not in STOPWORDS and len(lower) > 1:
+            terms.append(lower)
+        parts = [p.lower() for piece in word.split("_") for p in _CAMEL.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(p for p in parts if len(p) > 1 and p not in STOPWORDS)
+    return terms
+
+class BM25Index:
+    """
+    Sparse inverted index persisted in SQLite next to the FAISS index.
+    Postings are read per query term, so opening the index is instant and memory use does
+    not grow with the corpus; chunks are added and removed by their chunk ID.
+    Each posting stores its BM25 impact (the score without the idf factor), indexed per term,
+    so a search reads only the best BM25_TERM_DEPTH postings of every term.
+    With readonly=True (a published generation) the file is opened immutable and only
+    searched; the schema is created by the ingest that writes it.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self._lock = threading.Lock()
+        if readonly:
+            self._conn = connect_readonly(path)
+            self._impacts = self._has_impacts()
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Written in a private working directory; a rollback journal leaves no files behind
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+            CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value REAL NOT NULL);
+        """)
+        if not self._has_impacts():
+            # Indexes written before impacts were stored get them computed on the next commit
+            self._conn.execute("ALTER TABLE postings ADD COLUMN impact REAL")
+            self._conn.execute("DELETE FROM stats WHERE key = 'impact_avg_length'")
+        self._conn.executescript("""
+            DROP INDEX IF EXISTS postings_term;
+            CREATE INDEX IF NOT EXISTS postings_impact ON postings (term, impact DESC);
+        """)
+        self._conn.commit()
+        self._impacts = True
+
+    def _has_impacts(self):
+        return any(row[1] == "impact" for row in self._conn.execute("PRAGMA table_info(postings)"))
+
+    def _stat(self, key):
+        row = self._conn.execute("SELECT value FROM stats WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_stat(self, key, delta):
+        self._conn.execute(
+            "INSERT INTO stats (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+            (key, delta)
+        )
+
+    def doc_count(self):
+        with self._lock:
+            return int(self._stat("doc_count"))
+
+    def add(self, chunk_ids, texts):
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                self._conn.execute("INSERT OR IGNORE INTO docs (chunk_id, length) VALUES (?, ?)", (chunk_id, length))
+                if self._conn.execute("SELECT changes()").fetchone()[0] == 0:
+                    continue
+                self._conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in counts.items()]
+                )
+                self._conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in counts]
+                )
+                self._bump_stat("doc_count", 1)
+                self._bump_stat("total_length", length)
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                row = self._conn.execute("SELECT length FROM docs WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if not row:
+                    continue
+                terms = [t for (t,) in self._conn.execute("SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,))]
+                self._conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", [(t,) for t in terms])
+                self._conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+                self._conn.execute("DELETE FROM docs WHERE chunk_id = ?", (chunk_id,))
+                self._bump_stat("doc_count", -1)
+                self._bump_stat("total_length", -row[0])
+            self._conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def clear(self):
+        with self._lock:
+            for table in ("docs", "terms", "postings", "stats"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def _update_impacts(self):
+        """
+        Fills in the impact of new postings. Impacts are computed against a reference average
+        length; when the corpus has drifted away from it, every posting is recomputed.
+        """
+        n_docs = self._stat("doc_count")
+        if n_docs <= 0:
+            return
+        avg_length = self._stat("total_length") / n_docs
+        reference = self._stat("impact_avg_length")
+        where = " WHERE impact IS NULL"
+        if not reference or abs(avg_length - reference) > BM25_IMPACT_DRIFT * reference:
+            reference, where = avg_length, ""
+            self._conn.execute(
+                "INSERT INTO stats (key, value) VALUES ('impact_avg_length', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (reference,)
+            )
+        self._conn.execute(
+            "UPDATE postings SET impact = tf * ? / (tf + ? * (1 - ? + ? * "
+            "(SELECT length FROM docs WHERE docs.chunk_id = postings.chunk_id) / ?))" + where,
+            (BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, reference)
+        )
+
+    def commit(self):
+        with self._lock:
+            self._update_impacts()
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _postings(self, term, avg_length, allowed_ids):
+        """
+        Returns [(chunk_id, impact)] for the best postings of `term`, best first.
+        """
+        depth = BM25_TERM_DEPTH
+        if self._impacts:
+            select = "SELECT p.chunk_id, p.impact FROM postings p WHERE p.term = ?"
+            params = [term]
+        else:
+            # Written before impacts were stored: computed per query until the next ingest
+            select = (
+                "SELECT p.chunk_id, p.tf * ? / (p.tf + ? * (1 - ? + ? * d.length / ?)) AS impact "
+                "FROM postings p JOIN docs d ON d.chunk_id = p.chunk_id WHERE p.term = ?"
+            )
+            params = [BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, avg_length, term]
+        if allowed_ids is not None and len(allowed_ids) <= BM25_ALLOWED_LOOKUP:
+            ids = list(allowed_ids)
+            if not ids:
+                return []
+            return self._conn.execute(
+                f"{select} AND p.chunk_id IN ({','.join('?' * len(ids))}) ORDER BY impact DESC LIMIT ?",
+                (*params, *ids, depth)
+            ).fetchall()
+        if allowed_ids is None:
+            return self._conn.execute(f"{select} ORDER BY impact DESC LIMIT ?", (*params, depth)).fetchall()
+        # A broad filter: walk the postings in impact order until enough of them are allowed
+        postings = []
+        for chunk_id, impact in self._conn.execute(f"{select} ORDER BY impact DESC", params):
+            if chunk_id in allowed_ids:
+                postings.append((chunk_id, impact))
+                if len(postings) >= depth:
+                    break
+        return postings
+
+    def search(self, query, k=10, allowed_ids=None):
+        """
+        Returns up to k (chunk_id, score) pairs ranked by BM25.
+        If allowed_ids is given, only those chunks are scored.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = self._stat("doc_count")
+            if n_docs <= 0:
+                return []
+            avg_length = self._stat("total_length") / n_docs
+            scores = {}
+            for term in terms:
+                row = self._conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if not row:
+                    continue
+                df = row[0]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, impact in self._postings(term, avg_length, allowed_ids):
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * impact
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
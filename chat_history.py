@@ -0,0 +1,101 @@
+import os
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# Most recent turns (one question + one answer each) kept word for word in the prompt
+HISTORY_TURNS = int(os.getenv("DEVMATE_HISTORY_TURNS", "3"))
+# Token budget for the whole "Previous Conversation" section
+HISTORY_TOKEN_BUDGET = int(os.getenv("DEVMATE_HISTORY_TOKENS", "1200"))
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate (~4 characters per token for English and code).
+    """
+    return (len(text) + 3) // 4
+
+def format_messages(messages):
+    lines = []
+    for msg in messages:
+        role_name = "Human" if msg["role"] == "user" else "Assistant"
+        lines.append(f"{role_name}: {msg['content']}")
+    return "\n".join(lines)
+
+def _clip(text, max_tokens):
+    """
+    Keeps the end of `text` within max_tokens; the most recent part matters most.
+    """
+    max_chars = max(max_tokens, 0) * 4
+    if len(text) <= max_chars:
+        return text
+    return "..." + text[len(text) - max_chars + 3:]
+
+def _fallback_summary(summary, messages):
+    # Used when the LLM is unavailable: keep the gist of each message, newest last
+    lines = [summary] if summary else []
+    for msg in messages:
+        role_name = "Human" if msg["role"] == "user" else "Assistant"
+        content = " ".join(msg["content"].split())
+        lines.append(f"{role_name}: {content[:200]}")
+    return "\n".join(lines)
+
+class ConversationHistory:
+    """
+    Builds the history section of the chat prompt within a token budget.
+    The last few turns are kept verbatim; older messages are folded into a running summary
+    exactly once, when they leave the verbatim window, so each turn costs at most one small
+    summarization call instead of resending the whole conversation.
+    """
+
+    def __init__(self, keep_turns=HISTORY_TURNS, token_budget=HISTORY_TOKEN_BUDGET, summarize=None):
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary = ""
+        # Number of leading messages already folded into the summary
+        self.summarized_count = 0
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_count = 0
+
+    def _fold(self, messages):
+        if not messages:
+            return
+        summary = None
+        if self.summarize:
+            try:
+                summary = self.summarize(self.summary, format_messages(messages))
+            except Exception as e:
+                log.warning(f"History summarization failed: {e}")
+        self.summary = summary.strip() if summary else _fallback_summary(self.summary, messages)
+
+    def render(self, messages):
+        """
+        Returns the history text for `messages` (all earlier messages, oldest first).
+        """
+        if len(messages) < self.summarized_count:
+            # The chat was cleared
+            self.reset()
+
+        window_start = max(self.summarized_count, len(messages) - self.keep_turns * 2)
+        self._fold(messages[self.summarized_count:window_start])
+        self.summarized_count = window_start
+        recent = list(messages[window_start:])
+
+        # Leave at least a quarter of the budget to the summary; fold older verbatim
+        # messages into it while the recent turns alone would not fit
+        verbatim_budget = self.token_budget - min(estimate_tokens(self.summary), self.token_budget // 4)
+        while len(recent) > 1 and estimate_tokens(format_messages(recent)) > verbatim_budget:
+            self._fold(recent[:1])
+            recent = recent[1:]
+            self.summarized_count += 1
+
+        parts = []
+        recent_text = _clip(format_messages(recent), verbatim_budget)
+        summary_budget = self.token_budget - estimate_tokens(recent_text)
+        if self.summary and summary_budget > 0:
+            parts.append(f"Summary of earlier conversation: {_clip(self.summary, summary_budget)}")
+        if recent_text:
+            parts.append(recent_text)
+        return "\n".join(parts)
@@ -0,0 +1,266 @@
+import os
+import re
+import time
+import queue
+import sqlite3
+import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+from bedrock_client import get_embeddings
+from bedrock_gateway import gateway, current_session_id
+from code_splitter import split_code, guess_language
+from embedding_cache import CACHE_DIR, text_hash
+from rag import use_index, get_index_generation, chunk_text, format_sources
+from projects import get_project
+import metrics
+
+EXPLANATION_CACHE_PATH = os.path.join(CACHE_DIR, "explanations.sqlite")
+# Part of every cache key: bump it when the prompt changes so old explanations are not reused
+EXPLAIN_PROMPT_VERSION = "1"
+# Snippets longer than this are split into blocks that are explained (and cached) separately
+EXPLAIN_BLOCK_CHARS = int(os.getenv("DEVMATE_EXPLAIN_BLOCK_CHARS", "2500"))
+# Blocks explained at once; the gateway's fair queue still caps the total across sessions
+EXPLAIN_CONCURRENCY = int(os.getenv("DEVMATE_EXPLAIN_CONCURRENCY", "3"))
+# Indexed chunks (definitions and callers of the block's identifiers) added as context
+EXPLAIN_CONTEXT_CHUNKS = 3
+# Identifiers of a block used as the keyword query
+EXPLAIN_QUERY_TERMS = 30
+EXPLANATION_CACHE_MAX_ENTRIES = int(os.getenv("DEVMATE_EXPLAIN_CACHE_MAX", "5000"))
+
+EXPLAIN_PROMPT = """
+Human: You are an expert senior developer. Please explain the following code to a junior developer.
+Break it down line-by-line or by logical blocks. Explain WHY it is done this way, not just WHAT it does.
+{part}
+Related code from the project (definitions and usages of the names it refers to; use it to explain how the code fits in, do not explain it separately):
+{context}
+
+Code to explain:
+```{language}
+{code}
+```
+
+Assistant:"""
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+# Too common to say anything about where code belongs
+_KEYWORDS = {
+    "and", "any", "as", "async", "await", "bool", "break", "case", "catch", "char", "class",
+    "const", "continue", "def", "default", "del", "dict", "double", "elif", "else", "end", "enum",
+    "except", "export", "extends", "false", "final", "finally", "float", "for", "from", "func",
+    "function", "global", "impl", "implements", "import", "int", "interface", "lambda", "len",
+    "let", "list", "long", "new", "nil", "none", "not", "null", "package", "pass", "print",
+    "private", "protected", "pub", "public", "raise", "range", "return", "self", "static", "str",
+    "string", "struct", "super", "switch", "this", "throw", "throws", "true", "try", "type",
+    "undefined", "use", "var", "void", "while", "with", "yield",
+}
+
+def normalize_code(code):
+    """
+    Canonical form of a snippet for caching: consistent newlines and indentation, no trailing
+    whitespace and no surrounding blank lines, so re-pasting the same code hits the cache.
+    """
+    lines = [line.rstrip() for line in code.replace("\r\n", "\n").replace("\r", "\n").expandtabs(4).split("\n")]
+    return textwrap.dedent("\n".join(lines)).strip("\n")
+
+class ExplanationCache:
+    """
+    Persistent cache of code explanations in SQLite, keyed by the hash of the normalized
+    code block, the prompt version, and the project and index generation the explanation
+    was grounded in. Least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, path=EXPLANATION_CACHE_PATH, max_entries=EXPLANATION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS explanations (
+                key TEXT PRIMARY KEY,
+                explanation TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS explanations_last_used ON explanations (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(code, project, generation):
+        # Explanations cite the project's indexed code, so a re-ingest invalidates them
+        return text_hash(f"{EXPLAIN_PROMPT_VERSION}\0{project}\0{generation}\0{code}")
+
+    def get(self, key):
+        """
+        Returns (explanation, sources) or None.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT explanation, sources FROM explanations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE explanations SET last_used = ? WHERE key = ?", (time.time(), key))
+        explanation, sources = row
+        return explanation, [s for s in sources.split("\n") if s]
+
+    def put(self, key, explanation, sources):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO explanations (key, explanation, sources, last_used) VALUES (?, ?, ?, ?)",
+                (key, explanation, "\n".join(sources), time.time())
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM explanations WHERE key IN (SELECT key FROM explanations ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_explanation_cache():
+    """
+    Returns the process-wide explanation cache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExplanationCache()
+                metrics.register_stats("explanation_cache", _cache.stats)
+    return _cache
+
+def split_blocks(code, max_chars=EXPLAIN_BLOCK_CHARS):
+    """
+    Splits normalized code into (language, [(title, block)]). Blocks follow function and
+    class boundaries (see code_splitter), so editing one function changes only its block.
+    """
+    language = guess_language(code)
+    if len(code) <= max_chars:
+        return language, [("", code)]
+    chunks = split_code(Document(page_content=code, metadata={}), language=language, max_chars=max_chars)
+    blocks = []
+    for chunk in chunks:
+        metadata = chunk.metadata
+        title = f"Lines {metadata['start_line']}-{metadata['end_line']}"
+        if metadata.get("symbol"):
+            title += f" ({metadata['symbol']})"
+        blocks.append((title, chunk.page_content))
+    return language, blocks
+
+def related_chunks(code, k=EXPLAIN_CONTEXT_CHUNKS, project=None):
+    """
+    Returns indexed chunks that define or use the identifiers in `code`, found with the BM25
+    index (exact identifier matches matter here, and no embedding call is needed).
+    Chunks that are the pasted code itself are skipped. [] if there is no keyword index.
+    """
+    names = [name for name in _IDENTIFIER.findall(code) if name.lower() not in _KEYWORDS]
+    names = list(dict.fromkeys(names))[:EXPLAIN_QUERY_TERMS]
+    if not names:
+        return []
+    with use_index(get_embeddings(), project) as (_, knowledge_base, bm25):
+        if knowledge_base is None or bm25 is None:
+            return []
+        hits = bm25.search(" ".join(names), k=k * 2)
+        documents = knowledge_base.get_documents([chunk_id for chunk_id, _ in hits])
+    related = []
+    for chunk_id, _ in hits:
+        document = documents.get(chunk_id)
+        if document is not None and normalize_code(document.page_content) not in code:
+            related.append(document)
+    return related[:k]
+
+def _context(documents):
+    if not documents:
+        return "(none found)"
+    parts = []
+    for document in documents:
+        name = format_sources([document])[0]
+        parts.append(f"--- {name} ---\n{document.page_content}")
+    return "\n\n".join(parts)
+
+def _explain_block(title, block, language, total, session_id, project, key, out):
+    """
+    Streams the explanation of one block into `out` as ("token", text) items, then puts
+    ("done", sources) or ("error", message). Stores complete explanations in the cache.
+    """
+    try:
+        related = related_chunks(block, project=project)
+        part = f"This is {title}, one part of a longer file.\n" if total > 1 else ""
+        prompt = EXPLAIN_PROMPT.format(part=part, context=_context(related), language=language or "", code=block)
+        parts = []
+        # The same block pasted by several people at once is explained by one LLM call
+        for chunk in gateway.stream(prompt, session_id=session_id, shared=True):
+            text = chunk_text(chunk)
+            if text:
+                parts.append(text)
+                out.put(("token", text))
+        sources = format_sources(related)
+        get_explanation_cache().put(key, "".join(parts), sources)
+        out.put(("done", sources))
+    except Exception as e:
+        out.put(("error", str(e)))
+
+def explain_code_stream(code_snippet):
+    """
+    Explains a snippet grounded in the current project's indexed code, yielding events in order:
+    {"block": title, "cached": bool} when a block starts (title is "" for a single-block
+    snippet), {"token": text} for its explanation, and {"sources": [...]} when it ends.
+    Cached blocks are replayed instantly; the others are explained concurrently, and the
+    block being displayed streams live while the later ones are generated in the background.
+    """
+    code = normalize_code(code_snippet)
+    if not code:
+        return
+    language, blocks = split_blocks(code)
+    project = get_project()
+    cache = get_explanation_cache()
+    generation = get_index_generation(project)
+    keys = [ExplanationCache.key(block, project.name, generation) for _, block in blocks]
+    cached = [cache.get(key) for key in keys]
+
+    missing = [i for i, hit in enumerate(cached) if hit is None]
+    outputs = {i: queue.Queue() for i in missing}
+    # Worker threads do not inherit the session's context; pass on its ID (for fair queueing) and project
+    session_id = current_session_id()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(EXPLAIN_CONCURRENCY, len(missing)))) if missing else None
+    try:
+        for i in missing:
+            title, block = blocks[i]
+            executor.submit(_explain_block, title, block, language, len(blocks), session_id, project, keys[i], outputs[i])
+
+        for i, (title, _) in enumerate(blocks):
+            yield {"block": title, "cached": cached[i] is not None}
+            if cached[i] is not None:
+                explanation, sources = cached[i]
+                yield {"token": explanation}
+                yield {"sources": sources}
+                continue
+            while True:
+                kind, value = outputs[i].get()
+                if kind == "token":
+                    yield {"token": value}
+                elif kind == "done":
+                    yield {"sources": value}
+                    break
+                else:
+                    yield {"token": f"\n\nError explaining this block: {value}"}
+                    yield {"sources": []}
+                    break
+    finally:
+        if executor is not None:
+            # Blocks still running finish in the background and land in the cache
+            executor.shutdown(wait=False)
@@ -0,0 +1,316 @@
+import os
+import re
+import ast
+from langchain_core.documents import Document
+
+# Largest chunk we aim for; consecutive small units are packed together up to this size
+CODE_CHUNK_SIZE = int(os.getenv("DEVMATE_CODE_CHUNK_SIZE", "1500"))
+
+LANGUAGES = {
+    ".py": "python",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".java": "java",
+    ".cpp": "cpp",
+    ".c": "c",
+    ".h": "c",
+    ".go": "go",
+    ".rs": "rust",
+    ".php": "php",
+    ".rb": "ruby",
+}
+
+# Declaration patterns per language: each match yields (kind, name).
+# Brace languages find the end of a unit by matching braces; Ruby uses its `end` keyword.
+_JS_PATTERNS = [
+    ("class", r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(\w+)"),
+    ("function", r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)"),
+    ("function", r"^\s*(?:export\s+)?(?:const|let|var)\s+(\w+)\s*(?::[^=]+)?=\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|\w+\s*=>)"),
+    ("interface", r"^\s*(?:export\s+)?interface\s+(\w+)"),
+    ("enum", r"^\s*(?:export\s+)?(?:const\s+)?enum\s+(\w+)"),
+    ("method", r"^\s+(?:(?:public|private|protected|static|async|get|set|readonly)\s+)*(\w+)\s*\([^)]*\)\s*(?::[^{]+)?\{\s*$"),
+]
+_PATTERNS = {
+    "javascript": _JS_PATTERNS,
+    "typescript": _JS_PATTERNS,
+    "java": [
+        ("class", r"^\s*(?:(?:public|private|protected|abstract|final|static)\s+)*(?:class|record)\s+(\w+)"),
+        ("interface", r"^\s*(?:(?:public|private|protected|abstract|static)\s+)*(?:interface|@interface)\s+(\w+)"),
+        ("enum", r"^\s*(?:(?:public|private|protected|static)\s+)*enum\s+(\w+)"),
+        ("method", r"^\s*(?:@\w+\s+)*(?:(?:public|private|protected|static|final|abstract|synchronized|native|default)\s+)*(?:<[^>]+>\s+)?[\w<>\[\],.? ]+\s+(\w+)\s*\([^;]*$"),
+    ],
+    "c": [
+        ("struct", r"^(?:typedef\s+)?(?:struct|union|enum)\s+(\w+)\s*\{?\s*$"),
+        ("function", r"^(?!\s)(?:[\w\*]+\s+)+\**(\w+)\s*\([^;]*$"),
+    ],
+    "cpp": [
+        ("class", r"^\s*(?:template\s*<[^>]*>\s*)?(?:class|struct)\s+(\w+)[^;]*$"),
+        ("namespace", r"^\s*namespace\s+(\w+)"),
+        ("function", r"^\s*(?:template\s*<[^>]*>\s*)?(?:[\w:<>\*&~,]+\s+)+[\*&]?((?:\w+::)*~?\w+)\s*\([^;]*$"),
+    ],
+    "go": [
+        ("function", r"^func\s+(?:\([^)]*\)\s*)?(\w+)"),
+        ("type", r"^type\s+(\w+)\s+(?:struct|interface)"),
+    ],
+    "rust": [
+        ("impl", r"^\s*impl(?:<[^>]*>)?\s+(?:[\w:<>]+\s+for\s+)?([\w:]+)"),
+        ("trait", r"^\s*(?:pub(?:\([^)]*\))?\s+)?trait\s+(\w+)"),
+        ("struct", r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|union)\s+(\w+)"),
+        ("module", r"^\s*(?:pub(?:\([^)]*\))?\s+)?mod\s+(\w+)\s*\{"),
+        ("function", r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?(?:extern\s+\"[^\"]*\"\s+)?fn\s+(\w+)"),
+    ],
+    "php": [
+        ("class", r"^\s*(?:(?:abstract|final)\s+)?(?:class|interface|trait)\s+(\w+)"),
+        ("function", r"^\s*(?:(?:public|private|protected|static|abstract|final)\s+)*function\s+&?(\w+)"),
+    ],
+    "ruby": [
+        ("class", r"^\s*class\s+([\w:]+)"),
+        ("module", r"^\s*module\s+([\w:]+)"),
+        ("method", r"^\s*def\s+((?:self\.)?[\w?!=]+)"),
+    ],
+}
+_COMPILED = {language: [(kind, re.compile(pattern)) for kind, pattern in patterns] for language, patterns in _PATTERNS.items()}
+
+def detect_language(file_path):
+    """
+    Returns the language for a source file based on its extension, or None for non-code files.
+    """
+    return LANGUAGES.get(os.path.splitext(file_path)[1].lower())
+
+def guess_language(code):
+    """
+    Guesses the language of a pasted snippet with no file name: Python if it parses,
+    otherwise the language whose declaration patterns find the most units. None if no
+    language finds any.
+    """
+    lines = code.splitlines()
+    if not lines:
+        return None
+    if _python_units(lines):
+        return "python"
+    best, best_count = None, 0
+    for language in _COMPILED:
+        count = len(_regex_units(lines, language, 0, len(lines) - 1))
+        if count > best_count:
+            best, best_count = language, count
+    return best
+
+class _Unit:
+    """
+    A contiguous range of lines (1-based, inclusive) with the symbol it defines.
+    """
+
+    def __init__(self, start, end, kind, symbol, children=None):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.symbol = symbol
+        self.children = children or []
+
+# --- Python: exact boundaries from the AST ---
+
+def _python_units(lines):
+    try:
+        tree = ast.parse("\n".join(lines))
+    except (SyntaxError, ValueError):
+        return None
+
+    def unit_for(node, prefix=""):
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        name = prefix + node.name
+        if isinstance(node, ast.ClassDef):
+            children = [
+                unit_for(child, name + ".")
+                for child in node.body
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+            ]
+            return _Unit(start, node.end_lineno, "class", name, children)
+        kind = "method" if prefix else "function"
+        return _Unit(start, node.end_lineno, kind, name)
+
+    return [
+        unit_for(node)
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+
+# --- Other languages: declaration regexes plus brace / `end` matching ---
+
+_STRING_OR_COMMENT = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|//.*$|#.*$')
+
+def _brace_delta(line, in_block_comment):
+    """
+    Returns (opens - closes, still_in_block_comment) for one line, ignoring strings and comments.
+    """
+    if in_block_comment:
+        if "*/" not in line:
+            return 0, True
+        line = line.split("*/", 1)[1]
+    while "/*" in line:
+        before, after = line.split("/*", 1)
+        if "*/" in after:
+            line = before + after.split("*/", 1)[1]
+        else:
+            line = before
+            in_block_comment = True
+            break
+    line = _STRING_OR_COMMENT.sub("", line)
+    return line.count("{") - line.count("}"), in_block_comment
+
+def _find_block_end(lines, start, language):
+    """
+    Returns the 0-based index of the last line of the unit starting at `start`, or None if the
+    declaration turns out to have no body (a prototype or a one-line expression).
+    """
+    if language == "ruby":
+        indent = len(lines[start]) - len(lines[start].lstrip())
+        for i in range(start + 1, len(lines)):
+            stripped = lines[i].strip()
+            if stripped == "end" and len(lines[i]) - len(lines[i].lstrip()) == indent:
+                return i
+        return None
+
+    depth = 0
+    opened = False
+    in_comment = False
+    for i in range(start, len(lines)):
+        delta, in_comment = _brace_delta(lines[i], in_comment)
+        if not opened and delta == 0 and ("{" not in lines[i]):
+            # Header spanning several lines; give up if it ends before a body starts
+            if lines[i].rstrip().endswith(";") or i - start > 5:
+                return None
+            continue
+        depth += delta
+        opened = True
+        if depth <= 0:
+            return i
+    return None
+
+def _regex_units(lines, language, first, last, prefix=""):
+    patterns = _COMPILED.get(language)
+    if not patterns:
+        return []
+    units = []
+    i = first
+    while i <= last:
+        match = None
+        for kind, pattern in patterns:
+            m = pattern.match(lines[i])
+            if m:
+                match = (kind, m.group(1))
+                break
+        if match:
+            end = _find_block_end(lines, i, language)
+            if end is not None and end <= last:
+                kind, name = match
+                if prefix and kind == "function":
+                    kind = "method"
+                unit = _Unit(i + 1, end + 1, kind, prefix + name)
+                if end - i > 1:
+                    unit.children = _regex_units(lines, language, i + 1, end - 1, prefix + name + ".")
+                units.append(unit)
+                i = end + 1
+                continue
+        i += 1
+    return units
+
+# --- Turning units into chunks ---
+
+def _line_windows(lines, start, end, max_chars):
+    """
+    Splits lines start..end (1-based) into consecutive windows of at most max_chars, without overlap.
+    """
+    windows = []
+    window_start = start
+    size = 0
+    for line_no in range(start, end + 1):
+        length = len(lines[line_no - 1]) + 1
+        if size and size + length > max_chars:
+            windows.append((window_start, line_no - 1))
+            window_start = line_no
+            size = 0
+        size += length
+    if windows and size < max_chars // 4:
+        # Fold a short tail into the previous window rather than emitting a runt chunk
+        windows[-1] = (windows[-1][0], end)
+    else:
+        windows.append((window_start, end))
+    return windows
+
+def _segments(lines, units, start, end, max_chars, outer_kind, outer_symbol):
+    """
+    Yields (start, end, kind, symbol) segments covering lines start..end: one per unit that fits,
+    recursing into units that are too large, with the code between units as its own segments.
+    """
+    def span_size(a, b):
+        return sum(len(lines[n - 1]) + 1 for n in range(a, b + 1))
+
+    def gap(a, b):
+        if a > b or not any(lines[n - 1].strip() for n in range(a, b + 1)):
+            return
+        for window_start, window_end in _line_windows(lines, a, b, max_chars):
+            yield window_start, window_end, outer_kind, outer_symbol
+
+    cursor = start
+    for unit in units:
+        yield from gap(cursor, unit.start - 1)
+        if span_size(unit.start, unit.end) <= max_chars:
+            yield unit.start, unit.end, unit.kind, unit.symbol
+        elif unit.children:
+            yield from _segments(lines, unit.children, unit.start, unit.end, max_chars, unit.kind, unit.symbol)
+        else:
+            for window_start, window_end in _line_windows(lines, unit.start, unit.end, max_chars):
+                yield window_start, window_end, unit.kind, unit.symbol
+        cursor = unit.end + 1
+    yield from gap(cursor, end)
+
+def split_code(document, language=None, max_chars=CODE_CHUNK_SIZE):
+    """
+    Splits a source file into chunks that follow function and class boundaries.
+    Small neighbouring units are packed together up to max_chars; oversized classes are split
+    by their methods. Each chunk's metadata gets language, symbol, kind, start_line and end_line.
+    """
+    source = document.metadata.get("source", "")
+    language = language or detect_language(source)
+    lines = document.page_content.splitlines()
+    if not lines:
+        return []
+
+    units = None
+    if language == "python":
+        units = _python_units(lines)
+    if units is None:
+        units = _regex_units(lines, language, 0, len(lines) - 1)
+
+    chunks = []
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        first, last = pending[0][0], pending[-1][1]
+        symbols = [symbol for _, _, _, symbol in pending if symbol]
+        kinds = list(dict.fromkeys(kind for _, _, kind, _ in pending))
+        metadata = dict(document.metadata)
+        metadata.update({
+            "language": language,
+            "symbol": ", ".join(dict.fromkeys(symbols)),
+            "kind": ", ".join(kinds),
+            "start_line": first,
+            "end_line": last,
+        })
+        chunks.append(Document(page_content="\n".join(lines[first - 1:last]), metadata=metadata))
+        pending.clear()
+
+    size = 0
+    for segment in _segments(lines, units, 1, len(lines), max_chars, "module", ""):
+        segment_size = sum(len(lines[n - 1]) + 1 for n in range(segment[0], segment[1] + 1))
+        if pending and size + segment_size > max_chars:
+            flush()
+            size = 0
+        pending.append(segment)
+        size += segment_size
+    flush()
+    return chunks
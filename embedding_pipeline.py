@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from bedrock_client import is_throttling_error
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# Number of embedding requests in flight at once; raise it until Bedrock starts throttling
+EMBED_CONCURRENCY = int(os.getenv("DEVMATE_EMBED_CONCURRENCY", "8"))
+# Chunks handed to one worker per task
+EMBED_BATCH_SIZE = int(os.getenv("DEVMATE_EMBED_BATCH_SIZE", "16"))
+EMBED_MAX_RETRIES = int(os.getenv("DEVMATE_EMBED_MAX_RETRIES", "8"))
+
+class AdaptiveBackoff:
+    """
+    Shared delay applied by every worker before calling Bedrock.
+    A throttling error doubles the delay for the whole pool; each success shrinks it again,
+    so the pool settles just below the account quota instead of hammering it.
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, decay=0.8):
+        self.initial = initial
+        self.maximum = maximum
+        self.decay = decay
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.delay
+        if delay > 0:
+            # Jitter keeps the workers from retrying in lockstep
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+    def throttled(self):
+        with self._lock:
+            self.delay = min(self.maximum, max(self.initial, self.delay * 2))
+
+    def succeeded(self):
+        with self._lock:
+            self.delay = self.delay * self.decay
+            if self.delay < 0.05:
+                self.delay = 0.0
+
+def _embed_with_retry(embeddings, texts, backoff, max_retries):
+    for attempt in range(max_retries + 1):
+        backoff.wait()
+        try:
+            vectors = embeddings.embed_documents(texts)
+            backoff.succeeded()
+            return vectors
+        except Exception as e:
+            if not is_throttling_error(e) or attempt == max_retries:
+                raise
+            backoff.throttled()
+            metrics.log_event(log, "bedrock throttled embedding batch", level=logging.WARNING, backoff=round(backoff.delay, 2), attempt=attempt + 1)
+
+def embed_batches(texts, embeddings, concurrency=EMBED_CONCURRENCY, batch_size=EMBED_BATCH_SIZE, max_retries=EMBED_MAX_RETRIES, backoff=None):
+    """
+    Embeds `texts` with a bounded worker pool and yields (start, vectors) for each batch
+    as soon as it finishes, so callers can add vectors to the index while others are in flight.
+    Batches are yielded in completion order; `start` is the offset of the batch in `texts`.
+    Callers embedding in several rounds pass one `backoff` to all of them, so the throttling
+    learned in one round carries over to the next.
+    """
+    backoff = backoff or AdaptiveBackoff()
+    batches = ((start, texts[start:start + batch_size]) for start in range(0, len(texts), batch_size))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pending = {}
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            start, batch_texts = batch
+            pending[executor.submit(_embed_with_retry, embeddings, batch_texts, backoff, max_retries)] = start
+            return True
+
+        # Keep at most two batches per worker queued so memory stays bounded
+        for _ in range(max(1, concurrency) * 2):
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start = pending.pop(future)
+                yield start, future.result()
+                submit_next()
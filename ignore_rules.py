@@ -0,0 +1,248 @@
+import os
+import re
+
+# Project-specific ignore file, same syntax as .gitignore; honoured in any directory under data/
+DEVMATE_IGNORE_FILE = ".devmateignore"
+IGNORE_FILES = (".gitignore", DEVMATE_IGNORE_FILE)
+
+# Largest text/code file worth embedding, and largest PDF
+MAX_FILE_BYTES = int(os.getenv("DEVMATE_MAX_FILE_BYTES", str(1024 * 1024)))
+MAX_PDF_BYTES = int(os.getenv("DEVMATE_MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+# Total bytes ingested per run; files past this budget are skipped
+MAX_TOTAL_BYTES = int(os.getenv("DEVMATE_MAX_TOTAL_BYTES", str(500 * 1024 * 1024)))
+
+VENDORED_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "bower_components", "jspm_packages", "vendor",
+    "third_party", "dist", "build", "out", "target", "coverage", "__pycache__", ".venv", "venv",
+    ".tox", ".nox", ".mypy_cache", ".pytest_cache", ".next", ".nuxt", ".gradle", ".idea",
+    ".vscode", "site-packages", "Pods",
+}
+LOCK_FILES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "npm-shrinkwrap.json", "Cargo.lock",
+    "poetry.lock", "Pipfile.lock", "composer.lock", "Gemfile.lock", "go.sum", "packages.lock.json",
+}
+GENERATED_MARKERS = (".min.", ".bundle.", ".chunk.", "-min.")
+
+# Minified/generated text: very long lines are a give-away
+MINIFIED_MAX_LINE = 2000
+MINIFIED_MEAN_LINE = 300
+SNIFF_BYTES = 64 * 1024
+# Uploaded prose often has one unwrapped paragraph per line, so it is never judged by line length
+PROSE_EXTENSIONS = (".txt", ".md", ".pdf")
+# Folder of the root that holds synced git repos (see repo_sync), whose files are always sniffed
+REPOS_SUBDIR = "repos"
+
+def _glob_to_regex(pattern):
+    """
+    Translates one gitignore glob into a regex over '/'-separated relative paths.
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "(?:/.*)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                regex += f"[{body}]"
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+def parse_ignore_lines(lines):
+    """
+    Parses gitignore-style lines into (regex, negated, dir_only) rules.
+    """
+    rules = []
+    for raw in lines:
+        line = raw.rstrip("\n").rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        # A slash anywhere but the end anchors the pattern to the ignore file's directory
+        anchored = "/" in line
+        line = line.lstrip("/")
+        prefix = "" if anchored else "(?:.*/)?"
+        rules.append((re.compile(f"^{prefix}{_glob_to_regex(line)}$"), negated, dir_only))
+    return rules
+
+class IgnoreRules:
+    """
+    Decides which files under a root directory are worth ingesting.
+    Combines .gitignore and .devmateignore files (loaded lazily per directory, deeper files
+    taking precedence), vendored/generated heuristics and size caps, and remembers why
+    each file was skipped.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self._rules = {}
+        self.skipped = []
+
+    def _rules_for(self, directory):
+        if directory not in self._rules:
+            rules = []
+            for name in IGNORE_FILES:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    try:
+                        with open(path, "r", encoding="utf-8", errors="replace") as f:
+                            rules.extend(parse_ignore_lines(f))
+                    except OSError:
+                        pass
+            self._rules[directory] = rules
+        return self._rules[directory]
+
+    def _ignored_by_rules(self, path, is_dir):
+        """
+        Returns the ignore file directory whose rule excluded `path`, or None.
+        """
+        path = os.path.normpath(path)
+        parent = os.path.dirname(path)
+        # Ancestors from the root down, so deeper ignore files are applied last and win
+        ancestors = []
+        directory = parent
+        while True:
+            ancestors.append(directory)
+            if directory == self.root or not directory.startswith(self.root):
+                break
+            directory = os.path.dirname(directory)
+
+        ignored_by = None
+        for directory in reversed(ancestors):
+            relative = os.path.relpath(path, directory).replace(os.sep, "/")
+            for regex, negated, dir_only in self._rules_for(directory):
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(relative):
+                    ignored_by = None if negated else directory
+        return ignored_by
+
+    def skip(self, path, reason):
+        self.skipped.append({"path": path, "reason": reason})
+
+    def _is_upload(self, path):
+        relative = os.path.relpath(os.path.normpath(path), self.root).replace(os.sep, "/")
+        return not relative.startswith(REPOS_SUBDIR + "/")
+
+    def dir_skip_reason(self, path):
+        name = os.path.basename(path)
+        if name in VENDORED_DIRS:
+            return "vendored or build directory"
+        if self._ignored_by_rules(path, is_dir=True) is not None:
+            return "ignore rule"
+        return None
+
+    def file_skip_reason(self, path):
+        """
+        Returns why `path` should not be ingested, or None if it should.
+        Checks ignore rules, lock files and generated names, the size cap, then sniffs
+        the first bytes for binary or minified content. Uploaded .txt/.md files are only
+        checked for binary content: long lines there are unwrapped paragraphs.
+        """
+        name = os.path.basename(path)
+        if name in IGNORE_FILES:
+            return "ignore file"
+        if self._ignored_by_rules(path, is_dir=False) is not None:
+            return "ignore rule"
+        if name in LOCK_FILES:
+            return "lock file"
+        if any(marker in name for marker in GENERATED_MARKERS):
+            return "minified or bundled file"
+
+        size = os.path.getsize(path)
+        is_pdf = name.lower().endswith(".pdf")
+        limit = MAX_PDF_BYTES if is_pdf else MAX_FILE_BYTES
+        if size > limit:
+            return f"larger than {limit} bytes"
+        if is_pdf:
+            return None
+
+        with open(path, "rb") as f:
+            sample = f.read(SNIFF_BYTES)
+        if b"\0" in sample[:8192]:
+            return "binary content"
+        if name.lower().endswith(PROSE_EXTENSIONS) and self._is_upload(path):
+            return None
+        lines = sample.splitlines() or [b""]
+        longest = max(len(line) for line in lines)
+        if longest > MINIFIED_MAX_LINE or len(sample) / len(lines) > MINIFIED_MEAN_LINE:
+            return "minified or generated content"
+        return None
+
+def scan_files(root, is_supported, max_total_bytes=None):
+    """
+    Walks `root` and returns (file_paths, rules) where file_paths are the supported files that
+    pass the ignore rules, sorted, and rules.skipped lists everything left out and why.
+    Ignored directories are pruned from the walk instead of being filtered file by file.
+    """
+    max_total_bytes = MAX_TOTAL_BYTES if max_total_bytes is None else max_total_bytes
+    rules = IgnoreRules(root)
+    candidates = []
+
+    for current, dirs, files in os.walk(root):
+        kept_dirs = []
+        for d in sorted(dirs):
+            dir_path = os.path.join(current, d)
+            reason = rules.dir_skip_reason(dir_path)
+            if reason:
+                rules.skip(dir_path + "/", reason)
+            else:
+                kept_dirs.append(d)
+        dirs[:] = kept_dirs
+
+        for file in files:
+            file_path = os.path.join(current, file)
+            if not is_supported(file_path):
+                continue
+            try:
+                reason = rules.file_skip_reason(file_path)
+            except OSError as e:
+                reason = f"unreadable: {e}"
+            if reason:
+                rules.skip(file_path, reason)
+            else:
+                candidates.append(file_path)
+
+    candidates.sort()
+    file_paths = []
+    total = 0
+    for file_path in candidates:
+        size = os.path.getsize(file_path)
+        if total + size > max_total_bytes:
+            rules.skip(file_path, f"total size cap of {max_total_bytes} bytes reached")
+            continue
+        total += size
+        file_paths.append(file_path)
+    return file_paths, rules
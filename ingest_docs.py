@@ -1,82 +1,492 @@
 import os
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, DirectoryLoader
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from bedrock_client import get_embeddings
-import shutil
-
-DATA_DIR = "data"
-FAISS_INDEX_DIR = "faiss_index"
-
-def ingest_docs():
-    """
-    Loads documents from 'data/' directory, splits them, and stores embeddings in FAISS.
-    """
-    print(f"Loading documents from {DATA_DIR}...")
-    
-    documents = []
-    
-    # Load PDFs
-    for root, dirs, files in os.walk(DATA_DIR):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                if file.endswith(".pdf"):
-                    loader = PyPDFLoader(file_path)
-                    documents.extend(loader.load())
-                elif file.endswith(".txt"):
-                    loader = TextLoader(file_path, encoding='utf-8')
-                    documents.extend(loader.load())
-                elif file.endswith(".md"):
-                    loader = TextLoader(file_path, encoding='utf-8')
-                    documents.extend(loader.load())
-                elif file.endswith(".py"):
-                    loader = TextLoader(file_path, encoding='utf-8')
-                    documents.extend(loader.load())
-                elif file.endswith((".js", ".jsx", ".ts", ".tsx", ".html", ".css", ".json", ".java", ".cpp", ".c", ".h", ".go", ".rs", ".php", ".rb")):
-                     loader = TextLoader(file_path, encoding='utf-8')
-                     documents.extend(loader.load())
-            except Exception as e:
-                print(f"Error loading {file}: {e}")
-
-    if not documents:
-        print("No documents found to ingest.")
-        return
+from code_splitter import detect_language, split_code
+from ignore_rules import scan_files
+from repo_sync import repo_heads, trusted_repo_files, indexed_heads
+from projects import get_project, DEFAULT_DATA_DIR, DEFAULT_INDEX_DIR
+from bm25_index import BM25Index
+from ann_index import describe
+from kb_store import (
+    IndexWriter, KnowledgeBase, write_lock, current_generation, generation_dir,
+    new_generation, discard_generation, publish_generation, clear_generations,
+)
+from embedding_pipeline import embed_batches, AdaptiveBackoff, EMBED_CONCURRENCY
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import hashlib
+import json
+import time
+import metrics
+
+log = metrics.get_logger("ingest")
+
+# Folders of the default project; every other project has its own pair (see projects.py)
+DATA_DIR = DEFAULT_DATA_DIR
+# Holds the published index generations (see kb_store) and the ingest report
+FAISS_INDEX_DIR = DEFAULT_INDEX_DIR
+# Per-file and per-chunk content hashes of what is in a generation
+MANIFEST_FILE = "manifest.json"
+# Bump whenever chunking, chunk metadata or the index format changes so existing indexes are rebuilt
+MANIFEST_VERSION = 4
+# Files from before generations existed, removed once the first generation is published
+LEGACY_FILES = ("index.faiss", "index.pkl", "docstore.sqlite", "bm25.sqlite", "manifest.json", "generation")
+# What the last ingest left out and why
+REPORT_FILE = "ingest_report.json"
+# Sparse keyword index kept in sync with the FAISS index for hybrid retrieval
+BM25_FILE = "bm25.sqlite"
+# Chunks embedded and added to the index per pipeline step; bounds peak memory during ingestion
+INGEST_BATCH_SIZE = int(os.getenv("DEVMATE_INGEST_BATCH_SIZE", "256"))
+# Processes used to parse and split changed files (PDF parsing is CPU-bound)
+LOAD_WORKERS = int(os.getenv("DEVMATE_LOAD_WORKERS", str(os.cpu_count() or 1)))
+
+TEXT_EXTENSIONS = (".txt", ".md", ".py", ".js", ".jsx", ".ts", ".tsx", ".html", ".css", ".json", ".java", ".cpp", ".c", ".h", ".go", ".rs", ".php", ".rb")
+
+def file_hash(file_path):
+    """
+    Returns the sha256 of a file's bytes.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_ids(source, chunks):
+    """
+    Returns stable IDs for a file's chunks, derived from the file path and the chunk content.
+    Repeated identical chunks within one file get an occurrence suffix so IDs stay unique.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(f"{source}\0{chunk.page_content}".encode("utf-8")).hexdigest()
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        ids.append(chunk_hash if occurrence == 0 else f"{chunk_hash}-{occurrence}")
+    return ids
 
-    print(f"Loaded {len(documents)} documents.")
+def is_supported(file_path):
+    return file_path.endswith(".pdf") or file_path.endswith(TEXT_EXTENSIONS)
 
-    # Split documents
-    text_splitter = RecursiveCharacterTextSplitter(
+def load_file(file_path):
+    """
+    Loads a single supported file into LangChain documents. Returns None for unsupported types.
+    """
+    if file_path.endswith(".pdf"):
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith(TEXT_EXTENSIONS):
+        loader = TextLoader(file_path, encoding='utf-8')
+    else:
+        return None
+    return loader.load()
+
+def make_text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         separators=["\n\n", "\n", " ", ""]
     )
-    
-    print("Splitting documents...")
-    split_docs = text_splitter.split_documents(documents)
-    print(f"Created {len(split_docs)} chunks.")
 
-    if not split_docs:
-        print("No chunks created. Documents might be empty.")
+def source_metadata(file_path, data_dir=DATA_DIR):
+    """
+    Returns the metadata searches can be scoped by: origin ("upload" for data/docs, "repo" for
+    cloned repos), repo name, path inside the upload folder or repo, language and file type.
+    """
+    parts = os.path.relpath(file_path, data_dir).replace(os.sep, "/").split("/")
+    if parts[0] == "repos" and len(parts) > 2:
+        origin, repo, path = "repo", parts[1], "/".join(parts[2:])
+    elif parts[0] == "docs" and len(parts) > 1:
+        origin, repo, path = "upload", None, "/".join(parts[1:])
+    else:
+        origin, repo, path = "other", None, "/".join(parts)
+    return {
+        "origin": origin,
+        "repo": repo,
+        "path": path,
+        "language": detect_language(file_path),
+        "file_type": os.path.splitext(file_path)[1].lstrip(".").lower() or None,
+    }
+
+def load_and_split(file_path, data_dir=DATA_DIR):
+    """
+    Loads and splits one file. Runs inside the worker processes, so errors are returned
+    instead of raised: one broken file must not take the rest of the batch down.
+    Returns (file_path, chunks, error).
+    """
+    try:
+        documents = load_file(file_path)
+        if documents is None:
+            return file_path, [], None
+        language = detect_language(file_path)
+        if language:
+            # Source code is cut on function/class boundaries instead of fixed-size windows
+            chunks = []
+            for document in documents:
+                chunks.extend(split_code(document, language))
+        else:
+            chunks = make_text_splitter().split_documents(documents)
+        metadata = source_metadata(file_path, data_dir)
+        for chunk in chunks:
+            chunk.metadata.update(metadata)
+        return file_path, chunks, None
+    except Exception as e:
+        return file_path, None, str(e)
+
+def iter_loaded_files(file_paths, workers=None, data_dir=DATA_DIR):
+    """
+    Yields load_and_split() results in the same order as `file_paths`.
+    With more than one worker, files are parsed in a process pool with a bounded window of
+    files in flight, so memory stays flat while every core is busy.
+    """
+    workers = LOAD_WORKERS if workers is None else workers
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield load_and_split(file_path, data_dir)
         return
 
-    # Get embeddings
+    # 'spawn' avoids forking the threaded Streamlit server
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths)), mp_context=context) as executor:
+        window = []
+        paths = iter(file_paths)
+        for file_path in paths:
+            window.append(executor.submit(load_and_split, file_path, data_dir))
+            if len(window) >= workers * 2:
+                break
+        while window:
+            result = window.pop(0).result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                window.append(executor.submit(load_and_split, next_path, data_dir))
+            yield result
+
+def load_manifest(index_dir):
+    """
+    Reads the manifest of the generation in `index_dir`. Returns an empty manifest if there is
+    none, it is from an older format, or it is out of sync with the index (which forces a full rebuild).
+    """
+    empty = {"version": MANIFEST_VERSION, "files": {}}
+    if index_dir is None:
+        return empty
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return empty
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable manifest: {e}")
+        return empty
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty
+    indexed = sum(len(entry["chunks"]) for entry in manifest["files"].values())
+    try:
+        # Memory-mapped, so checking the counts costs next to nothing
+        knowledge_base = KnowledgeBase(index_dir)
+        counts = (knowledge_base.ntotal, knowledge_base.doc_count())
+        knowledge_base.close()
+    except Exception as e:
+        log.warning(f"Could not read the existing index, rebuilding: {e}")
+        return empty
+    if counts != (indexed, indexed):
+        log.warning("Manifest does not match the index, rebuilding from scratch.")
+        return empty
+    return manifest
+
+def save_manifest(index_dir, manifest):
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def find_changed_files(file_paths, old_files, new_files, trusted=frozenset(), failed=None):
+    """
+    Hashes every supported file and returns [(file_path, digest)] for the ones whose content
+    differs from the manifest. Unchanged files are carried over into `new_files` directly.
+    Files in `trusted` are known to be unchanged (from git) and are not read at all.
+    Files that cannot be read are appended to `failed`.
+    """
+    changed = []
+    for file_path in file_paths:
+        if not is_supported(file_path):
+            continue
+        old_entry = old_files.get(file_path)
+        if old_entry and file_path in trusted:
+            new_files[file_path] = old_entry
+            continue
+        try:
+            digest = file_hash(file_path)
+        except OSError as e:
+            log.warning(f"Error reading {os.path.basename(file_path)}: {e}")
+            if failed is not None:
+                failed.append(file_path)
+            if old_entry:
+                new_files[file_path] = old_entry
+            continue
+        if old_entry and old_entry["sha256"] == digest:
+            new_files[file_path] = old_entry
+        else:
+            changed.append((file_path, digest))
+    return changed
+
+def save_skip_report(skipped, index_dir=FAISS_INDEX_DIR):
+    """
+    Writes the list of skipped files and the reasons, plus a count per reason.
+    """
+    counts = {}
+    for entry in skipped:
+        counts[entry["reason"]] = counts.get(entry["reason"], 0) + 1
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump({"counts": counts, "skipped": skipped}, f, indent=2)
+
+def open_bm25(index_dir, writer):
+    """
+    Opens the BM25 index next to the FAISS index and makes sure it covers the same chunks:
+    it is cleared for a full rebuild, and re-filled from the docstore (no embedding
+    needed) if it is missing or out of sync.
+    """
+    bm25 = BM25Index(os.path.join(index_dir, BM25_FILE))
+    if writer.index is None:
+        bm25.clear()
+    elif bm25.doc_count() != writer.ntotal:
+        log.info("Rebuilding keyword index from the docstore...")
+        bm25.clear()
+        for batch in iter_batches(writer.iter_documents(), INGEST_BATCH_SIZE):
+            bm25.add([chunk_id for chunk_id, _ in batch], [text for _, text in batch])
+    return bm25
+
+def iter_changed_chunks(changed_files, old_files, new_files, stale_ids, data_dir=DATA_DIR, failed=None, retained=None):
+    """
+    Yields (chunk, chunk_id) for every chunk of the changed files that is not already in the
+    index. Files are parsed in parallel but consumed one at a time in a deterministic order.
+    Fills `new_files` with the manifest entry of every file and `stale_ids` with the IDs to delete;
+    files that fail to load are appended to `failed`. Chunks that are already indexed are
+    appended to `retained` as (chunk, chunk_id): their text is the same, but code chunks may
+    have moved, so their metadata (start_line/end_line) is refreshed without re-embedding.
+    """
+    digests = dict(changed_files)
+    for file_path, split_docs, error in iter_loaded_files([path for path, _ in changed_files], data_dir=data_dir):
+        old_entry = old_files.get(file_path)
+        if error is not None:
+            log.warning(f"Error loading {os.path.basename(file_path)}: {error}")
+            if failed is not None:
+                failed.append(file_path)
+            # Keep whatever was indexed for this file before
+            if old_entry:
+                new_files[file_path] = old_entry
+            continue
+
+        ids = chunk_ids(file_path, split_docs)
+        old_ids = set(old_entry["chunks"]) if old_entry else set()
+        stale_ids.extend(old_ids.difference(ids))
+        new_files[file_path] = {"sha256": digests[file_path], "chunks": ids}
+        for chunk, chunk_id in zip(split_docs, ids):
+            chunk.metadata["chunk_id"] = chunk_id
+            if chunk_id not in old_ids:
+                yield chunk, chunk_id
+            elif retained is not None:
+                retained.append((chunk, chunk_id))
+
+def iter_batches(items, batch_size):
+    """
+    Groups any iterable into lists of at most `batch_size` items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def remove_legacy_files(index_dir=FAISS_INDEX_DIR):
+    for name in LEGACY_FILES:
+        for path in (name, name + "-wal", name + "-shm"):
+            path = os.path.join(index_dir, path)
+            if os.path.exists(path):
+                os.remove(path)
+
+def ingest_docs(progress=None, project=None):
+    """
+    Loads documents from the project's data directory ('data/' for the default project),
+    splits them, and stores embeddings in the project's FAISS index.
+    Only new or changed chunks are embedded: a manifest of file and chunk hashes next to the
+    index tells which vectors to keep, which to delete and which to add.
+
+    Loading, splitting, embedding and indexing run as a streaming pipeline over fixed-size
+    batches, so peak memory does not depend on the size of the data directory.
+
+    Changes are applied to a copy of the live generation and published with an atomic
+    rename, so chat keeps answering from the previous index until the new one is complete.
+    Concurrent ingests of a project, from any thread or process, run one after the other.
+    Args:
+        progress: Optional callback(fraction, message) for UI progress bars
+        project: Project (or name) to ingest; defaults to the current project
+    Returns:
+        The final status message
+    """
+    def report(fraction, message):
+        log.info(message)
+        if progress:
+            progress(min(max(fraction, 0.0), 1.0), message)
+        return message
+
+    project = get_project(project)
+    log.info(f"Loading documents from {project.data_dir}...")
+
     embeddings = get_embeddings()
     if not embeddings:
-        print("Failed to initialize embeddings. Check AWS credentials.")
-        return
+        raise RuntimeError("Failed to initialize embeddings. Check AWS credentials.")
+
+    # Each phase is a span on the "ingest" trace and in devmate_stage_seconds
+    with metrics.trace("ingest", logger=log, project=project.name), write_lock(project.index_dir):
+        return _ingest_locked(project, embeddings, report)
 
-    # Create vector store
-    print("Creating FAISS index...")
+def _ingest_locked(project, embeddings, report):
+    index_root = project.index_dir
+    live = current_generation(index_root)
+    live_dir = generation_dir(index_root, live) if live else None
+    with metrics.span("ingest_load_manifest"):
+        manifest = load_manifest(live_dir)
+    old_files = manifest["files"]
+    new_files = {}
+    stale_ids = []
+    # Files that could not be read or loaded; their repos are not advanced to the new HEAD
+    failed = []
+    # Unchanged chunks of changed files, whose line ranges may have shifted
+    retained = []
+
+    # Honour .gitignore/.devmateignore and skip vendored, minified and oversized files
+    with metrics.span("ingest_scan") as span:
+        file_paths, rules = scan_files(project.data_dir, is_supported)
+        save_skip_report(rules.skipped, index_root)
+        span.update(files=len(file_paths), skipped=len(rules.skipped))
+    if rules.skipped:
+        log.info(f"Skipped {len(rules.skipped)} files and directories (see {os.path.join(index_root, REPORT_FILE)}).")
+
+    report(0.0, f"Scanning {len(file_paths)} files...")
+    # Repo files outside `git diff <last indexed commit> HEAD` are not even hashed
+    with metrics.span("ingest_detect_changes") as span:
+        heads = repo_heads(project.repos_dir)
+        trusted = trusted_repo_files(file_paths, manifest.get("repos", {}), heads, project.repos_dir) if old_files else set()
+        changed_files = find_changed_files(file_paths, old_files, new_files, trusted, failed)
+        removed_files = set(old_files).difference(file_paths)
+        span.update(changed=len(changed_files), removed=len(removed_files), trusted=len(trusted))
+    if not changed_files and not removed_files:
+        if old_files:
+            return report(1.0, "Index is up to date.")
+        return report(1.0, "No documents found to ingest.")
+
+    # Work on a private copy of the live generation (or an empty one for a full rebuild)
+    with metrics.span("ingest_copy_generation"):
+        generation, work_dir = new_generation(index_root, base=live_dir if old_files else None)
+        writer = IndexWriter(work_dir)
+        bm25 = open_bm25(work_dir, writer)
+    unchanged_count = len(new_files)
+    total_changed = max(len(changed_files), 1)
+    chunks = iter_changed_chunks(changed_files, old_files, new_files, stale_ids, project.data_dir, failed, retained)
+
+    published = False
     try:
-        vectorstore = FAISS.from_documents(split_docs, embeddings)
-        
-        # Save index
-        vectorstore.save_local(FAISS_INDEX_DIR)
-        print(f"FAISS index saved to {FAISS_INDEX_DIR}")
-        
-    except Exception as e:
-        print(f"Error creating FAISS index: {e}")
+        # Vectors are added to the index batch by batch as the embedding workers finish them
+        started = time.time()
+        embedded = 0
+        # One for the whole run: a throttled batch slows the next ones down too
+        backoff = AdaptiveBackoff()
+        # Loading, embedding and indexing overlap, so they are timed as one streaming phase
+        with metrics.span("ingest_embed_and_index") as span:
+            for batch in iter_batches(chunks, INGEST_BATCH_SIZE):
+                texts = [chunk.page_content for chunk, _ in batch]
+                for start, vectors in embed_batches(texts, embeddings, backoff=backoff):
+                    end = start + len(vectors)
+                    metadatas = [chunk.metadata for chunk, _ in batch[start:end]]
+                    ids = [chunk_id for _, chunk_id in batch[start:end]]
+                    writer.add(ids, texts[start:end], metadatas, vectors)
+                    bm25.add(ids, texts[start:end])
+                    embedded += len(vectors)
+                done_files = len(new_files) - unchanged_count
+                report(done_files / total_changed, f"Embedded {embedded} chunks ({done_files}/{len(changed_files)} changed files)...")
+            span["chunks"] = embedded
+        metrics.inc("devmate_ingest_chunks_total", embedded, help="Chunks embedded and indexed by ingestion")
+
+        if retained:
+            with metrics.span("ingest_refresh_metadata", chunks=len(retained)):
+                writer.update_metadata([chunk_id for _, chunk_id in retained], [chunk.metadata for chunk, _ in retained])
+
+        for file_path in removed_files:
+            stale_ids.extend(old_files[file_path]["chunks"])
+
+        if writer.index is None:
+            return report(1.0, "No documents found to ingest.")
+
+        if embedded:
+            elapsed = max(time.time() - started, 1e-6)
+            log.info(f"Embedded {embedded} chunks in {elapsed:.1f}s ({embedded / elapsed:.1f} chunks/sec, concurrency {EMBED_CONCURRENCY}).")
+
+        # Deleting once at the end removes every stale label in a single pass over the index
+        if stale_ids:
+            log.info(f"Removing {len(stale_ids)} stale chunks...")
+            with metrics.span("ingest_delete_stale", chunks=len(stale_ids)):
+                writer.delete(stale_ids)
+                bm25.delete(stale_ids)
+
+        # Pick flat / HNSW / IVF (optionally PQ) for the corpus size
+        with metrics.span("ingest_build_index"):
+            kind, pq = describe(writer.finalize())
+
+        # Save the generation, then make it the live one
+        with metrics.span("ingest_save"):
+            writer.save()
+            bm25.commit()
+            repos = indexed_heads(heads, manifest.get("repos", {}), failed, project.repos_dir)
+            save_manifest(work_dir, {"version": MANIFEST_VERSION, "files": new_files, "repos": repos})
+            writer.close()
+            bm25.close()
+        with metrics.span("ingest_publish"):
+            publish_generation(index_root, generation, work_dir)
+            published = True
+            remove_legacy_files(index_root)
+        return report(1.0, f"FAISS {kind}{f'+PQ{pq}' if pq else ''} index saved to {index_root} (generation {generation[:8]})")
+
+    except Exception:
+        metrics.inc("devmate_ingest_failures_total", help="Ingest runs that raised")
+        log.exception("Error creating FAISS index")
+        raise
+    finally:
+        if not published:
+            # The live generation is untouched; the half-built copy is thrown away
+            writer.close()
+            bm25.close()
+            discard_generation(work_dir)
+
+def reset_data(project=None):
+    """
+    Deletes every uploaded document and cloned repo of a project, leaving the empty folder structure.
+    """
+    from repo_sync import remove_tree
+    project = get_project(project)
+    remove_tree(project.data_dir)
+    project.create()
+
+def reset_index(project=None):
+    """
+    Deletes every index generation of a project. Waits for a running ingest to finish first.
+    """
+    index_root = get_project(project).index_dir
+    with write_lock(index_root):
+        clear_generations(index_root)
+        remove_legacy_files(index_root)
+        report_path = os.path.join(index_root, REPORT_FILE)
+        if os.path.exists(report_path):
+            os.remove(report_path)
 
 if __name__ == "__main__":
-    ingest_docs()
+    import sys
+    # python ingest_docs.py [project]
+    ingest_docs(project=sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from embedding_cache import CACHE_DIR
+from projects import Project, DEFAULT_PROJECT
+import metrics
+
+log = metrics.get_logger("jobs")
+
+JOBS_PATH = os.path.join(CACHE_DIR, "jobs.sqlite")
+# Seconds an idle worker sleeps before checking for jobs queued by another process
+JOB_POLL_INTERVAL = float(os.getenv("DEVMATE_JOB_POLL_INTERVAL", "2"))
+# Progress is written to SQLite at most this often per job
+PROGRESS_INTERVAL = 0.5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else (or the platform cannot tell)
+        return True
+    return True
+
+class JobQueue:
+    """
+    Persistent queue of knowledge-base jobs (ingest, sync, quiz_bank, reset) in SQLite.
+    Every job acts on the project named in its payload (the default project if none).
+    Jobs survive restarts: a job left "running" by a process that died is queued again.
+    An identical job that is still queued is reused instead of queued twice, so repeated
+    Refresh clicks cost one ingest.
+    """
+
+    def __init__(self, path=JOBS_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT NOT NULL DEFAULT '',
+                worker_pid INTEGER,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self._conn.commit()
+
+    def submit(self, kind, payload=None):
+        """
+        Queues a job and returns its ID.
+        """
+        payload = json.dumps(payload or {}, sort_keys=True)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND kind = ? AND payload = ?", (QUEUED, kind, payload)
+            ).fetchone()
+            if row:
+                return row[0]
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, payload, status, message, created) VALUES (?, ?, ?, ?, ?)",
+                (kind, payload, QUEUED, "Waiting for the worker...", time.time())
+            )
+            return cursor.lastrowid
+
+    def claim(self):
+        """
+        Marks the oldest queued job as running by this process and returns it, or None.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if not row:
+                return None
+            # The status check makes the claim safe against workers in other processes
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, started = ?, message = ? WHERE id = ? AND status = ?",
+                (RUNNING, os.getpid(), time.time(), "Starting...", row[0], QUEUED)
+            )
+            if cursor.rowcount == 0:
+                return None
+        return self.get(row[0])
+
+    def requeue_orphans(self):
+        """
+        Queues again the jobs whose worker process is gone.
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT id, worker_pid FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for job_id, pid in rows:
+                if pid != os.getpid() and not (pid and _pid_alive(pid)):
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, progress = 0, message = ? WHERE id = ?",
+                        (QUEUED, "Restarted after the worker stopped", job_id)
+                    )
+
+    def update(self, job_id, progress, message):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?", (progress, message, job_id))
+
+    def finish(self, job_id, status, message):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, message = ?, finished = ? WHERE id = ?",
+                (status, status, message, time.time(), job_id)
+            )
+
+    def _rows(self, query, params=()):
+        columns = ("id", "kind", "payload", "status", "progress", "message", "created", "started", "finished")
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(columns)} FROM jobs {query}", params).fetchall()
+        jobs = [dict(zip(columns, row)) for row in rows]
+        for job in jobs:
+            job["payload"] = json.loads(job["payload"])
+        return jobs
+
+    def get(self, job_id):
+        jobs = self._rows("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def recent(self, limit=5):
+        return self._rows("ORDER BY id DESC LIMIT ?", (limit,))
+
+    def pending(self):
+        return self._rows("WHERE status IN (?, ?) ORDER BY id", (QUEUED, RUNNING))
+
+def run_job(job, progress):
+    """
+    Executes one job. Returns the final status message; raises on failure.
+    """
+    # Imported here so the UI process does not load the ingestion stack until it is needed
+    import ingest_docs
+    kind = job["kind"]
+    payload = job["payload"]
+    project = Project(payload.get("project", DEFAULT_PROJECT))
+    if kind == "ingest":
+        return ingest_docs.ingest_docs(progress=progress, project=project)
+    if kind == "sync":
+        import repo_sync
+        # One repo (registered on first use) or every registered repo
+        if payload.get("url"):
+            progress(0.0, f"Fetching {payload['url']}...")
+            synced = f"Synced {repo_sync.sync_repo(payload['url'], repos_dir=project.repos_dir)}."
+        else:
+            progress(0.0, "Fetching all repos...")
+            failed = repo_sync.sync_all(repos_dir=project.repos_dir)
+            synced = f"Could not update: {', '.join(failed)}." if failed else "Synced all repos."
+        message = ingest_docs.ingest_docs(progress=progress, project=project)
+        return f"{synced} {message}"
+    if kind == "quiz_bank":
+        from quiz_bank import build_quiz_bank
+        return build_quiz_bank(progress=progress, project=project)
+    if kind == "reset":
+        from quiz_bank import get_quiz_bank
+        ingest_docs.reset_index(project)
+        ingest_docs.reset_data(project)
+        get_quiz_bank(project).clear()
+        return f"Knowledge base of {project.name} wiped."
+    raise ValueError(f"Unknown job kind: {kind}")
+
+class JobWorker:
+    """
+    Background thread that runs queued jobs one at a time.
+    Index writes are additionally serialized across processes by ingest_docs' write lock,
+    so a CLI ingest and the app never build a generation at the same time.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="devmate-jobs", daemon=True)
+
+    def start(self):
+        self.queue.requeue_orphans()
+        self._thread.start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        last_write = [0.0]
+
+        def progress(fraction, message):
+            now = time.time()
+            if now - last_write[0] >= PROGRESS_INTERVAL or fraction >= 1.0:
+                last_write[0] = now
+                self.queue.update(job["id"], fraction, message)
+
+        started = time.time()
+        try:
+            message = run_job(job, progress)
+            self.queue.finish(job["id"], DONE, message or "Done")
+            status = DONE
+            if job["kind"] in ("ingest", "sync"):
+                # New or changed chunks: write quiz questions for them while nobody waits
+                self.queue.submit("quiz_bank", {"project": job["payload"].get("project", DEFAULT_PROJECT)})
+        except Exception as e:
+            log.exception(f"Job {job['id']} ({job['kind']}) failed")
+            self.queue.finish(job["id"], FAILED, str(e))
+            status = FAILED
+        metrics.inc("devmate_jobs_total", help="Background jobs run, by kind and outcome", kind=job["kind"], status=status)
+        metrics.observe("devmate_job_seconds", time.time() - started, help="Background job duration", kind=job["kind"])
+
+_queue = None
+_worker = None
+_worker_lock = threading.Lock()
+
+def get_queue():
+    """
+    Returns the process-wide job queue, starting its worker thread on first use.
+    """
+    global _queue, _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _queue = JobQueue()
+                worker = JobWorker(_queue)
+                worker.start()
+                _worker = worker
+    return _queue
+
+def submit_job(kind, payload=None):
+    """
+    Queues a job for the background worker and returns its ID.
+    """
+    queue = get_queue()
+    job_id = queue.submit(kind, payload)
+    _worker.notify()
+    return job_id
@@ -0,0 +1,527 @@
+import os
+import json
+import uuid
+import shutil
+import sqlite3
+import pathlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from ann_index import new_index, to_flat, supports_removal, finalize_index, search_params, describe, target_type, TOMBSTONE_MAX_RATIO
+
+# Vectors, labelled with the docstore row IDs
+INDEX_FILE = "index.faiss"
+# Chunk text and metadata by label; replaces LangChain's pickled docstore
+DOCSTORE_FILE = "docstore.sqlite"
+# Chunk metadata copied into docstore columns so searches can be scoped with SQL
+FILTER_FIELDS = ("origin", "repo", "path", "language", "file_type")
+# Filters whose matching labels are kept per loaded index
+FILTER_CACHE_SIZE = 32
+
+# Every ingest writes a complete new generation directory next to the live one and then
+# repoints CURRENT at it, so readers only ever see a fully written index
+GENERATIONS_DIR = "generations"
+CURRENT_FILE = "CURRENT"
+# Published generations in publish order, oldest first. Pruning goes by this order: directory
+# mtimes are not a publish order, they change whenever something is written inside them.
+PUBLISHED_FILE = "PUBLISHED"
+LOCK_FILE = "write.lock"
+# Generations kept on disk: the live one plus the one readers may still be finishing with
+KEEP_GENERATIONS = 2
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+def read_index(path, mmap=True):
+    """
+    Reads a FAISS index. With mmap=True the vectors are mapped from the file instead of
+    copied into RAM, so loading is near-instant and the pages are shared between processes.
+    Falls back to a regular read for index types or faiss builds that cannot be mapped.
+    """
+    if mmap:
+        for flag in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            if not hasattr(faiss, flag):
+                continue
+            try:
+                return faiss.read_index(path, getattr(faiss, flag) | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
+
+def write_index(index, path):
+    """
+    Writes a FAISS index atomically. Readers that mapped the previous file keep a valid view of it.
+    """
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+def connect_readonly(path):
+    """
+    Opens a SQLite file of a published generation. Generations never change once published,
+    so the file is opened immutable: no journal, lock or -wal/-shm file is ever created in it.
+    """
+    uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro&immutable=1"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+def _connect(path):
+    # Write side only: the working directory of a generation is private to one ingest
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # A rollback journal leaves nothing behind once committed (copies of WAL files would keep WAL)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    # Labels are never reused, so a reader still holding an older index can only miss
+    # deleted chunks, never get someone else's text
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            label INTEGER PRIMARY KEY AUTOINCREMENT,
+            chunk_id TEXT UNIQUE NOT NULL,
+            text TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            origin TEXT,
+            repo TEXT,
+            path TEXT,
+            language TEXT,
+            file_type TEXT
+        )
+    """)
+    # Docstores written before chunks carried filter fields
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+    for field in FILTER_FIELDS:
+        if field not in columns:
+            conn.execute(f"ALTER TABLE chunks ADD COLUMN {field} TEXT")
+    for field in ("origin", "repo", "language", "file_type"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS chunks_{field} ON chunks ({field})")
+    # Labels of deleted chunks still in an HNSW graph (see ann_index.TOMBSTONE_MAX_RATIO)
+    conn.execute("CREATE TABLE IF NOT EXISTS tombstones (label INTEGER PRIMARY KEY)")
+    conn.commit()
+    return conn
+
+def _filter_sql(filters):
+    """
+    Turns {field: value or [values]} into a WHERE clause. `path` matches as a prefix.
+    """
+    clauses = []
+    params = []
+    for field, value in sorted(filters.items()):
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field: {field}")
+        values = list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        if not values:
+            continue
+        if field == "path":
+            clauses.append("(" + " OR ".join("path LIKE ? ESCAPE '\\'" for _ in values) + ")")
+            params.extend(v.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for v in values)
+        else:
+            clauses.append(f"{field} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    return " AND ".join(clauses), params
+
+def filter_key(filters):
+    """
+    Returns a hashable, order-independent form of a filter dict (None when it filters nothing).
+    """
+    if not filters:
+        return None
+    key = []
+    for field, value in sorted(filters.items()):
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        if values:
+            key.append((field, tuple(sorted(values))))
+    return tuple(key) or None
+
+def _document(text, metadata):
+    return Document(page_content=text, metadata=json.loads(metadata))
+
+def exists(directory):
+    return os.path.exists(os.path.join(directory, INDEX_FILE)) and os.path.exists(os.path.join(directory, DOCSTORE_FILE))
+
+class KnowledgeBase:
+    """
+    Read side of the index: a memory-mapped FAISS index plus the SQLite docstore.
+    Documents are only read for the hits of a search, so memory use does not grow with
+    the number of chunks and nothing is unpickled.
+    """
+
+    def __init__(self, directory, embeddings=None, mmap=True):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.index = read_index(os.path.join(directory, INDEX_FILE), mmap=mmap)
+        self._lock = threading.Lock()
+        self._conn = connect_readonly(os.path.join(directory, DOCSTORE_FILE))
+        self._filter_cache = OrderedDict()
+        tables = {name for (name,) in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        # Docstores written before chunks carried filter fields cannot be scoped until re-ingested
+        self._fields = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")} & set(FILTER_FIELDS)
+        # Unscoped searches skip these; scoped ones only ever select live labels
+        self._tombstones = np.fromiter(
+            (label for (label,) in self._conn.execute("SELECT label FROM tombstones")) if "tombstones" in tables else (),
+            dtype="int64"
+        )
+
+    @property
+    def ntotal(self):
+        # Vectors of live chunks: HNSW tombstones are not counted
+        return self.index.ntotal - len(self._tombstones)
+
+    def doc_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _rows(self, column, keys):
+        with self._lock:
+            rows = {}
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows.update(
+                    (row[0], row[1:]) for row in self._conn.execute(
+                        f"SELECT {column}, chunk_id, text, metadata FROM chunks WHERE {column} IN ({placeholders})", part
+                    )
+                )
+            return rows
+
+    def chunk_ids(self):
+        with self._lock:
+            return {chunk_id for (chunk_id,) in self._conn.execute("SELECT chunk_id FROM chunks")}
+
+    def describe_labels(self, labels):
+        """
+        Returns {label: (chunk_id, text_length)} without reading the chunk texts.
+        """
+        labels = [int(label) for label in labels]
+        with self._lock:
+            rows = {}
+            for start in range(0, len(labels), 500):
+                part = labels[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows.update(
+                    (label, (chunk_id, length)) for label, chunk_id, length in self._conn.execute(
+                        f"SELECT label, chunk_id, length(text) FROM chunks WHERE label IN ({placeholders})", part
+                    )
+                )
+            return rows
+
+    def select(self, filters):
+        """
+        Returns (labels, chunk_ids) of the chunks matching `filters`, or None if filters is empty.
+        Chunks added after this index was loaded are not in it anyway, and deleted ones are
+        skipped when read, so results are cached for the lifetime of the loaded index.
+        """
+        key = filter_key(filters)
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._filter_cache:
+                self._filter_cache.move_to_end(key)
+                return self._filter_cache[key]
+            where, params = _filter_sql(dict(key))
+            if all(field in self._fields for field, _ in key):
+                rows = self._conn.execute(f"SELECT label, chunk_id FROM chunks WHERE {where}", params).fetchall()
+            else:
+                rows = []
+            selection = (
+                np.fromiter((label for label, _ in rows), dtype="int64", count=len(rows)),
+                frozenset(chunk_id for _, chunk_id in rows),
+            )
+            self._filter_cache[key] = selection
+            while len(self._filter_cache) > FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
+            return selection
+
+    def facets(self):
+        """
+        Returns {field: sorted distinct values} for the fields a search can be scoped by.
+        """
+        with self._lock:
+            return {
+                field: [value for (value,) in self._conn.execute(
+                    f"SELECT DISTINCT {field} FROM chunks WHERE {field} IS NOT NULL AND {field} != '' ORDER BY {field}"
+                )]
+                for field in ("origin", "repo", "language", "file_type") if field in self._fields
+            }
+
+    def search_by_vector(self, vector, k=4, labels=None):
+        """
+        Returns up to k (Document, distance) pairs, closest first.
+        If labels is given (see select()), only those chunks are searched.
+        """
+        query = np.asarray([vector], dtype="float32")
+        if labels is None and len(self._tombstones):
+            distances, labels = self.index.search(query, k, params=search_params(self.index, self._tombstones, k, exclude=True))
+        elif labels is None:
+            distances, labels = self.index.search(query, k)
+        elif len(labels) == 0:
+            return []
+        else:
+            distances, labels = self.index.search(query, k, params=search_params(self.index, labels, k))
+        hits = [(int(label), float(distance)) for label, distance in zip(labels[0], distances[0]) if label >= 0]
+        rows = self._rows("label", [label for label, _ in hits])
+        results = []
+        for label, distance in hits:
+            # Deleted by an ingest that finished after this index was loaded
+            if label in rows:
+                _, text, metadata = rows[label]
+                results.append((_document(text, metadata), distance))
+        return results
+
+    def similarity_search(self, query, k=4, filters=None):
+        selection = self.select(filters)
+        labels = selection[0] if selection is not None else None
+        return [doc for doc, _ in self.search_by_vector(self.embeddings.embed_query(query), k, labels)]
+
+    def get_documents(self, chunk_ids):
+        """
+        Returns {chunk_id: Document} for the chunk IDs that exist.
+        """
+        rows = self._rows("chunk_id", list(chunk_ids))
+        return {chunk_id: _document(text, metadata) for chunk_id, (_, text, metadata) in rows.items()}
+
+    def get(self, chunk_id):
+        return self.get_documents([chunk_id]).get(chunk_id)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            # Drops the memory map (or the in-RAM vectors)
+            self.index = None
+            self._filter_cache.clear()
+
+class IndexWriter:
+    """
+    Write side of the index, used by ingestion. The index is loaded fully into RAM (a mapped
+    index is read-only) and every chunk gets a new docstore label that doubles as its FAISS ID.
+    Nothing is visible to readers until save().
+    """
+
+    def __init__(self, directory, rebuild=False):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self._conn = _connect(os.path.join(directory, DOCSTORE_FILE))
+        self.index = None
+        if rebuild:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM tombstones")
+        elif os.path.exists(self.index_path):
+            self.index = read_index(self.index_path, mmap=False)
+
+    @property
+    def ntotal(self):
+        # Vectors of live chunks: HNSW tombstones are not counted
+        if self.index is None:
+            return 0
+        return self.index.ntotal - self._conn.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+
+    def doc_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, chunk_ids, texts, metadatas, vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        labels = []
+        for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+            cursor = self._conn.execute(
+                f"INSERT INTO chunks (chunk_id, text, metadata, {', '.join(FILTER_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (chunk_id, text, json.dumps(metadata), *(metadata.get(field) for field in FILTER_FIELDS))
+            )
+            labels.append(cursor.lastrowid)
+        if self.index is None:
+            self.index = new_index(vectors.shape[1])
+        self.index.add_with_ids(vectors, np.asarray(labels, dtype="int64"))
+
+    def update_metadata(self, chunk_ids, metadatas):
+        """
+        Replaces the stored metadata of existing chunks, e.g. the line range of a code chunk
+        whose content is unchanged but moved within its file. The vectors are kept.
+        """
+        self._conn.executemany(
+            f"UPDATE chunks SET metadata = ?, {', '.join(f'{field} = ?' for field in FILTER_FIELDS)} WHERE chunk_id = ?",
+            [
+                (json.dumps(metadata), *(metadata.get(field) for field in FILTER_FIELDS), chunk_id)
+                for chunk_id, metadata in zip(chunk_ids, metadatas)
+            ]
+        )
+
+    def delete(self, chunk_ids):
+        labels = []
+        for start in range(0, len(chunk_ids), 500):
+            part = chunk_ids[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            labels.extend(label for (label,) in self._conn.execute(
+                f"SELECT label FROM chunks WHERE chunk_id IN ({placeholders})", part
+            ))
+            self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", part)
+        if labels and self.index is not None:
+            if supports_removal(self.index):
+                self.index.remove_ids(np.asarray(labels, dtype="int64"))
+            else:
+                # Rebuilding the graph for every edit would take minutes; searches skip tombstones
+                self._conn.executemany("INSERT OR IGNORE INTO tombstones (label) VALUES (?)", [(label,) for label in labels])
+
+    def tombstones(self):
+        return [label for (label,) in self._conn.execute("SELECT label FROM tombstones")]
+
+    def iter_documents(self):
+        """
+        Yields (chunk_id, text) for every stored chunk.
+        """
+        for chunk_id, text in self._conn.execute("SELECT chunk_id, text FROM chunks ORDER BY label"):
+            yield chunk_id, text
+
+    def finalize(self):
+        """
+        Picks flat / HNSW / IVF (optionally PQ) for the corpus size. HNSW tombstones are only
+        compacted away once they pass TOMBSTONE_MAX_RATIO of the graph, or when the index is
+        rebuilt as another type anyway.
+        """
+        tombstones = self.tombstones()
+        if tombstones and (
+            len(tombstones) > TOMBSTONE_MAX_RATIO * self.index.ntotal or describe(self.index) != target_type(self.index)
+        ):
+            compacted = to_flat(self.index)
+            compacted.remove_ids(np.asarray(tombstones, dtype="int64"))
+            self.index = compacted
+            self._conn.execute("DELETE FROM tombstones")
+        self.index = finalize_index(self.index)
+        return self.index
+
+    def save(self):
+        # Index first: if the docstore commit is lost, the counts no longer match the
+        # manifest and the next ingest rebuilds instead of trusting a half-written pair
+        write_index(self.index, self.index_path)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+@contextmanager
+def write_lock(root):
+    """
+    Holds an exclusive lock on the index directory, so only one ingest (in any thread or
+    process) builds a generation at a time. Readers never take it.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILE), "a+") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def current_generation(root):
+    """
+    Returns the name of the live generation, or None if nothing has been published.
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            generation = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return generation if generation and os.path.isdir(generation_dir(root, generation)) else None
+
+def generation_dir(root, generation):
+    return os.path.join(root, GENERATIONS_DIR, generation)
+
+def new_generation(root, base=None):
+    """
+    Creates a private working directory for the next generation and returns (name, path).
+    If `base` (a generation directory) is given, its files are copied in to be updated
+    incrementally; SQLite files are copied through the backup API so open readers are safe.
+    """
+    generation = uuid.uuid4().hex
+    work_dir = generation_dir(root, generation) + ".tmp"
+    os.makedirs(work_dir)
+    if base:
+        for name in os.listdir(base):
+            src = os.path.join(base, name)
+            if not os.path.isfile(src) or name.endswith(("-wal", "-shm", "-journal")):
+                continue
+            dst = os.path.join(work_dir, name)
+            if name.endswith(".sqlite"):
+                source, target = connect_readonly(src), sqlite3.connect(dst)
+                try:
+                    source.backup(target)
+                finally:
+                    source.close()
+                    target.close()
+            else:
+                shutil.copy2(src, dst)
+    return generation, work_dir
+
+def discard_generation(work_dir):
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+def _write_atomic(path, text):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+def published_generations(root):
+    """
+    Returns the published generation names, oldest first.
+    """
+    try:
+        with open(os.path.join(root, PUBLISHED_FILE), "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def publish_generation(root, generation, work_dir):
+    """
+    Makes a finished working directory the live index: one rename for the directory,
+    one atomic replace for the CURRENT pointer. Older generations are then pruned.
+    The caller holds write_lock().
+    """
+    os.replace(work_dir, generation_dir(root, generation))
+    history = published_generations(root)
+    previous = current_generation(root)
+    # Indexes published before the history was kept
+    if previous and previous not in history:
+        history.append(previous)
+    history.append(generation)
+    _write_atomic(os.path.join(root, PUBLISHED_FILE), "\n".join(history[-KEEP_GENERATIONS * 4:]) + "\n")
+    _write_atomic(os.path.join(root, CURRENT_FILE), generation)
+    prune_generations(root)
+
+def prune_generations(root, keep=KEEP_GENERATIONS):
+    """
+    Removes all but the `keep` most recently published generations (always including the
+    live one and the one it replaced, which readers may still be finishing with) and any
+    abandoned working directories. Deletion is best-effort: a file still open by a reader
+    on Windows is simply retried on the next ingest.
+    """
+    base = os.path.join(root, GENERATIONS_DIR)
+    if not os.path.isdir(base):
+        return
+    kept = set(published_generations(root)[-max(keep, 2):]) | {current_generation(root)}
+    for entry in os.scandir(base):
+        if entry.is_dir() and entry.name not in kept:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def clear_generations(root):
+    """
+    Unpublishes and deletes every generation. The caller holds write_lock().
+    """
+    for name in (CURRENT_FILE, PUBLISHED_FILE):
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(os.path.join(root, GENERATIONS_DIR), ignore_errors=True)
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serve /metrics in Prometheus text format on this port (e.g. 9464); unset means no server
+METRICS_PORT = os.getenv("DEVMATE_METRICS_PORT")
+METRICS_HOST = os.getenv("DEVMATE_METRICS_HOST", "127.0.0.1")
+# "json" writes one JSON object per log line; "text" is the plain message
+LOG_FORMAT = os.getenv("DEVMATE_LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("DEVMATE_LOG_LEVEL", "INFO")
+# Histogram bucket upper bounds in seconds, from a cached answer to a slow full ingest phase
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# --- Structured logs ---
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+_root_logger = logging.getLogger("devmate")
+if not _root_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(_JSONFormatter() if LOG_FORMAT == "json" else _TextFormatter("%(message)s"))
+    _root_logger.addHandler(_handler)
+    _root_logger.setLevel(LOG_LEVEL.upper())
+    _root_logger.propagate = False
+
+def get_logger(name):
+    """
+    Returns the "devmate.<name>" logger. Extra structured fields go in `extra={"fields": {...}}`,
+    or use log_event().
+    """
+    return logging.getLogger(f"devmate.{name}")
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """
+    Logs one structured event: a short name plus key/value fields.
+    """
+    logger.log(level, event, extra={"fields": fields})
+
+# --- Metrics registry ---
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Registry:
+    """
+    Process-wide counters and histograms with labels, plus "stats" collectors: functions
+    returning a dict of numbers (a cache's hits, misses and hit rate, the gateway's queue)
+    that are read when the metrics are rendered and exported as gauges.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = {}
+
+    def inc(self, name, value=1, help=None, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def observe(self, name, value, help=None, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {"buckets": [0] * len(SECONDS_BUCKETS), "sum": 0.0, "count": 0}
+            # Buckets are cumulative, as in the exposition format
+            for i, bound in enumerate(SECONDS_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            if help:
+                self._help.setdefault(name, help)
+
+    def register_stats(self, prefix, stats):
+        """
+        Exports every numeric value of `stats()` as the gauge devmate_<prefix>_<key>.
+        Registering the same prefix again replaces the previous collector.
+        """
+        with self._lock:
+            self._collectors[prefix] = stats
+
+    def snapshot(self):
+        """
+        Returns {"counters", "histograms", "gauges"} as plain dicts, for tests and the UI.
+        """
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: {"sum": h["sum"], "count": h["count"], "buckets": list(h["buckets"])} for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+            collectors = list(self._collectors.items())
+        gauges = {}
+        for prefix, stats in collectors:
+            try:
+                values = stats()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"devmate_{prefix}_{key}"] = value
+        return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def render_prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in sorted(snapshot["counters"].items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(snapshot["histograms"].items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(series.items()):
+                for bound, count in zip(SECONDS_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+register_stats = registry.register_stats
+
+# --- Per-request traces and timing spans ---
+
+class Trace:
+    """
+    The spans recorded while serving one request, in the order they ended.
+    Each span is {"name", "start" (seconds since the trace began), "duration", **attributes}.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration, **attributes):
+        with self._lock:
+            self.spans.append({"name": name, "start": start - self.started, "duration": duration, **attributes})
+
+    def total(self):
+        return time.time() - self.started
+
+_current_trace = contextvars.ContextVar("devmate_trace", default=None)
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def trace(name, logger=None, **attributes):
+    """
+    Collects the spans of one request into a Trace (yielded) and logs a summary at the end.
+    Spans recorded in other threads join it when the trace is passed to span() explicitly.
+    """
+    active = Trace(name, **attributes)
+    token = _current_trace.set(active)
+    try:
+        yield active
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A generator holding the trace was closed from another context
+            pass
+        stages = {span["name"]: round(span["duration"], 4) for span in active.spans}
+        log_event(logger or get_logger("trace"), f"{name} trace", total=round(active.total(), 4), stages=stages, **active.attributes)
+
+def record_span(name, start, duration, trace=None, **attributes):
+    """
+    Records a stage that was timed by hand (e.g. across the yields of a stream).
+    """
+    observe("devmate_stage_seconds", duration, help="Time spent per pipeline stage", stage=name)
+    active = trace or _current_trace.get()
+    if active is not None:
+        active.add(name, start, duration, **attributes)
+
+@contextmanager
+def span(name, trace=None, **attributes):
+    """
+    Times the enclosed block as pipeline stage `name`: a histogram observation, and a span
+    on the current (or given) trace. Failures are counted in devmate_stage_errors_total.
+    The yielded dict can be filled with attributes known only at the end (e.g. hit counts).
+    """
+    start = time.time()
+    extra = dict(attributes)
+    try:
+        yield extra
+    except Exception:
+        inc("devmate_stage_errors_total", help="Pipeline stages that raised", stage=name)
+        extra["error"] = True
+        raise
+    finally:
+        record_span(name, start, time.time() - start, trace=trace, **extra)
+
+# --- Prometheus endpoint ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the console
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port=None, host=METRICS_HOST):
+    """
+    Serves /metrics from a daemon thread if a port is given or DEVMATE_METRICS_PORT is set.
+    Safe to call on every Streamlit rerun: only the first call starts a server.
+    Returns the server, or None when disabled or the port is taken.
+    """
+    global _server
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                # Another process (e.g. a second Streamlit worker) already serves it
+                log_event(get_logger("metrics"), "metrics server not started", level=logging.WARNING, port=port, error=str(e))
+                return None
+            threading.Thread(target=_server.serve_forever, name="devmate-metrics", daemon=True).start()
+            log_event(get_logger("metrics"), "metrics server started", host=host, port=port)
+    return _server
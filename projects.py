@@ -0,0 +1,72 @@
+import os
+import re
+import contextvars
+
+# Every project except the default one lives in its own folder in here
+PROJECTS_DIR = os.getenv("DEVMATE_PROJECTS_DIR", "projects")
+DEFAULT_PROJECT = "default"
+# The default project keeps the pre-project layout, so existing deployments keep their index
+DEFAULT_DATA_DIR = "data"
+DEFAULT_INDEX_DIR = "faiss_index"
+
+_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+class Project:
+    """
+    One namespaced knowledge base: its uploaded docs and cloned repos (data_dir) and its index
+    generations, manifest, keyword index and quiz bank (index_dir). Nothing is shared between
+    projects except the content-addressed caches in .cache.
+    """
+
+    def __init__(self, name):
+        if not _NAME.match(name or ""):
+            raise ValueError(f"Invalid project name {name!r}: use lowercase letters, digits, '-' and '_' (at most 64).")
+        self.name = name
+        if name == DEFAULT_PROJECT:
+            self.data_dir = DEFAULT_DATA_DIR
+            self.index_dir = DEFAULT_INDEX_DIR
+        else:
+            self.data_dir = os.path.join(PROJECTS_DIR, name, "data")
+            self.index_dir = os.path.join(PROJECTS_DIR, name, "faiss_index")
+        self.docs_dir = os.path.join(self.data_dir, "docs")
+        self.repos_dir = os.path.join(self.data_dir, "repos")
+
+    def __repr__(self):
+        return f"Project({self.name!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Project) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def create(self):
+        os.makedirs(self.docs_dir, exist_ok=True)
+        os.makedirs(self.repos_dir, exist_ok=True)
+        return self
+
+# Set by app.py at the start of every script run, like the gateway's session ID
+_current = contextvars.ContextVar("devmate_project", default=DEFAULT_PROJECT)
+
+def set_project(name):
+    _current.set(Project(name).name)
+
+def current_project():
+    return _current.get()
+
+def get_project(project=None):
+    """
+    Returns the Project for a name or Project, or the session's current project for None.
+    """
+    if isinstance(project, Project):
+        return project
+    return Project(project or current_project())
+
+def list_projects():
+    """
+    Returns the project names on disk, the default project first.
+    """
+    names = []
+    if os.path.isdir(PROJECTS_DIR):
+        names = sorted(name for name in os.listdir(PROJECTS_DIR) if _NAME.match(name) and os.path.isdir(os.path.join(PROJECTS_DIR, name)))
+    return [DEFAULT_PROJECT] + [name for name in names if name != DEFAULT_PROJECT]
@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+from ann_index import sample_vectors
+from bedrock_client import get_embeddings
+from bedrock_gateway import gateway
+from rag import use_index, chunk_text
+from projects import get_project
+from structured_output import JSONObjectStream, parse_json_objects
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# Lives next to the project's index generations; questions are tied to chunk IDs, not to a generation
+QUIZ_BANK_FILE = "quiz_bank.sqlite"
+QUIZ_SIZE = 3
+# Chunks turned into questions per background build, each from a different region of the corpus
+QUIZ_SOURCE_CHUNKS = int(os.getenv("DEVMATE_QUIZ_SOURCE_CHUNKS", "24"))
+QUESTIONS_PER_CHUNK = 2
+# Vectors clustered to pick the source chunks; larger indexes are sampled down to this
+QUIZ_SAMPLE_MAX = 20000
+# Too short to carry a question (headings, import blocks)
+MIN_CHUNK_CHARS = 200
+# LLM calls in flight during a build; the gateway keeps the rest of its slots for users
+QUIZ_BUILD_CONCURRENCY = 2
+# The bank is topped up once fewer unseen questions than this are left
+QUIZ_REFILL_BELOW = QUIZ_SIZE * 4
+# Follow-up calls per chunk asking only for the questions a reply was missing
+QUIZ_REPAIR_ATTEMPTS = 1
+
+# Every stored question satisfies this schema; validate_question() enforces it
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string", "minLength": 1},
+        "options": {"type": "array", "items": {"type": "string", "minLength": 1}, "minItems": 4, "maxItems": 4, "uniqueItems": True},
+        "answer": {"type": "string", "description": "Exactly one of the options"},
+    },
+    "required": ["question", "options", "answer"],
+}
+
+QUIZ_PROMPT = """
+Human: Based on the following context, generate {count} multiple-choice questions that test understanding of it.
+Return a JSON list of {count} objects, each matching this JSON schema:
+{schema}
+Do not output any markdown code blocks or text, just the raw JSON list.
+{avoid}
+Context:
+{context}
+
+Assistant:"""
+
+def validate_question(item):
+    """
+    Returns the question in canonical form if it matches QUESTION_SCHEMA, otherwise None:
+    {"question": non-empty str, "options": 4 distinct non-empty str, "answer": one of the options}
+    """
+    if not isinstance(item, dict):
+        return None
+    question = item.get("question")
+    options = item.get("options")
+    answer = item.get("answer")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4:
+        return None
+    if not all(isinstance(option, str) and option.strip() for option in options):
+        return None
+    options = [option.strip() for option in options]
+    if len(set(options)) != 4 or not isinstance(answer, str) or answer.strip() not in options:
+        return None
+    return {"question": question.strip(), "options": options, "answer": answer.strip()}
+
+def parse_questions(text):
+    """
+    Parses an LLM reply into validated questions, salvaging every well-formed question even
+    if the reply as a whole is not valid JSON.
+    """
+    return [question for question in map(validate_question, parse_json_objects(text)) if question]
+
+class QuizBank:
+    """
+    Precomputed quiz questions in SQLite, each tied to the chunk it was written from.
+    Questions whose chunk leaves the index are pruned on the next build; least-served
+    questions are handed out first so repeated quizzes keep showing new material.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                question TEXT NOT NULL UNIQUE,
+                options TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                served INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS questions_chunk ON questions (chunk_id);
+            CREATE INDEX IF NOT EXISTS questions_served ON questions (served);
+        """)
+        self._conn.commit()
+
+    def add(self, chunk_id, source, questions):
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO questions (chunk_id, source, question, options, answer, created) VALUES (?, ?, ?, ?, ?, ?)",
+                [(chunk_id, source, q["question"], json.dumps(q["options"]), q["answer"], time.time()) for q in questions]
+            )
+            return self._conn.total_changes - before
+
+    def chunk_ids(self):
+        with self._lock:
+            return {chunk_id for (chunk_id,) in self._conn.execute("SELECT DISTINCT chunk_id FROM questions")}
+
+    def prune(self, live_chunk_ids):
+        """
+        Deletes the questions whose chunk is no longer indexed. Returns how many were removed.
+        """
+        stale = self.chunk_ids().difference(live_chunk_ids)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM questions WHERE chunk_id = ?", [(chunk_id,) for chunk_id in stale])
+        return len(stale)
+
+    def unserved_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM questions WHERE served = 0").fetchone()[0]
+
+    def candidates(self, limit):
+        """
+        Returns up to `limit` questions, least served first and shuffled within that.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, chunk_id, source, question, options, answer FROM questions ORDER BY served, RANDOM() LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {"id": id_, "chunk_id": chunk_id, "source": source, "question": question, "options": json.loads(options), "answer": answer}
+            for id_, chunk_id, source, question, options, answer in rows
+        ]
+
+    def mark_served(self, question_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE questions SET served = served + 1 WHERE id = ?", [(i,) for i in question_ids])
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM questions")
+
+# Project name -> QuizBank
+_banks = {}
+_bank_lock = threading.Lock()
+
+def get_quiz_bank(project=None):
+    """
+    Returns the process-wide quiz bank of a project (the current project by default).
+    """
+    project = get_project(project)
+    with _bank_lock:
+        if project.name not in _banks:
+            os.makedirs(project.index_dir, exist_ok=True)
+            _banks[project.name] = QuizBank(os.path.join(project.index_dir, QUIZ_BANK_FILE))
+        return _banks[project.name]
+
+def diverse_chunks(knowledge_base, count, exclude=frozenset(), seed=None):
+    """
+    Picks up to `count` chunk IDs spread over the whole corpus: the embeddings are clustered
+    with k-means and the chunk closest to each centroid is taken (skipping `exclude`d and very
+    short chunks). A different seed per build gives different clusters, and so new material.
+    """
+    seed = int(time.time()) if seed is None else seed
+    labels, vectors = sample_vectors(knowledge_base.index, QUIZ_SAMPLE_MAX, seed=seed)
+    info = knowledge_base.describe_labels(labels)
+    usable = [i for i, label in enumerate(labels) if label in info and info[label][1] >= MIN_CHUNK_CHARS and info[label][0] not in exclude]
+    if not usable:
+        return []
+    labels = labels[usable]
+    vectors = np.ascontiguousarray(vectors[usable], dtype="float32")
+    if len(labels) <= count:
+        return [info[label][0] for label in labels]
+
+    kmeans = faiss.Kmeans(vectors.shape[1], count, niter=20, seed=seed, min_points_per_centroid=1)
+    kmeans.train(vectors)
+    distances, assignments = kmeans.index.search(vectors, 1)
+    closest = {}
+    for i, (cluster, distance) in enumerate(zip(assignments[:, 0], distances[:, 0])):
+        if cluster not in closest or distance < closest[cluster][1]:
+            closest[cluster] = (i, distance)
+    return [info[labels[i]][0] for i, _ in closest.values()]
+
+def generate_questions(document, count=QUESTIONS_PER_CHUNK):
+    """
+    Asks the LLM for `count` questions about one chunk. The reply is parsed while it streams:
+    valid questions are kept as soon as they are complete, and the stream is closed once
+    enough have arrived. If the reply falls short (cut off, malformed or invalid items), a
+    follow-up call asks for just the missing questions, at most QUIZ_REPAIR_ATTEMPTS times.
+    Returns (questions, llm_calls).
+    """
+    questions = []
+    calls = 0
+    for attempt in range(1 + QUIZ_REPAIR_ATTEMPTS):
+        missing = count - len(questions)
+        avoid = ""
+        if questions:
+            asked = "\n".join(f"- {q['question']}" for q in questions)
+            avoid = f"Do not repeat these questions:\n{asked}\n"
+        prompt = QUIZ_PROMPT.format(
+            count=missing, schema=json.dumps(QUESTION_SCHEMA), avoid=avoid, context=document.page_content
+        )
+
+        calls += 1
+        parser = JSONObjectStream()
+        # Background work gets its own fair-queue lane, so quiz builds never starve chat sessions
+        stream = gateway.stream(prompt, session_id="quiz-bank")
+        try:
+            for chunk in stream:
+                for item in parser.feed(chunk_text(chunk)):
+                    question = validate_question(item)
+                    if question and all(question["question"] != q["question"] for q in questions):
+                        questions.append(question)
+                if len(questions) >= count:
+                    break
+        finally:
+            # Stops generation early and frees the gateway slot
+            stream.close()
+        if len(questions) >= count:
+            break
+    return questions[:count], calls
+
+def build_quiz_bank(progress=None, project=None):
+    """
+    Generates questions for a diverse sample of not-yet-covered chunks of the project's live
+    index. Runs as a background job after every ingest. Returns a status message.
+    """
+    def report(fraction, message):
+        log.info(message)
+        if progress:
+            progress(min(max(fraction, 0.0), 1.0), message)
+        return message
+
+    project = get_project(project)
+    bank = get_quiz_bank(project)
+    # The index is only needed to pick the chunks, not while the LLM writes questions
+    with use_index(get_embeddings(), project) as (_, knowledge_base, _):
+        if knowledge_base is None:
+            return report(1.0, "No index to build quiz questions from.")
+        pruned = bank.prune(knowledge_base.chunk_ids())
+        chunk_ids = diverse_chunks(knowledge_base, QUIZ_SOURCE_CHUNKS, exclude=bank.chunk_ids())
+        documents = knowledge_base.get_documents(chunk_ids)
+    report(0.0, f"Writing quiz questions for {len(documents)} chunks...")
+
+    added = 0
+    failed = 0
+    calls = 0
+    with ThreadPoolExecutor(max_workers=QUIZ_BUILD_CONCURRENCY) as executor:
+        futures = {executor.submit(generate_questions, doc): chunk_id for chunk_id, doc in documents.items()}
+        for done, (future, chunk_id) in enumerate(futures.items(), start=1):
+            try:
+                questions, chunk_calls = future.result()
+                calls += chunk_calls
+            except Exception as e:
+                log.warning(f"Quiz generation failed for chunk {chunk_id[:12]}: {e}")
+                failed += 1
+                continue
+            source = os.path.basename(documents[chunk_id].metadata.get("source", "Unknown"))
+            added += bank.add(chunk_id, source, questions)
+            report(done / max(len(futures), 1), f"Quiz bank: {added} questions from {done}/{len(futures)} chunks...")
+
+    message = f"Quiz bank: added {added} questions with {calls} LLM calls, removed questions of {pruned} deleted chunks."
+    if failed:
+        message += f" {failed} chunks failed."
+    return report(1.0, message)
+
+def draw_quiz(size=QUIZ_SIZE, project=None):
+    """
+    Serves a quiz from the project's bank: `size` questions about different chunks that are
+    still in the live index, least served first. No LLM call; when the bank runs low, a
+    background build is queued. Returns [] if the bank has nothing to serve yet.
+    """
+    project = get_project(project)
+    bank = get_quiz_bank(project)
+    with use_index(get_embeddings(), project) as (_, knowledge_base, _):
+        if knowledge_base is None:
+            return []
+        candidates = bank.candidates(size * 10)
+        # A question may be about a chunk an ingest removed since the last build
+        live = knowledge_base.get_documents({c["chunk_id"] for c in candidates})
+    quiz = []
+    seen_chunks = set()
+    for candidate in candidates:
+        if candidate["chunk_id"] in live and candidate["chunk_id"] not in seen_chunks:
+            seen_chunks.add(candidate["chunk_id"])
+            quiz.append(candidate)
+            if len(quiz) == size:
+                break
+    bank.mark_served([q["id"] for q in quiz])
+
+    if bank.unserved_count() < QUIZ_REFILL_BELOW:
+        from ingest_jobs import submit_job
+        submit_job("quiz_bank", {"project": project.name})
+    return quiz
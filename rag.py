@@ -1,172 +1,495 @@
 import os
-from langchain_community.vectorstores import FAISS
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from langchain_core.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
 from bedrock_client import get_embeddings, get_llm
+from bedrock_gateway import gateway
+from answer_cache import answer_cache
+from embedding_cache import text_hash
+from bm25_index import BM25Index
+from retrieval import hybrid_search
+from ann_index import tune_index
+from kb_store import KnowledgeBase, INDEX_FILE, current_generation, generation_dir, exists as index_exists, filter_key
+from projects import get_project, DEFAULT_INDEX_DIR
+import metrics
 
-FAISS_INDEX_DIR = "faiss_index"
+log = metrics.get_logger("rag")
 
-FAISS_INDEX_DIR = "faiss_index"
+# Index folder of the default project; every other project has its own (see projects.py)
+FAISS_INDEX_DIR = DEFAULT_INDEX_DIR
+# Keyword index written next to the FAISS index by ingest_docs
+BM25_FILE = "bm25.sqlite"
+# Indexes of the least recently queried projects are dropped from memory beyond this size
+INDEX_MEMORY_BUDGET = int(os.getenv("DEVMATE_INDEX_MEMORY_MB", "2048")) * 1024 * 1024
 
-def ask_devmate(question, role, exp, history=""):
+# Loaded indexes are shared by all sessions in this process, least recently used first: project
+# name -> ResidentIndex. An entry is replaced when its project publishes a new generation and dropped
+# when the budget is exceeded. Readers hold a lease while they search (see use_index), so a question
+# that is already running keeps using the old index while a new one loads, and a retired index is
+# only closed once its last reader is done.
+_resident = OrderedDict()
+_resident_lock = threading.Lock()
+# One per project, so a slow load never blocks questions about other projects
+_reload_locks = {}
+_residency = {"loads": 0, "evictions": 0}
+# project name -> (generation, facets); a published generation never changes, so its facets
+# are read once instead of on every UI rerun. Guarded by _resident_lock.
+_facets = {}
+
+class ResidentIndex:
     """
-    Main function to query the RAG system.
-    Args:
-        question: User's question
-        role: User's role
-        exp: User's experience
-        history: Formatted chat history string
+    One loaded index generation of a project and the number of readers using it.
+    Once retired (evicted or replaced by a newer generation) it is closed when the last
+    reader releases it, which frees its SQLite connections and its memory-mapped vectors.
+    """
+
+    def __init__(self, generation, knowledge_base, bm25, size):
+        self.generation = generation
+        self.knowledge_base = knowledge_base
+        self.bm25 = bm25
+        self.size = size
+        # Both guarded by _resident_lock
+        self.readers = 0
+        self.retired = False
+
+    def close(self):
+        self.knowledge_base.close()
+        if self.bm25 is not None:
+            self.bm25.close()
+
+def get_index_generation(project=None):
+    """
+    Returns the name of the project's live index generation (published by ingest_docs), or None if no index exists.
+    """
+    return current_generation(get_project(project).index_dir)
+
+def _estimate_bytes(index_dir):
+    # The memory-mapped vectors dominate; pages are only resident once searched, so this is an upper bound
+    try:
+        return os.path.getsize(os.path.join(index_dir, INDEX_FILE))
+    except OSError:
+        return 0
+
+def _retire(entry):
+    # Caller holds _resident_lock. Returns True if the caller has to close the entry now.
+    entry.retired = True
+    return entry.readers == 0
+
+def _evict(budget):
+    # Caller holds _resident_lock. The most recently used index always stays, even over budget.
+    # Returns the evicted entries nobody is reading, to be closed outside the lock.
+    unused = []
+    total = sum(entry.size for entry in _resident.values())
+    while total > budget and len(_resident) > 1:
+        name, entry = _resident.popitem(last=False)
+        total -= entry.size
+        _residency["evictions"] += 1
+        if _retire(entry):
+            unused.append(entry)
+        log.info(f"Evicted the index of project {name} ({entry.size / 1e6:.1f} MB) from memory")
+    return unused
+
+def _release(entry):
+    with _resident_lock:
+        entry.readers -= 1
+        unused = entry.retired and entry.readers == 0
+    if unused:
+        entry.close()
+
+def _open(generation, index_dir, embeddings):
+    knowledge_base = KnowledgeBase(index_dir, embeddings)
+    # nprobe / efSearch from DEVMATE_NPROBE and DEVMATE_EF_SEARCH
+    tune_index(knowledge_base.index)
+    bm25_path = os.path.join(index_dir, BM25_FILE)
+    bm25 = BM25Index(bm25_path, readonly=True) if os.path.exists(bm25_path) else None
+    return ResidentIndex(generation, knowledge_base, bm25, _estimate_bytes(index_dir))
+
+def _acquire(embeddings, project, retry=True):
+    """
+    Returns (ResidentIndex with a reader lease taken, whether it was just loaded), or (None, False)
+    if the project has no index. Generations are immutable once published and the vectors are
+    memory-mapped, so a load costs milliseconds regardless of the index size and never sees a
+    half-written index. A generation pruned between reading CURRENT and opening it means a
+    newer one is live by then, so CURRENT is read again once.
+    """
+    generation = get_index_generation(project)
+    if generation is None:
+        return None, False
+    index_dir = generation_dir(project.index_dir, generation)
+    if not index_exists(index_dir):
+        if retry and get_index_generation(project) != generation:
+            return _acquire(embeddings, project, retry=False)
+        return None, False
+
+    # The lease on the current entry is taken under the lock, so it cannot be closed in between
+    with _resident_lock:
+        current = _resident.get(project.name)
+        if current is not None:
+            _resident.move_to_end(project.name)
+            current.readers += 1
+        reload_lock = _reload_locks.setdefault(project.name, threading.Lock())
+    if current is not None and current.generation == generation:
+        return current, False
+
+    # Another thread is already loading the new index: keep serving the old one meanwhile
+    if current is not None and not reload_lock.acquire(blocking=False):
+        return current, False
+    if current is None:
+        reload_lock.acquire()
+
+    unused = []
+    latest, loaded = None, False
+    try:
+        with _resident_lock:
+            resident = _resident.get(project.name)
+            if resident is not None and resident.generation == generation:
+                resident.readers += 1
+                latest = resident
+        if latest is None:
+            try:
+                latest = _open(generation, index_dir, embeddings)
+            except Exception:
+                if not retry or get_index_generation(project) == generation:
+                    raise
+            else:
+                latest.readers = 1
+                loaded = True
+                with _resident_lock:
+                    replaced = _resident.get(project.name)
+                    if replaced is not None and _retire(replaced):
+                        unused.append(replaced)
+                    _resident[project.name] = latest
+                    _resident.move_to_end(project.name)
+                    _residency["loads"] += 1
+                    unused.extend(_evict(INDEX_MEMORY_BUDGET))
+    finally:
+        reload_lock.release()
+        for entry in unused:
+            entry.close()
+        if current is not None:
+            _release(current)
+    if latest is None:
+        # The generation vanished while it was being opened
+        return _acquire(embeddings, project, retry=False)
+    return latest, loaded
+
+@contextmanager
+def use_index(embeddings, project=None):
     """
+    Yields (generation, knowledge_base, bm25) for a project's index (the current project by
+    default), loading it once and reloading only when a new generation is published. The index
+    stays open until the block exits, even if it is evicted or replaced meanwhile, so nothing
+    from it may be kept beyond the block. bm25 is None for indexes built without a keyword
+    index. Yields (None, None, None) if no index exists, including indexes in an older format
+    that have not been re-ingested yet.
+    """
+    project = get_project(project)
+    with metrics.span("index_load", project=project.name) as span:
+        entry, loaded = _acquire(embeddings, project)
+        span["reloaded"] = loaded
+    if entry is None:
+        yield None, None, None
+        return
     try:
-        # Initialize components
+        yield entry.generation, entry.knowledge_base, entry.bm25
+    finally:
+        _release(entry)
+
+def resident_stats():
+    with _resident_lock:
+        return {
+            "projects": len(_resident),
+            "bytes": sum(entry.size for entry in _resident.values()),
+            "budget_bytes": INDEX_MEMORY_BUDGET,
+            **_residency,
+        }
+
+metrics.register_stats("resident_indexes", resident_stats)
+
+def set_search_params(nprobe=None, ef_search=None):
+    """
+    Changes the ANN recall/latency trade-off of the loaded indexes at runtime:
+    nprobe for IVF indexes, efSearch for HNSW. Flat indexes are always exact.
+    """
+    # Under the lock, so no index is closed while it is being tuned
+    with _resident_lock:
+        for entry in _resident.values():
+            tune_index(entry.knowledge_base.index, nprobe, ef_search)
+
+def get_facets(project=None):
+    """
+    Returns the origins, repos, languages and file types present in the project's index, for
+    scope selectors in the UI. Returns {} if no index exists.
+    Cached per (project, generation): the index is only read again after a new ingest.
+    """
+    project = get_project(project)
+    generation = get_index_generation(project)
+    with _resident_lock:
+        cached = _facets.get(project.name)
+    if generation is not None and cached is not None and cached[0] == generation:
+        return cached[1]
+    with use_index(get_embeddings(), project) as (generation, knowledge_base, _):
+        if knowledge_base is None:
+            return {}
+        facets = knowledge_base.facets()
+    with _resident_lock:
+        _facets[project.name] = (generation, facets)
+    return facets
+
+def build_prompt(role, exp, history):
+    """
+    Returns the chat PromptTemplate with the user profile and history baked in.
+    """
+    # Create Prompt with Role/Experience + History context
+    # We use an f-string to bake in the metadata first.
+    # CRITICAL: We must escape curly braces in the inputs to prevent PromptTemplate from treating them as variables.
+    role_safe = role.replace("{", "{{").replace("}", "}}")
+    exp_safe = exp.replace("{", "{{").replace("}", "}}")
+    history_safe = history.replace("{", "{{").replace("}", "}}")
+    
+    template_str = f"""
+    Human: You are DevMate, a helpful developer onboarding assistant.
+    
+    User Profile:
+    - Role: {role_safe}
+    - Experience: {exp_safe}
+    
+    Previous Conversation:
+    {history_safe}
+    
+    Use the following pieces of context to answer the question at the end.
+    
+    Context: {{context}}
+    
+    Question: {{question}}
+    
+    Assistant:"""
+    
+    return PromptTemplate(
+        template=template_str,
+        input_variables=["context", "question"]
+    )
+
+def format_sources(source_docs):
+    """
+    Turns retrieved documents into a de-duplicated list of display names.
+    """
+    sources = []
+    for doc in source_docs:
+        source_name = doc.metadata.get('source', 'Unknown')
+        # Only keep the filename, not the full path
+        source_name = os.path.basename(source_name)
+        # Code chunks carry the symbol and line range they were cut on
+        if doc.metadata.get('symbol'):
+            source_name += f" ({doc.metadata['symbol']}, lines {doc.metadata['start_line']}-{doc.metadata['end_line']})"
+        sources.append(source_name)
+        
+    # Remove duplicates
+    return list(dict.fromkeys(sources))
+
+def chunk_text(chunk):
+    """
+    Extracts the text of a streamed message chunk.
+    Converse streams content as a list of blocks rather than a plain string.
+    """
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+def prepare_answer(question, role, exp, history="", filters=None):
+    """
+    Retrieves context for the question from the current project's index, restricted to the
+    chunks matching `filters` (see kb_store.FILTER_FIELDS), and assembles the prompt.
+    Returns a dict with either "error" (setup failed), "cached" (a semantic cache hit),
+    or "prompt" and "source_docs" to generate a fresh answer. "cache_key" is where the
+    fresh answer is stored in the answer cache, under the "project" namespace.
+    """
+    # Initialize components
+    with metrics.span("client_init"):
         embeddings = get_embeddings()
         llm = get_llm()
+    
+    if not embeddings or not llm:
+        return {"error": "Error: Failed to initialize AWS Bedrock components. Check your credentials."}
         
-        if not embeddings or not llm:
-            return {"answer": "Error: Failed to initialize AWS Bedrock components. Check your credentials.", "sources": []}
-            
-        if not os.path.exists(FAISS_INDEX_DIR):
-            return {"answer": f"Error: FAISS index not found at {FAISS_INDEX_DIR}. Please run 'Re-ingest Knowledge Base' first.", "sources": []}
-            
-        # Load Vector Store
-        vectorstore = FAISS.load_local(FAISS_INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-        
-        # Create Prompt with Role/Experience + History context
-        # We use an f-string to bake in the metadata first.
-        # CRITICAL: We must escape curly braces in the inputs to prevent PromptTemplate from treating them as variables.
-        role_safe = role.replace("{", "{{").replace("}", "}}")
-        exp_safe = exp.replace("{", "{{").replace("}", "}}")
-        history_safe = history.replace("{", "{{").replace("}", "}}")
-        
-        template_str = f"""
-        Human: You are DevMate, a helpful developer onboarding assistant.
-        
-        User Profile:
-        - Role: {role_safe}
-        - Experience: {exp_safe}
-        
-        Previous Conversation:
-        {history_safe}
-        
-        Use the following pieces of context to answer the question at the end.
-        
-        Context: {{context}}
+    # Load Vector Store (cached per process, per project); held open until retrieval is done
+    project = get_project()
+    with use_index(embeddings, project) as (generation, vectorstore, bm25):
+        if vectorstore is None:
+            return {"error": f"Error: FAISS index not found at {project.index_dir}. Please run 'Re-ingest Knowledge Base' first."}
         
-        Question: {{question}}
+        # Embed once: the same vector drives the answer cache and the similarity search
+        query_vector = gateway.embed_query(question)
         
-        Assistant:"""
+        # Follow-up questions depend on the conversation, so the history is part of the scope:
+        # they hit only for the same conversation so far (standalone questions share "")
+        conversation = text_hash(history.strip()) if history.strip() else ""
+        cache_key = (query_vector, (role, exp, filter_key(filters), conversation), generation)
+        with metrics.span("answer_cache"):
+            cached = answer_cache.lookup(*cache_key, namespace=project.name)
+        metrics.inc("devmate_cache_requests_total", help="Cache lookups by result", cache="answer", result="hit" if cached else "miss")
+        if cached:
+            return {"cached": cached}
         
-        PROMPT = PromptTemplate(
-            template=template_str,
-            input_variables=["context", "question"]
-        )
-        
-        # Create Chain
-        chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=retriever,
-            chain_type_kwargs={"prompt": PROMPT},
-            return_source_documents=True
-        )
-        
-        # Run Chain
-        # Now we only need to pass the query
-        result = chain.invoke({"query": question})
-        
-        # Extract Answer and Sources
-        answer = result['result']
-        source_docs = result.get('source_documents', [])
-        
-        # Format sources
-        sources = []
-        for doc in source_docs:
-            source_name = doc.metadata.get('source', 'Unknown')
-            # Only keep the filename, not the full path
-            source_name = os.path.basename(source_name)
-            sources.append(source_name)
+        # Dense + keyword retrieval fused, so exact identifiers and file names are found too
+        with metrics.span("retrieval"):
+            source_docs = hybrid_search(vectorstore, bm25, question, query_vector, k=3, filters=filters)
+    if filters and not source_docs:
+        return {"error": "No indexed documents match the selected search scope."}
+    
+    # "Stuff" the retrieved chunks into the prompt
+    with metrics.span("prompt") as span:
+        context = "\n\n".join(doc.page_content for doc in source_docs)
+        prompt_text = build_prompt(role, exp, history).format(context=context, question=question)
+        span["chars"] = len(prompt_text)
+    return {"prompt": prompt_text, "source_docs": source_docs, "cache_key": cache_key, "project": project.name}
+
+def ask_devmate(question, role, exp, history="", filters=None):
+    """
+    Main function to query the RAG system.
+    Args:
+        question: User's question
+        role: User's role
+        exp: User's experience
+        history: Formatted chat history string
+        filters: Optional search scope, e.g. {"origin": "repo", "repo": "devmate", "file_type": ["py"]}
+    """
+    with metrics.trace("chat", logger=log, streaming=False) as active:
+        try:
+            plan = prepare_answer(question, role, exp, history, filters)
+            if "error" in plan:
+                metrics.inc("devmate_chat_errors_total", help="Chat turns answered with an error", stage="prepare")
+                return {"answer": plan["error"], "sources": [], "trace": active}
+            if "cached" in plan:
+                return {"answer": plan["cached"]["answer"], "sources": plan["cached"]["sources"], "cached": True, "trace": active}
             
-        # Remove duplicates
-        sources = list(set(sources))
-        
-        return {"answer": answer, "sources": sources}
-        
-    except Exception as e:
-        return {"answer": f"Error: {str(e)}", "sources": []}
+            response = gateway.invoke(plan["prompt"])
+            answer = chunk_text(response)
+            sources = format_sources(plan["source_docs"])
+            if plan["cache_key"]:
+                answer_cache.store(*plan["cache_key"], answer, sources, namespace=plan["project"])
+            return {"answer": answer, "sources": sources, "trace": active}
+            
+        except Exception as e:
+            metrics.inc("devmate_chat_errors_total", help="Chat turns answered with an error", stage="exception")
+            log.exception("chat turn failed")
+            return {"answer": f"Error: {str(e)}", "sources": [], "trace": active}
+
+def ask_devmate_stream(question, role, exp, history="", filters=None):
+    """
+    Streaming variant of ask_devmate() built on the Converse streaming API.
+    Yields {"token": text} events as the model produces them, then one final
+    {"sources": [...], "cached": bool, "time_to_first_token": seconds, "total_time": seconds,
+    "trace": metrics.Trace} event.
+    Errors are yielded as a token so the chat shows them like a normal answer.
+    """
+    started = time.time()
+    first_token_at = None
+    sources = []
+    cached = False
+    with metrics.trace("chat", logger=log, streaming=True) as active:
+        try:
+            plan = prepare_answer(question, role, exp, history, filters)
+            if "error" in plan:
+                metrics.inc("devmate_chat_errors_total", help="Chat turns answered with an error", stage="prepare")
+                yield {"token": plan["error"]}
+            elif "cached" in plan:
+                cached = True
+                first_token_at = time.time()
+                sources = plan["cached"]["sources"]
+                yield {"token": plan["cached"]["answer"]}
+            else:
+                parts = []
+                usage = {}
+                llm_started = time.time()
+                for chunk in gateway.stream(plan["prompt"]):
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    text = chunk_text(chunk)
+                    if not text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        metrics.observe("devmate_llm_time_to_first_token_seconds", first_token_at - llm_started, help="Time from sending the prompt to the first streamed token")
+                        metrics.record_span("llm_first_token", llm_started, first_token_at - llm_started)
+                    parts.append(text)
+                    yield {"token": text}
+                metrics.record_span("llm_stream", llm_started, time.time() - llm_started, **usage)
+                sources = format_sources(plan["source_docs"])
+                if plan["cache_key"]:
+                    answer_cache.store(*plan["cache_key"], "".join(parts), sources, namespace=plan["project"])
+        except Exception as e:
+            metrics.inc("devmate_chat_errors_total", help="Chat turns answered with an error", stage="exception")
+            log.exception("chat turn failed")
+            yield {"token": f"Error: {str(e)}"}
+            sources = []
+        active.attributes["cached"] = cached
+
+    finished = time.time()
+    metrics.observe("devmate_chat_seconds", finished - started, help="Full chat turn latency", cached=str(cached).lower())
+    yield {
+        "sources": sources,
+        "cached": cached,
+        "time_to_first_token": (first_token_at or finished) - started,
+        "total_time": finished - started,
+        "trace": active,
+    }
 
 def generate_quiz():
     """
-    Generates a 3-question quiz based on the knowledge base.
+    Returns a 3-question quiz served from the precomputed quiz bank (see quiz_bank.py).
+    No LLM call happens here; [] means the bank is still being built.
     """
     try:
-        # Initialize components
-        embeddings = get_embeddings()
-        llm = get_llm()
-        
-        if not embeddings or not llm:
-            return None
-            
-        vectorstore = FAISS.load_local(FAISS_INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5}) # Get broad context
-        
-        # We need to retrieve some random/broad context to base the quiz on.
-        # Since we can't search for "everything", we'll search for key project terms.
-        # A simple hack: search for "overview features setup"
-        docs = retriever.invoke("project overview features setup")
-        context_text = "\n".join([doc.page_content for doc in docs])
-        
-        prompt_template = f"""
-        Human: based on the following context, generate a quiz with 3 multiple-choice questions.
-        Return the result correctly formatted in JSON with the keys: "question", "options" (list of 4 strings), and "answer" (the correct string).
-        Do not output any markdown code blocks or text, just the raw JSON list.
-        
-        Context:
-        {context_text}
-        
-        Assistant:"""
-        
-        # Direct generation
-        response = llm.invoke(prompt_template)
-        
-        # Parse JSON
-        import json
-        import re
-        
-        content = response.content.strip()
-        # Clean potential markdown
-        content = re.sub(r'```json', '', content)
-        content = re.sub(r'```', '', content)
-        
-        quiz_data = json.loads(content)
-        return quiz_data
-        
+        # quiz_bank builds on this module, so it is imported on first use
+        from quiz_bank import draw_quiz
+        return draw_quiz()
     except Exception as e:
-        print(f"Quiz Generation Error: {e}")
+        log.exception("quiz generation failed")
         return []
 
 def explain_code(code_snippet):
     """
-    Explains a code snippet line-by-line using the LLM.
+    Explains a code snippet line-by-line using the LLM, grounded in the indexed project code
+    and cached per code block (see code_explainer.py). Returns the whole explanation as markdown.
     """
     try:
-        llm = get_llm()
-        if not llm:
-            return "Error: LLM not initialized."
-            
-        prompt = f"""
-        Human: You are an expert senior developer. Please explain the following code snippet to a junior developer.
-        Break it down line-by-line or by logical blocks. Explain WHY it is done this way, not just WHAT it does.
-        
-        Code Snippet:
-        ```
-        {code_snippet}
-        ```
-        
-        Assistant:"""
-        
-        response = llm.invoke(prompt)
-        return response.content
+        # code_explainer builds on this module, so it is imported on first use
+        from code_explainer import explain_code_stream
+        parts = []
+        for event in explain_code_stream(code_snippet):
+            if event.get("block"):
+                parts.append(f"\n\n#### {event['block']}\n\n")
+            elif "token" in event:
+                parts.append(event["token"])
+        return "".join(parts).strip()
         
     except Exception as e:
         return f"Error explaining code: {str(e)}"
+
+def summarize_history(summary, transcript):
+    """
+    Folds new conversation turns into the running summary used by chat_history.
+    Only the previous summary and the newly evicted turns are sent, never the whole chat.
+    """
+    llm = get_llm()
+    if not llm:
+        return None
+        
+    prompt = f"""
+    Human: You maintain a short running summary of a developer onboarding chat.
+    Update the summary with the new messages. Keep facts, decisions, file names and open questions.
+    Reply with the updated summary only, in at most 120 words.
+    
+    Current summary:
+    {summary or "(empty)"}
+    
+    New messages:
+    {transcript}
+    
+    Assistant:"""
+    
+    response = gateway.invoke(prompt)
+    return chunk_text(response)
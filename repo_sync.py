@@ -0,0 +1,168 @@
+import os
+import stat
+import shutil
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# Every directory in here is a shallow clone managed by DevMate; its `origin` remote is the
+# registered source URL, so the clones themselves are the repo registry.
+# This is the default project's folder; every function takes another project's repos_dir.
+REPOS_DIR = os.path.join("data", "repos")
+
+def _on_rm_error(func, path, exc_info):
+    # Git marks object files read-only, which blocks deletion on Windows
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+def remove_tree(path):
+    if os.path.exists(path):
+        shutil.rmtree(path, onerror=_on_rm_error)
+
+def repo_name_from_url(repo_url):
+    return repo_url.rstrip("/").split("/")[-1].replace(".git", "")
+
+def _open_repo(path):
+    import git
+    try:
+        return git.Repo(path)
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        return None
+
+def _origin_url(repo):
+    try:
+        return repo.remotes.origin.url
+    except (AttributeError, IndexError):
+        return None
+
+def update_repo(repo):
+    """
+    Brings a registered clone to the tip of its branch with a depth-1 fetch.
+    The previous commit stays in the object store (the reflog keeps it), so the next
+    ingest can diff against it.
+    """
+    branch = "HEAD" if repo.head.is_detached else repo.active_branch.name
+    repo.git.fetch("--depth=1", "origin", branch)
+    repo.git.reset("--hard", "FETCH_HEAD")
+
+def sync_repo(repo_url, repos_dir=REPOS_DIR):
+    """
+    Registers `repo_url` with a shallow, single-branch clone the first time, and only
+    fetches the latest commit on later calls. Returns the repo name.
+    """
+    import git
+
+    repo_name = repo_name_from_url(repo_url)
+    clone_path = os.path.join(repos_dir, repo_name)
+    repo = _open_repo(clone_path)
+    if repo is not None and _origin_url(repo) == repo_url:
+        update_repo(repo)
+    else:
+        # Not a clone of this URL (or not a git repo at all): start over
+        remove_tree(clone_path)
+        git.Repo.clone_from(repo_url, clone_path, depth=1, single_branch=True)
+    return repo_name
+
+def registered_repos(repos_dir=REPOS_DIR):
+    """
+    Returns [(name, origin_url)] for every clone under repos_dir.
+    """
+    repos = []
+    if not os.path.isdir(repos_dir):
+        return repos
+    for name in sorted(os.listdir(repos_dir)):
+        repo = _open_repo(os.path.join(repos_dir, name))
+        if repo is not None:
+            repos.append((name, _origin_url(repo)))
+    return repos
+
+def sync_all(repos_dir=REPOS_DIR):
+    """
+    Fetches every registered repo. Returns the names that failed to update.
+    """
+    failed = []
+    for name, url in registered_repos(repos_dir):
+        try:
+            update_repo(_open_repo(os.path.join(repos_dir, name)))
+        except Exception as e:
+            log.warning(f"Could not update {name} from {url}: {e}")
+            failed.append(name)
+    return failed
+
+def repo_heads(repos_dir=REPOS_DIR):
+    """
+    Returns {name: HEAD commit SHA} for every clone under repos_dir.
+    """
+    heads = {}
+    for name, _ in registered_repos(repos_dir):
+        try:
+            heads[name] = _open_repo(os.path.join(repos_dir, name)).head.commit.hexsha
+        except ValueError:
+            # Empty repository
+            continue
+    return heads
+
+def changed_paths(name, old_commit, new_commit, repos_dir=REPOS_DIR):
+    """
+    Returns the set of repo-relative paths that differ between two commits, or None when the
+    old commit is no longer available locally (e.g. the repo was cloned again).
+    """
+    import git
+
+    repo = _open_repo(os.path.join(repos_dir, name))
+    if repo is None:
+        return None
+    try:
+        output = repo.git.diff("--name-only", "--no-renames", old_commit, new_commit)
+    except git.GitCommandError:
+        return None
+    return set(output.splitlines())
+
+def _repo_of(file_path, repos_dir):
+    parts = os.path.relpath(file_path, repos_dir).split(os.sep)
+    if len(parts) > 1 and parts[0] != "..":
+        return parts[0]
+    return None
+
+def indexed_heads(heads, indexed_commits, failed_paths, repos_dir=REPOS_DIR):
+    """
+    Returns the commits to record as indexed. A repo with a file that could not be read or
+    loaded keeps its previously indexed commit (or none), so the failed file stays in the
+    next `git diff` and is retried instead of being trusted from then on.
+    """
+    failed = {_repo_of(file_path, repos_dir) for file_path in failed_paths}
+    recorded = {}
+    for name, head in heads.items():
+        if name not in failed:
+            recorded[name] = head
+        elif indexed_commits.get(name):
+            recorded[name] = indexed_commits[name]
+    return recorded
+
+def trusted_repo_files(file_paths, indexed_commits, heads, repos_dir=REPOS_DIR):
+    """
+    Returns the files under repos_dir that git says are unchanged since the commit each repo
+    was last indexed at, so ingestion can carry them over without reading or hashing them.
+    Repos with local modifications, or whose last indexed commit is gone, get no shortcut.
+    """
+    by_repo = {}
+    for file_path in file_paths:
+        name = _repo_of(file_path, repos_dir)
+        if name is not None:
+            by_repo.setdefault(name, []).append(file_path)
+
+    trusted = set()
+    for name, head in heads.items():
+        old_commit = indexed_commits.get(name)
+        if not old_commit or name not in by_repo:
+            continue
+        root = os.path.join(repos_dir, name)
+        if _open_repo(root).is_dirty(untracked_files=True):
+            continue
+        changed = set() if old_commit == head else changed_paths(name, old_commit, head, repos_dir)
+        if changed is None:
+            continue
+        for file_path in by_repo[name]:
+            if os.path.relpath(file_path, root).replace(os.sep, "/") not in changed:
+                trusted.add(file_path)
+    return trusted
@@ -0,0 +1,81 @@
+import metrics
+
+# Standard reciprocal rank fusion constant; dampens the weight of the very top ranks
+RRF_K = 60
+# Candidates fetched from each retriever per requested result
+CANDIDATE_FACTOR = 4
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several ranked lists of IDs into {id: score} with score = sum(1 / (k + rank)).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+def hybrid_search(knowledge_base, bm25, query, query_vector, k=3, filters=None):
+    """
+    Returns the top k documents for `query` from dense (FAISS) and sparse (BM25) retrieval
+    fused with reciprocal rank fusion. Ties are broken by dense distance, then BM25 score,
+    which are already at hand, so fusion adds no extra lookups beyond fetching BM25-only hits.
+    Falls back to dense retrieval alone when no BM25 index is available.
+
+    `filters` ({field: value or [values]}, see kb_store.FILTER_FIELDS) scope both retrievers:
+    the matching chunks are looked up once and only those are searched, so out-of-scope
+    chunks cannot crowd the candidates out.
+    """
+    fetch_k = k * CANDIDATE_FACTOR
+    with metrics.span("scope_filter"):
+        selection = knowledge_base.select(filters)
+    labels, allowed_ids = selection if selection is not None else (None, None)
+    with metrics.span("ann_search") as span:
+        dense = knowledge_base.search_by_vector(query_vector, k=fetch_k, labels=labels)
+        span["hits"] = len(dense)
+    if bm25 is None:
+        return [doc for doc, _ in dense[:k]]
+
+    docs = {}
+    distances = {}
+    dense_ids = []
+    for doc, distance in dense:
+        chunk_id = doc.metadata.get("chunk_id")
+        if chunk_id is None:
+            # Index built before chunk IDs existed: nothing to fuse on
+            return [doc for doc, _ in dense[:k]]
+        docs[chunk_id] = doc
+        distances[chunk_id] = distance
+        dense_ids.append(chunk_id)
+
+    with metrics.span("bm25_search") as span:
+        sparse = bm25.search(query, k=fetch_k, allowed_ids=allowed_ids)
+        span["hits"] = len(sparse)
+    sparse_scores = dict(sparse)
+    fused = reciprocal_rank_fusion([dense_ids, [chunk_id for chunk_id, _ in sparse]])
+
+    ranked = sorted(
+        fused,
+        key=lambda chunk_id: (
+            -fused[chunk_id],
+            distances.get(chunk_id, float("inf")),
+            -sparse_scores.get(chunk_id, 0.0),
+        )
+    )
+
+    # One docstore read for all BM25-only hits
+    missing = [chunk_id for chunk_id in ranked if chunk_id not in docs]
+    if missing:
+        with metrics.span("fetch_documents"):
+            docs.update(knowledge_base.get_documents(missing))
+
+    results = []
+    for chunk_id in ranked:
+        doc = docs.get(chunk_id)
+        if doc is None:
+            # BM25 can briefly be ahead of the loaded FAISS index during a re-ingest
+            continue
+        results.append(doc)
+        if len(results) == k:
+            break
+    return results
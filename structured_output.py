@@ -0,0 +1,76 @@
+import re
+import json
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+def _loads_lenient(text):
+    """
+    json.loads that also accepts the trailing commas LLMs like to leave behind.
+    Returns None if the text still is not valid JSON.
+    """
+    for candidate in (text, _TRAILING_COMMA.sub(r"\1", text)):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+class JSONObjectStream:
+    """
+    Incremental parser that pulls complete JSON objects out of streamed LLM text.
+    Anything around them (prose, markdown fences, a list or wrapper object, a reply cut off
+    mid-object) is tolerated: every object is parsed on its own as soon as its closing brace
+    arrives, so one broken item never costs the rest of the reply.
+    Only innermost-complete objects are yielded by feed(): an object that contains other
+    objects is not repeated once its children have been yielded.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._starts = []
+        # Per open object: whether a child object was already yielded from it
+        self._has_child = []
+        self._in_string = False
+        self._escaped = False
+        self._position = 0
+
+    def feed(self, text):
+        """
+        Consumes the next piece of text and returns the objects it completed.
+        """
+        completed = []
+        for char in text:
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._starts:
+                self._in_string = True
+            elif char == "{":
+                self._starts.append(self._position)
+                self._has_child.append(False)
+            elif char == "}" and self._starts:
+                start = self._starts.pop()
+                has_child = self._has_child.pop()
+                if not has_child:
+                    value = _loads_lenient("".join(self._buffer[start:self._position + 1]))
+                    if isinstance(value, dict):
+                        completed.append(value)
+                        if self._has_child:
+                            self._has_child[-1] = True
+            self._position += 1
+        if not self._starts:
+            # Nothing open: text so far can never be part of a future object
+            self._buffer = []
+            self._position = 0
+        return completed
+
+def parse_json_objects(text):
+    """
+    Returns every complete JSON object found in `text` (see JSONObjectStream).
+    """
+    return JSONObjectStream().feed(text)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+import numpy as np
+
+from ann_index import build_index, reconstruct_all, sample_vectors
+
+def test_ivf_sampling_leaves_the_shared_index_untouched():
+    vectors = np.random.default_rng(0).random((2000, 8), dtype="float32")
+    labels = np.arange(2000, dtype="int64") * 3
+    index = build_index(labels, vectors, "ivf")
+    ivf = faiss.extract_index_ivf(index)
+
+    picked, sampled = sample_vectors(index, 50, seed=1)
+    assert len(picked) == 50 and list(picked) == sorted(picked)
+    np.testing.assert_allclose(sampled, vectors[picked // 3])
+    all_labels, all_vectors = reconstruct_all(index)
+    assert np.array_equal(all_labels, labels)
+    np.testing.assert_allclose(all_vectors, vectors)
+    # No direct map was attached to the index other threads search concurrently
+    assert ivf.direct_map.type == faiss.DirectMap.NoMap
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from answer_cache import SemanticAnswerCache
+
+SCOPE = ("Intern", "0-1 years", None, "")
+
+def test_similar_questions_hit_and_others_miss():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], SCOPE, "g1", "answer", ["a.md"], namespace="default")
+    hit = cache.lookup([0.99, 0.05], SCOPE, "g1", namespace="default")
+    assert hit["answer"] == "answer" and hit["sources"] == ["a.md"]
+    assert cache.lookup([0.0, 1.0], SCOPE, "g1", namespace="default") is None
+    # Another profile, conversation or project never sees the entry
+    assert cache.lookup([1.0, 0.0], ("Intern", "0-1 years", None, "digest"), "g1", namespace="default") is None
+    assert cache.lookup([1.0, 0.0], SCOPE, "g1", namespace="other") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+def test_a_new_generation_invalidates_its_namespace_only():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], SCOPE, "g1", "old", [], namespace="default")
+    cache.store([1.0, 0.0], SCOPE, "g1", "kept", [], namespace="other")
+    assert cache.lookup([1.0, 0.0], SCOPE, "g2", namespace="default") is None
+    assert cache.lookup([1.0, 0.0], SCOPE, "g1", namespace="other")["answer"] == "kept"
+    # Going back to an older generation does not resurrect its entries
+    assert cache.lookup([1.0, 0.0], SCOPE, "g1", namespace="default") is None
+
+def test_expired_and_least_recently_used_entries_are_dropped():
+    cache = SemanticAnswerCache(ttl=0, max_entries=2)
+    cache.store([1.0, 0.0], SCOPE, "g1", "expired", [], namespace="default")
+    assert cache.lookup([1.0, 0.0], SCOPE, "g1", namespace="default") is None
+    cache.ttl = 60
+    for i, vector in enumerate(np.eye(3)):
+        cache.store(vector, SCOPE, "g1", f"answer {i}", [], namespace="default")
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup(np.eye(3)[0], SCOPE, "g1", namespace="default") is None
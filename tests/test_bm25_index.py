@@ -0,0 +1,97 @@
+import os
+import sys
+import math
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bm25_index
+from bm25_index import BM25Index, tokenize, BM25_K1, BM25_B
+
+WORDS = ["parser", "token", "cache", "index", "query", "vector", "chunk", "stream", "retry", "socket"]
+
+def _corpus(count):
+    return {
+        f"chunk-{i}": " ".join(WORDS[(i * j) % len(WORDS)] for j in range(1, 2 + i % 7))
+        for i in range(count)
+    }
+
+def _exact(corpus, query, allowed=None):
+    # Plain BM25 over every document, for comparison
+    docs = {chunk_id: tokenize(text) for chunk_id, text in corpus.items()}
+    avg_length = sum(len(terms) for terms in docs.values()) / len(docs)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(term in terms for terms in docs.values())
+        if not df:
+            continue
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for chunk_id, terms in docs.items():
+            tf = terms.count(term)
+            if tf and (allowed is None or chunk_id in allowed):
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * len(terms) / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return scores
+
+def _build(path, corpus):
+    bm25 = BM25Index(path)
+    bm25.add(list(corpus), list(corpus.values()))
+    bm25.commit()
+    bm25.close()
+
+def _assert_same(hits, expected, k):
+    top = sorted(expected.items(), key=lambda item: item[1], reverse=True)[:k]
+    assert len(hits) == len(top)
+    for (_, score), (_, expected_score) in zip(hits, top):
+        assert math.isclose(score, expected_score, rel_tol=1e-9)
+
+def test_impact_ordered_search_matches_exact_bm25(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    corpus = _corpus(300)
+    _build(path, corpus)
+    reader = BM25Index(path, readonly=True)
+    try:
+        for query in ("parser cache", "vector socket retry", "stream"):
+            _assert_same(reader.search(query, k=10), _exact(corpus, query), 10)
+        # Small filters are looked up directly, broad ones walk the postings in impact order
+        for allowed in ({"chunk-1", "chunk-8", "chunk-15"}, {f"chunk-{i}" for i in range(0, 300, 2)}):
+            _assert_same(reader.search("parser cache", k=5, allowed_ids=allowed), _exact(corpus, "parser cache", allowed), 5)
+    finally:
+        reader.close()
+
+def test_search_reads_at_most_the_term_depth(tmp_path, monkeypatch):
+    path = str(tmp_path / "bm25.sqlite")
+    _build(path, {f"chunk-{i}": "token " * (1 + i % 5) for i in range(50)})
+    monkeypatch.setattr(bm25_index, "BM25_TERM_DEPTH", 10)
+    reader = BM25Index(path, readonly=True)
+    try:
+        hits = reader.search("token", k=50)
+        assert len(hits) == 10
+        # The shortest chunks with the most occurrences rank first
+        assert hits[0][0] == "chunk-4"
+    finally:
+        reader.close()
+
+def test_indexes_without_impacts_are_searched_and_upgraded(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    corpus = _corpus(40)
+    _build(path, corpus)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        DROP INDEX postings_impact;
+        ALTER TABLE postings DROP COLUMN impact;
+        CREATE INDEX postings_term ON postings (term);
+    """)
+    conn.close()
+
+    reader = BM25Index(path, readonly=True)
+    _assert_same(reader.search("index query", k=5), _exact(corpus, "index query"), 5)
+    reader.close()
+
+    writer = BM25Index(path)
+    writer.commit()
+    writer.close()
+    reader = BM25Index(path, readonly=True)
+    assert reader._impacts
+    _assert_same(reader.search("index query", k=5), _exact(corpus, "index query"), 5)
+    reader.close()
@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import ingest_docs
+from ignore_rules import MINIFIED_MAX_LINE, scan_files
+
+# Prose with one unwrapped paragraph per line, as exported by many editors
+PARAGRAPH = "Onboarding starts with the architecture overview and the service map. " * 35
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+def test_unwrapped_prose_upload_is_kept(tmp_path):
+    assert len(PARAGRAPH) > MINIFIED_MAX_LINE
+    for name in ("notes.txt", "guide.md"):
+        _write(os.path.join(tmp_path, "docs", name), "\n\n".join([PARAGRAPH] * 3))
+
+    file_paths, rules = scan_files(str(tmp_path), ingest_docs.is_supported)
+
+    assert sorted(os.path.basename(path) for path in file_paths) == ["guide.md", "notes.txt"]
+    assert rules.skipped == []
+
+def test_minified_code_and_repo_files_are_skipped(tmp_path):
+    minified = "var a=1;" * 400
+    _write(os.path.join(tmp_path, "docs", "app.js"), minified)
+    _write(os.path.join(tmp_path, "repos", "web", "README.md"), minified)
+
+    file_paths, rules = scan_files(str(tmp_path), ingest_docs.is_supported)
+
+    assert file_paths == []
+    assert {entry["reason"] for entry in rules.skipped} == {"minified or generated content"}
+
+def test_unwrapped_prose_document_is_ingested(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ingest_docs, "get_embeddings", lambda: DeterministicFakeEmbedding(size=32))
+    _write(os.path.join("data", "docs", "handbook.txt"), "\n\n".join([PARAGRAPH] * 3))
+
+    ingest_docs.ingest_docs()
+
+    from kb_store import KnowledgeBase, current_generation, generation_dir
+    index_dir = generation_dir(ingest_docs.FAISS_INDEX_DIR, current_generation(ingest_docs.FAISS_INDEX_DIR))
+    knowledge_base = KnowledgeBase(index_dir)
+    try:
+        assert knowledge_base.ntotal > 0
+        assert knowledge_base.facets()["file_type"] == ["txt"]
+    finally:
+        knowledge_base.close()
@@ -0,0 +1,91 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest_docs import file_hash, iter_changed_chunks
+
+def _chunks(path, old_files):
+    new_files, stale_ids, retained = {}, [], []
+    changed = [(path, file_hash(path))]
+    added = list(iter_changed_chunks(changed, old_files, new_files, stale_ids, os.path.dirname(path), retained=retained))
+    return added, retained, new_files, stale_ids
+
+def test_moved_code_chunks_are_kept_with_their_new_line_range(tmp_path):
+    path = tmp_path / "tool.py"
+    # Each function is big enough to become a chunk of its own
+    body = "".join(f"    total += {n}\n" for n in range(80))
+    path.write_text(f"def first():\n    total = 0\n{body}    return total\n\n\ndef second():\n    total = 1\n{body}    return total\n", encoding="utf-8")
+    added, retained, new_files, _ = _chunks(str(path), {})
+    assert not retained
+    lines = {chunk.metadata["symbol"]: chunk.metadata["start_line"] for chunk, _ in added}
+
+    # Lines inserted above shift both functions without changing their text
+    path.write_text("import os\n\n\n" + path.read_text(encoding="utf-8"), encoding="utf-8")
+    added, retained, _, _ = _chunks(str(path), new_files)
+    # The import is packed with first(), so only second() keeps its ID and vector
+    assert [chunk.metadata["symbol"] for chunk, _ in retained] == ["second"]
+    chunk, chunk_id = retained[0]
+    assert chunk.metadata["start_line"] == lines["second"] + 3
+    assert chunk.metadata["chunk_id"] == chunk_id
+    assert "second" not in [chunk.metadata["symbol"] for chunk, _ in added]
+
+def _project(tmp_path, monkeypatch):
+    from projects import Project
+    project = Project("default")
+    monkeypatch.setattr(project, "data_dir", str(tmp_path / "data"))
+    monkeypatch.setattr(project, "docs_dir", str(tmp_path / "data" / "docs"))
+    monkeypatch.setattr(project, "repos_dir", str(tmp_path / "data" / "repos"))
+    monkeypatch.setattr(project, "index_dir", str(tmp_path / "index"))
+    os.makedirs(project.docs_dir)
+    return project
+
+class _CountingEmbeddings:
+    def __init__(self):
+        from benchmarks.fakes import HashEmbeddings
+        self._embeddings = HashEmbeddings(dim=16)
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return self._embeddings.embed_documents(texts)
+
+def test_the_manifest_limits_reingestion_to_changed_files(tmp_path, monkeypatch):
+    import ingest_docs
+    from kb_store import KnowledgeBase, current_generation, generation_dir
+
+    monkeypatch.setattr(ingest_docs, "LOAD_WORKERS", 1)
+    project = _project(tmp_path, monkeypatch)
+    for name in ("alpha", "beta", "gamma"):
+        with open(os.path.join(project.docs_dir, f"{name}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# {name}\n\nNotes about {name} and nothing else.\n")
+
+    def ingest():
+        embeddings = _CountingEmbeddings()
+        message = ingest_docs._ingest_locked(project, embeddings, lambda fraction, message: message)
+        return embeddings.texts, message
+
+    texts, _ = ingest()
+    assert len(texts) == 3
+    first = current_generation(project.index_dir)
+
+    # Nothing changed: no embedding and no new generation
+    texts, message = ingest()
+    assert texts == [] and message == "Index is up to date."
+    assert current_generation(project.index_dir) == first
+
+    # One edit and one deletion: only the edited file is embedded again
+    with open(os.path.join(project.docs_dir, "beta.md"), "w", encoding="utf-8") as f:
+        f.write("# beta\n\nRewritten notes about beta.\n")
+    os.remove(os.path.join(project.docs_dir, "gamma.md"))
+    texts, _ = ingest()
+    assert texts == ["# beta\n\nRewritten notes about beta."]
+
+    live_dir = generation_dir(project.index_dir, current_generation(project.index_dir))
+    manifest = ingest_docs.load_manifest(live_dir)
+    assert sorted(os.path.basename(path) for path in manifest["files"]) == ["alpha.md", "beta.md"]
+    knowledge_base = KnowledgeBase(live_dir)
+    try:
+        assert knowledge_base.ntotal == knowledge_base.doc_count() == 2
+    finally:
+        knowledge_base.close()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest_jobs import JobQueue, QUEUED, RUNNING, DONE
+
+def test_identical_queued_jobs_are_submitted_once(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    first = queue.submit("ingest", {"project": "default"})
+    assert queue.submit("ingest", {"project": "default"}) == first
+    # Another kind or project is a different job
+    assert queue.submit("ingest", {"project": "payments"}) != first
+    assert queue.submit("sync", {"project": "default"}) != first
+    assert len(queue.pending()) == 3
+
+def test_a_running_job_does_not_absorb_new_submissions(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    first = queue.submit("ingest")
+    job = queue.claim()
+    assert job["id"] == first and job["status"] == RUNNING
+    # Files may have changed since the running job scanned them, so a new run is queued
+    second = queue.submit("ingest")
+    assert second != first
+    assert queue.get(second)["status"] == QUEUED
+    queue.finish(first, DONE, "ok")
+    assert queue.get(first)["progress"] == 1
+    assert queue.submit("ingest") == second
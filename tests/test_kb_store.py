@@ -0,0 +1,135 @@
+import os
+import sys
+import shutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import ann_index
+from bm25_index import BM25Index
+from ann_index import describe
+from kb_store import (
+    IndexWriter, KnowledgeBase, current_generation, generation_dir, new_generation, publish_generation,
+    published_generations,
+)
+
+DIM = 8
+
+def _fill(directory, count, seed=0):
+    vectors = np.random.default_rng(seed).random((count, DIM), dtype="float32")
+    writer = IndexWriter(directory)
+    ids = [f"chunk-{i}" for i in range(count)]
+    writer.add(ids, [f"text {i}" for i in range(count)], [{"source": f"{i}.md"} for i in range(count)], vectors)
+    writer.finalize()
+    writer.save()
+    writer.close()
+    return ids, vectors
+
+def test_hnsw_deletes_are_tombstoned_until_the_ratio_is_passed(tmp_path, monkeypatch):
+    monkeypatch.setattr(ann_index, "FLAT_MAX", 100)
+    monkeypatch.setattr(ann_index, "TOMBSTONE_MAX_RATIO", 0.2)
+    directory = str(tmp_path)
+    ids, vectors = _fill(directory, 1500)
+
+    # A small edit keeps the graph: no rebuild, the deleted labels become tombstones
+    writer = IndexWriter(directory)
+    graph = writer.index
+    writer.delete(ids[:10])
+    writer.finalize()
+    assert writer.index is graph
+    assert describe(writer.index)[0] == "hnsw"
+    assert len(writer.tombstones()) == 10
+    assert writer.ntotal == 1490
+    writer.save()
+    writer.close()
+
+    knowledge_base = KnowledgeBase(directory)
+    try:
+        assert knowledge_base.ntotal == 1490
+        # The nearest neighbour of a deleted vector is never the deleted chunk itself
+        hits = knowledge_base.search_by_vector(vectors[0], k=5)
+        assert len(hits) == 5
+        assert all(doc.page_content != "text 0" for doc, _ in hits)
+    finally:
+        knowledge_base.close()
+
+    # Past the ratio the graph is rebuilt without the tombstones
+    writer = IndexWriter(directory)
+    writer.delete(ids[10:400])
+    writer.finalize()
+    assert describe(writer.index)[0] == "hnsw"
+    assert writer.tombstones() == []
+    assert writer.index.ntotal == writer.ntotal == 1100
+    writer.close()
+
+def _publish(root, text):
+    generation, work_dir = new_generation(root)
+    writer = IndexWriter(work_dir)
+    writer.add(["chunk"], [text], [{"source": "a.md"}], np.ones((1, DIM), dtype="float32"))
+    writer.finalize()
+    writer.save()
+    writer.close()
+    publish_generation(root, generation, work_dir)
+    return generation
+
+def test_pruning_follows_publish_order_not_mtimes(tmp_path):
+    root = str(tmp_path)
+    first = _publish(root, "one")
+    second = _publish(root, "two")
+    # Readers touching the older generation must not make it look newer
+    later = os.stat(generation_dir(root, second)).st_mtime + 100
+    os.utime(generation_dir(root, first), (later, later))
+    third = _publish(root, "three")
+
+    assert current_generation(root) == third
+    assert published_generations(root)[-2:] == [second, third]
+    assert sorted(os.listdir(os.path.join(root, "generations"))) == sorted([second, third])
+
+def test_reader_retries_when_its_generation_is_pruned(tmp_path, monkeypatch):
+    import rag
+    from projects import Project
+    project = Project("default")
+    monkeypatch.setattr(project, "index_dir", str(tmp_path))
+    stale = _publish(str(tmp_path), "old")
+    live = _publish(str(tmp_path), "new")
+    shutil.rmtree(generation_dir(str(tmp_path), stale))
+
+    # The first read of CURRENT returns the generation that was pruned right after
+    reads = iter([stale])
+    real = rag.get_index_generation
+    monkeypatch.setattr(rag, "get_index_generation", lambda p=None: next(reads, None) or real(p))
+    monkeypatch.setattr(rag, "_resident", rag.OrderedDict())
+    with rag.use_index(None, project) as (generation, knowledge_base, _):
+        assert generation == live
+        assert knowledge_base.get("chunk").page_content == "new"
+
+def test_readers_leave_published_generations_untouched(tmp_path):
+    root = str(tmp_path)
+    generation, work_dir = new_generation(root)
+    writer = IndexWriter(work_dir)
+    writer.add(["chunk"], ["alpha beta"], [{"source": "a.md", "origin": "docs"}], np.ones((1, DIM), dtype="float32"))
+    writer.finalize()
+    writer.save()
+    writer.close()
+    bm25 = BM25Index(os.path.join(work_dir, "bm25.sqlite"))
+    bm25.add(["chunk"], ["alpha beta"])
+    bm25.commit()
+    bm25.close()
+    publish_generation(root, generation, work_dir)
+    directory = generation_dir(root, generation)
+    # Writers use a rollback journal, so nothing but the data files is published
+    before = {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+    assert not [name for name in before if name.endswith(("-wal", "-shm", "-journal"))]
+
+    knowledge_base = KnowledgeBase(directory)
+    reader = BM25Index(os.path.join(directory, "bm25.sqlite"), readonly=True)
+    try:
+        assert knowledge_base.ntotal == 1
+        assert knowledge_base.facets()["origin"] == ["docs"]
+        assert [chunk_id for chunk_id, _ in reader.search("alpha")] == ["chunk"]
+        after = {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+        assert after == before
+    finally:
+        knowledge_base.close()
+        reader.close()
@@ -0,0 +1,66 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import rag
+from kb_store import IndexWriter, KnowledgeBase, new_generation, publish_generation
+from projects import Project
+
+def _publish(root, repo):
+    generation, work_dir = new_generation(root)
+    writer = IndexWriter(work_dir)
+    writer.add(["chunk"], ["text"], [{"source": "a.py", "origin": "repo", "repo": repo}], np.ones((1, 4), dtype="float32"))
+    writer.finalize()
+    writer.save()
+    writer.close()
+    publish_generation(root, generation, work_dir)
+
+def test_facets_are_read_once_per_generation(tmp_path, monkeypatch):
+    project = Project("default")
+    monkeypatch.setattr(project, "index_dir", str(tmp_path))
+    monkeypatch.setattr(rag, "_resident", rag.OrderedDict())
+    monkeypatch.setattr(rag, "_facets", {})
+    monkeypatch.setattr(rag, "get_embeddings", lambda: None)
+    reads = []
+    real = KnowledgeBase.facets
+    monkeypatch.setattr(KnowledgeBase, "facets", lambda self: reads.append(1) or real(self))
+
+    assert rag.get_facets(project) == {}
+    _publish(str(tmp_path), "alpha")
+    assert rag.get_facets(project)["repo"] == ["alpha"]
+    assert rag.get_facets(project)["repo"] == ["alpha"]
+    assert len(reads) == 1
+
+    # A new generation invalidates the cached facets
+    _publish(str(tmp_path), "beta")
+    assert rag.get_facets(project)["repo"] == ["beta"]
+    assert len(reads) == 2
+
+def test_follow_up_questions_hit_the_answer_cache_for_the_same_conversation(tmp_path, monkeypatch):
+    from answer_cache import SemanticAnswerCache
+    from langchain_core.documents import Document
+
+    project = Project("default")
+    monkeypatch.setattr(project, "index_dir", str(tmp_path))
+    _publish(str(tmp_path), "alpha")
+    cache = SemanticAnswerCache()
+    monkeypatch.setattr(rag, "answer_cache", cache)
+    monkeypatch.setattr(rag, "_resident", rag.OrderedDict())
+    monkeypatch.setattr(rag, "get_project", lambda project_=None: project)
+    monkeypatch.setattr(rag, "get_embeddings", lambda: object())
+    monkeypatch.setattr(rag, "get_llm", lambda: object())
+    monkeypatch.setattr(rag.gateway, "embed_query", lambda question: [1.0, 0.0, 0.0, 0.0])
+    monkeypatch.setattr(rag, "hybrid_search", lambda *args, **kwargs: [Document(page_content="text", metadata={"source": "a.py"})])
+
+    history = "User: How do I run the tests?\nDevMate: Use pytest."
+    plan = rag.prepare_answer("And only one file?", "Intern", "0-1 years", history)
+    assert "prompt" in plan
+    cache.store(*plan["cache_key"], "pytest path/to/test.py", ["a.py"], namespace=plan["project"])
+
+    assert rag.prepare_answer("And only one file?", "Intern", "0-1 years", history)["cached"]["answer"] == "pytest path/to/test.py"
+    # The same words after a different conversation mean something else
+    assert "prompt" in rag.prepare_answer("And only one file?", "Intern", "0-1 years", "User: How do I deploy?")
+    assert "prompt" in rag.prepare_answer("And only one file?", "Intern", "0-1 years")
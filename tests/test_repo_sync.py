@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import git
+
+from repo_sync import indexed_heads, repo_heads, trusted_repo_files
+
+def _commit(repo, files):
+    for name, text in files.items():
+        with open(os.path.join(repo.working_tree_dir, name), "w", encoding="utf-8") as f:
+            f.write(text)
+    repo.index.add(list(files))
+    return repo.index.commit("update", author=git.Actor("t", "t@example.com")).hexsha
+
+def test_a_repo_with_a_failed_file_keeps_its_indexed_commit(tmp_path):
+    repos_dir = str(tmp_path)
+    repo = git.Repo.init(os.path.join(repos_dir, "demo"))
+    first = _commit(repo, {"ok.py": "a = 1\n", "broken.py": "b = 1\n"})
+    files = [os.path.join(repos_dir, "demo", name) for name in ("ok.py", "broken.py")]
+    second = _commit(repo, {"ok.py": "a = 2\n", "broken.py": "b = 2\n"})
+    heads = repo_heads(repos_dir)
+    assert heads == {"demo": second}
+
+    # broken.py changed but could not be loaded: the recorded commit does not move
+    recorded = indexed_heads(heads, {"demo": first}, [files[1]], repos_dir)
+    assert recorded == {"demo": first}
+    # ...so the next ingest still sees it as changed and retries it
+    assert files[1] not in trusted_repo_files(files, recorded, heads, repos_dir)
+
+    # Once everything loads, the repo advances and both files are trusted
+    recorded = indexed_heads(heads, recorded, [], repos_dir)
+    assert recorded == {"demo": second}
+    assert trusted_repo_files(files, recorded, heads, repos_dir) == set(files)
+
+def test_a_new_repo_with_a_failed_file_records_no_commit(tmp_path):
+    repos_dir = str(tmp_path)
+    failed = [os.path.join(repos_dir, "demo", "broken.py")]
+    assert indexed_heads({"demo": "abc", "other": "def"}, {}, failed, repos_dir) == {"other": "def"}
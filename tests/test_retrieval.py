@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from retrieval import hybrid_search, reciprocal_rank_fusion
+
+def _doc(chunk_id):
+    return Document(page_content=chunk_id, metadata={"chunk_id": chunk_id})
+
+class _KnowledgeBase:
+    def __init__(self, dense, selection=None):
+        self.dense = dense
+        self.selection = selection
+        self.fetched = []
+
+    def select(self, filters):
+        return self.selection if filters else None
+
+    def search_by_vector(self, vector, k=4, labels=None):
+        return [(_doc(chunk_id), distance) for chunk_id, distance in self.dense[:k]]
+
+    def get_documents(self, chunk_ids):
+        self.fetched.append(list(chunk_ids))
+        return {chunk_id: _doc(chunk_id) for chunk_id in chunk_ids if chunk_id != "gone"}
+
+class _BM25:
+    def __init__(self, sparse):
+        self.sparse = sparse
+        self.allowed = None
+
+    def search(self, query, k=10, allowed_ids=None):
+        self.allowed = allowed_ids
+        return self.sparse[:k]
+
+def test_rrf_rewards_ids_ranked_by_both_retrievers():
+    scores = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    assert scores["a"] == 1 / 61 + 1 / 62
+    assert scores["c"] == 1 / 63 + 1 / 61
+    assert scores["b"] == 1 / 62
+    assert sorted(scores, key=scores.get, reverse=True) == ["a", "c", "b"]
+
+def test_hybrid_search_fuses_dense_and_keyword_hits():
+    knowledge_base = _KnowledgeBase([("dense-only", 0.1), ("both", 0.2)])
+    bm25 = _BM25([("both", 5.0), ("keyword-only", 4.0), ("gone", 3.0)])
+    docs = hybrid_search(knowledge_base, bm25, "query", [0.0], k=3)
+    assert [doc.page_content for doc in docs] == ["both", "dense-only", "keyword-only"]
+    # Keyword-only hits are read from the docstore in one go; vanished ones are skipped
+    assert knowledge_base.fetched == [["keyword-only", "gone"]]
+
+def test_hybrid_search_scopes_both_retrievers_and_falls_back_to_dense():
+    knowledge_base = _KnowledgeBase([("a", 0.1), ("b", 0.2)], selection=([1, 2], frozenset({"a", "b"})))
+    bm25 = _BM25([("b", 2.0)])
+    hybrid_search(knowledge_base, bm25, "query", [0.0], k=2, filters={"repo": "demo"})
+    assert bm25.allowed == frozenset({"a", "b"})
+    assert [doc.page_content for doc in hybrid_search(knowledge_base, None, "query", [0.0], k=1)] == ["a"]
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_output import JSONObjectStream, parse_json_objects
+
+REPLY = 'Here you go:\n```json\n[{"q": "What is {x}?", "options": ["a", "b",],}, {"q": "Broken", "options": [}, {"q": "Last"}]\n```'
+
+def test_objects_are_parsed_across_arbitrary_chunk_boundaries():
+    for size in (1, 3, 7, len(REPLY)):
+        stream = JSONObjectStream()
+        objects = []
+        for start in range(0, len(REPLY), size):
+            objects.extend(stream.feed(REPLY[start:start + size]))
+        # Braces inside strings are ignored, trailing commas tolerated, the broken item skipped
+        assert objects == [{"q": "What is {x}?", "options": ["a", "b"]}, {"q": "Last"}]
+
+def test_wrappers_are_not_repeated_and_cut_off_objects_are_dropped():
+    assert parse_json_objects('{"questions": [{"q": 1}, {"q": 2}]}') == [{"q": 1}, {"q": 2}]
+    assert parse_json_objects('{"q": "escaped \\" quote"} {"q": "cut') == [{"q": 'escaped " quote'}]
+    assert parse_json_objects("no json here") == []
@@ -0,0 +1,225 @@
+import io
+import os
+import re
+import wave
+import tempfile
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from embedding_cache import CACHE_DIR, text_hash
+import metrics
+
+log = metrics.get_logger(__name__)
+
+TTS_CACHE_DIR = os.path.join(CACHE_DIR, "tts")
+# "gtts" (Google TTS, needs network) or "pyttsx3" (local system voices, works offline)
+TTS_ENGINE = os.getenv("DEVMATE_TTS_ENGINE", "gtts").lower()
+TTS_LANG = os.getenv("DEVMATE_TTS_LANG", "en")
+# Sentences are grouped into segments of about this size; the first one plays while the rest are synthesized
+TTS_SEGMENT_CHARS = 300
+# Segments synthesized at once
+TTS_WORKERS = int(os.getenv("DEVMATE_TTS_WORKERS", "3"))
+# Oldest audio files are deleted beyond this size
+TTS_CACHE_MAX_BYTES = int(os.getenv("DEVMATE_TTS_CACHE_MAX_MB", "200")) * 1024 * 1024
+PRUNE_EVERY = 50
+
+_CODE_BLOCK = re.compile(r"```.*?(```|$)", re.DOTALL)
+_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+# Emphasis markers vanish; underscores inside identifiers are kept
+_EMPHASIS = re.compile(r"[`*]+|(?<!\w)_+|_+(?!\w)")
+_MARKUP = re.compile(r"[#>|]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+|\n+")
+
+def speakable_text(markdown):
+    """
+    Strips what should not be read aloud: code blocks, link targets and markdown symbols.
+    """
+    text = _CODE_BLOCK.sub(" (code omitted) ", markdown)
+    text = _LINK.sub(r"\1", text)
+    text = _EMPHASIS.sub("", text)
+    text = _MARKUP.sub(" ", text)
+    return re.sub(r"[ \t]+", " ", text).strip()
+
+def split_segments(text, max_chars=TTS_SEGMENT_CHARS):
+    """
+    Splits text into sentence-aligned segments of up to max_chars (a single longer sentence
+    stays whole). The first segment is kept to one sentence so playback starts sooner.
+    """
+    sentences = [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+    segments = []
+    for sentence in sentences:
+        if len(segments) > 1 and len(segments[-1]) + len(sentence) + 1 <= max_chars:
+            segments[-1] += " " + sentence
+        else:
+            segments.append(sentence)
+    return segments
+
+# --- Engines: text -> (audio bytes, MIME format) ---
+
+def _gtts(text):
+    from gtts import gTTS
+    buffer = io.BytesIO()
+    gTTS(text=text, lang=TTS_LANG).write_to_fp(buffer)
+    return buffer.getvalue(), "audio/mp3"
+
+# pyttsx3 drives one system speech engine, which is not thread-safe
+_pyttsx3_lock = threading.Lock()
+
+def _pyttsx3(text):
+    try:
+        import pyttsx3
+    except ImportError:
+        raise RuntimeError("DEVMATE_TTS_ENGINE=pyttsx3 needs the pyttsx3 package (and espeak on Linux).")
+    with _pyttsx3_lock:
+        engine = pyttsx3.init()
+        handle, path = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+        try:
+            engine.save_to_file(text, path)
+            engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read(), "audio/wav"
+        finally:
+            os.remove(path)
+
+ENGINES = {"gtts": (_gtts, "mp3"), "pyttsx3": (_pyttsx3, "wav")}
+
+def join_audio(parts, format):
+    """
+    Concatenates segments into one clip. MP3 frames can simply be appended; WAV needs one header.
+    """
+    if format != "audio/wav":
+        return b"".join(parts)
+    output = io.BytesIO()
+    with wave.open(output, "wb") as out:
+        for i, part in enumerate(parts):
+            with wave.open(io.BytesIO(part), "rb") as segment:
+                if i == 0:
+                    out.setparams(segment.getparams())
+                out.writeframes(segment.readframes(segment.getnframes()))
+    return output.getvalue()
+
+class SpeechSynthesizer:
+    """
+    Text-to-speech off the chat's critical path. Answers are split into sentence segments that
+    are synthesized concurrently in background threads, and every segment is cached on disk by
+    the hash of (engine, language, text), so replaying an answer (or a sentence another
+    answer already contained) needs no synthesis at all.
+    """
+
+    def __init__(self, engine=TTS_ENGINE, cache_dir=TTS_CACHE_DIR, workers=TTS_WORKERS):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown TTS engine {engine!r}; use one of {', '.join(ENGINES)}")
+        if engine == "pyttsx3" and importlib.util.find_spec("pyttsx3") is None:
+            # Optional dependency: keep answers speakable (online) rather than failing every request
+            log.warning("DEVMATE_TTS_ENGINE=pyttsx3 but pyttsx3 is not installed; falling back to gtts.")
+            engine = "gtts"
+        self.engine = engine
+        self._synthesize, self._extension = ENGINES[engine]
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="devmate-tts")
+        self._lock = threading.Lock()
+        # Segments being synthesized, so concurrent requests for the same audio share one call
+        self._inflight = {}
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, segment):
+        return os.path.join(self.cache_dir, f"{text_hash(f'{self.engine}:{TTS_LANG}:{segment}')}.{self._extension}")
+
+    def _format(self):
+        return "audio/wav" if self._extension == "wav" else "audio/mp3"
+
+    def _render(self, segment, path):
+        try:
+            with metrics.span("tts_segment", engine=self.engine, chars=len(segment)):
+                audio, _ = self._synthesize(segment)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % PRUNE_EVERY == 0
+            if prune:
+                self.prune()
+            return audio
+        finally:
+            with self._lock:
+                self._inflight.pop(path, None)
+
+    def segment(self, segment):
+        """
+        Returns a Future with the audio bytes of one segment; already done if it is cached.
+        """
+        path = self._path(segment)
+        with self._lock:
+            future = self._inflight.get(path)
+            if future is not None:
+                return future
+            if os.path.exists(path):
+                self.hits += 1
+                future = Future()
+                try:
+                    with open(path, "rb") as f:
+                        future.set_result(f.read())
+                    # Touch for the size-bounded eviction
+                    os.utime(path)
+                    return future
+                except OSError:
+                    pass
+            self.misses += 1
+            future = self._executor.submit(self._render, segment, path)
+            self._inflight[path] = future
+            return future
+
+    def speak(self, markdown):
+        """
+        Starts synthesizing an answer and returns (format, [Future of audio bytes per segment])
+        without waiting. Segments are queued in reading order, so the first finishes first.
+        """
+        return self._format(), [self.segment(segment) for segment in split_segments(speakable_text(markdown))]
+
+    def prune(self, max_bytes=TTS_CACHE_MAX_BYTES):
+        """
+        Deletes the least recently used audio files until the cache fits in max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "in_flight": len(self._inflight)}
+
+_synthesizer = None
+_synthesizer_lock = threading.Lock()
+
+def get_synthesizer():
+    """
+    Returns the process-wide synthesizer for DEVMATE_TTS_ENGINE.
+    """
+    global _synthesizer
+    if _synthesizer is None:
+        with _synthesizer_lock:
+            if _synthesizer is None:
+                _synthesizer = SpeechSynthesizer()
+                metrics.register_stats("tts_cache", _synthesizer.stats)
+    return _synthesizer